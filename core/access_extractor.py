@@ -0,0 +1,265 @@
+# core/access_extractor.py
+"""
+Извлечение таблиц Access (.mdb/.accdb): через ODBC (AccessSession) или без драйвера через
+утилиты mdbtools (MdbToolsSession/MdbToolsExtractor). Строки читаются потоково и отдаются пакетами
+фиксированного размера.
+"""
+import csv
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Размер пакета строк при потоковом чтении таблицы
+ACCESS_BATCH_SIZE = 5000
+
+# Формат даты/времени, совпадающий с форматом выгрузок boxbase (DD.MM.YYYY)
+MDB_DATETIME_FORMAT = '%d.%m.%Y %H:%M:%S'
+
+# Кодировка текстовых полей старых баз Jet3 (Access 97) с кириллицей
+MDB_JET3_CHARSET = 'cp1251'
+
+# Драйверы ODBC, которые пробуются после найденных в системе
+DEFAULT_ACCESS_DRIVERS = [
+    '{Microsoft Access Driver (*.mdb, *.accdb)}',
+    '{Microsoft Access Driver (*.mdb)}',
+    '{Microsoft Access (*.mdb)}'
+]
+
+# Кэш рабочих драйверов на время процесса: расширение файла -> драйвер
+_DRIVER_CACHE: Dict[str, str] = {}
+
+# Access хранит время без даты как 30.12.1899 ЧЧ:ММ:СС, дату без времени - с 00:00:00
+_TIME_ONLY_PATTERN = re.compile(r'^30\.12\.1899 (\d{2}:\d{2}:\d{2})$')
+_DATE_ONLY_PATTERN = re.compile(r'^(\d{2}\.\d{2}\.\d{4}) 00:00:00$')
+
+
+class MdbToolsExtractor:
+    """Потоковое чтение таблиц Access через mdbtools (без ODBC и Windows)"""
+
+    def __init__(self, batch_size: int = ACCESS_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    @staticmethod
+    def is_available() -> bool:
+        """Проверка наличия утилит mdbtools в PATH"""
+        return shutil.which('mdb-tables') is not None and shutil.which('mdb-export') is not None
+
+    @staticmethod
+    def _environment() -> dict:
+        env = os.environ.copy()
+        env.setdefault('MDB_JET3_CHARSET', MDB_JET3_CHARSET)
+        return env
+
+    def list_tables(self, access_file_path: str) -> List[str]:
+        """Список пользовательских таблиц базы"""
+        if not os.path.exists(access_file_path):
+            raise FileNotFoundError(f"Access файл не найден: {access_file_path}")
+
+        result = subprocess.run(
+            ['mdb-tables', '-1', access_file_path],
+            capture_output=True, text=True, encoding='utf-8', env=self._environment(), check=True
+        )
+        return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+    @staticmethod
+    def _normalize_value(value: str) -> Optional[str]:
+        """Пустые поля -> None, служебные даты Access -> дата или время по отдельности"""
+        if value == '':
+            return None
+        match = _TIME_ONLY_PATTERN.match(value)
+        if match:
+            return match.group(1)
+        match = _DATE_ONLY_PATTERN.match(value)
+        if match:
+            return match.group(1)
+        return value
+
+    def iter_rows(self, access_file_path: str, table_name: str) -> Iterator[Tuple[List[str], List[tuple]]]:
+        """Потоковое чтение таблицы пакетами: (заголовок, список строк)"""
+        process = subprocess.Popen(
+            ['mdb-export', '-D', MDB_DATETIME_FORMAT, '-b', 'strip', access_file_path, table_name],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self._environment()
+        )
+
+        completed = False
+        try:
+            reader = csv.reader(io.TextIOWrapper(process.stdout, encoding='utf-8', errors='replace', newline=''))
+            header = next(reader, None)
+            if header is not None:
+                batch = []
+                for row in reader:
+                    batch.append(tuple(self._normalize_value(value) for value in row))
+                    if len(batch) >= self.batch_size:
+                        yield header, batch
+                        batch = []
+                if batch:
+                    yield header, batch
+            completed = True
+        finally:
+            if not completed:
+                # Потребитель прервал чтение - останавливаем экспорт
+                process.kill()
+            process.stdout.close()
+            return_code = process.wait()
+            stderr = process.stderr.read().decode('utf-8', errors='replace').strip()
+            process.stderr.close()
+            if completed and return_code != 0:
+                raise RuntimeError(f"mdb-export завершился с кодом {return_code} для {table_name}: {stderr}")
+
+    def iter_batches(self, access_file_path: str, table_name: str) -> Iterator[pd.DataFrame]:
+        """Потоковое чтение таблицы пакетами DataFrame (строковые значения)"""
+        for header, rows in self.iter_rows(access_file_path, table_name):
+            yield pd.DataFrame.from_records(rows, columns=header)
+
+    def read_table(self, access_file_path: str, table_name: str) -> pd.DataFrame:
+        """Чтение таблицы целиком (для интерактивной загрузки небольших таблиц)"""
+        batches = list(self.iter_batches(access_file_path, table_name))
+        if not batches:
+            return pd.DataFrame()
+        return pd.concat(batches, ignore_index=True)
+
+
+class MdbToolsSession:
+    """Сессия работы с одним файлом Access через mdbtools (интерфейс как у AccessSession)"""
+
+    def __init__(self, access_file_path: str, chunksize: int = ACCESS_BATCH_SIZE):
+        if not os.path.exists(access_file_path):
+            raise FileNotFoundError(f"Access файл не найден: {access_file_path}")
+
+        self.access_file_path = access_file_path
+        self.driver = 'mdbtools'
+        self._extractor = MdbToolsExtractor(batch_size=chunksize)
+        self._tables: Optional[List[str]] = None
+
+    def __enter__(self) -> 'MdbToolsSession':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        pass
+
+    @property
+    def tables(self) -> List[str]:
+        if self._tables is None:
+            self._tables = self._extractor.list_tables(self.access_file_path)
+        return self._tables
+
+    def iter_table(self, table_name: str) -> Iterator[pd.DataFrame]:
+        return self._extractor.iter_batches(self.access_file_path, table_name)
+
+    def read_table(self, table_name: str) -> pd.DataFrame:
+        return self._extractor.read_table(self.access_file_path, table_name)
+
+    def extract(self, tables: Dict[str, str]) -> Dict[str, pd.DataFrame]:
+        loaded = {}
+        for key, table_name in tables.items():
+            loaded[key] = self.read_table(table_name)
+            logger.info(f"Загружена таблица {table_name} как {key} (mdbtools): {len(loaded[key])} строк")
+        return loaded
+
+
+class AccessSession:
+    """
+    Сессия работы с одним файлом Access через ODBC.
+    Рабочий драйвер определяется один раз (и кэшируется на процесс), соединение
+    открывается одно на всю сессию, список таблиц читается один раз.
+    """
+
+    def __init__(self, access_file_path: str, drivers: Optional[List[str]] = None,
+                 chunksize: int = ACCESS_BATCH_SIZE):
+        if not os.path.exists(access_file_path):
+            raise FileNotFoundError(f"Access файл не найден: {access_file_path}")
+
+        self.access_file_path = access_file_path
+        self.chunksize = chunksize
+        self.driver: Optional[str] = None
+        self._drivers = list(drivers or []) + [d for d in DEFAULT_ACCESS_DRIVERS if d not in (drivers or [])]
+        self._connection = None
+        self._tables: Optional[List[str]] = None
+
+    def __enter__(self) -> 'AccessSession':
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def connect(self):
+        """Подключение: сначала кэшированный драйвер, затем перебор кандидатов"""
+        if self._connection is not None:
+            return self._connection
+
+        import pyodbc
+
+        cache_key = os.path.splitext(self.access_file_path)[1].lower()
+        cached = _DRIVER_CACHE.get(cache_key)
+        candidates = ([cached] if cached else []) + [d for d in self._drivers if d != cached]
+
+        for driver in candidates:
+            try:
+                # Успешное соединение сразу используется для работы, а не закрывается
+                self._connection = pyodbc.connect(f'DRIVER={driver};DBQ={self.access_file_path};')
+                self.driver = driver
+                _DRIVER_CACHE[cache_key] = driver
+                logger.info(f"Успешный драйвер: {driver}")
+                return self._connection
+            except Exception as e:
+                logger.debug(f"Драйвер {driver} не сработал: {e}")
+
+        raise ConnectionError(
+            f"Не удалось подключиться к Access файлу ни с одним драйвером. Испробованы: {candidates}")
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            finally:
+                self._connection = None
+
+    @property
+    def tables(self) -> List[str]:
+        """Список пользовательских таблиц (читается один раз за сессию)"""
+        if self._tables is None:
+            cursor = self.connect().cursor()
+            self._tables = [table.table_name for table in cursor.tables(tableType='TABLE')]
+            cursor.close()
+        return self._tables
+
+    def iter_table(self, table_name: str) -> Iterator[pd.DataFrame]:
+        """Потоковое чтение таблицы чанками через fetchmany"""
+        cursor = self.connect().cursor()
+        try:
+            cursor.execute(f"SELECT * FROM [{table_name}]")
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(self.chunksize)
+                if not rows:
+                    break
+                yield pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+        finally:
+            cursor.close()
+
+    def read_table(self, table_name: str) -> pd.DataFrame:
+        """Чтение таблицы целиком (чанки склеиваются в конце)"""
+        chunks = list(self.iter_table(table_name))
+        if not chunks:
+            return pd.DataFrame()
+        return pd.concat(chunks, ignore_index=True)
+
+    def extract(self, tables: Dict[str, str]) -> Dict[str, pd.DataFrame]:
+        """Извлечение нескольких таблиц за один проход по одному соединению: {ключ: таблица}"""
+        loaded = {}
+        for key, table_name in tables.items():
+            loaded[key] = self.read_table(table_name)
+            logger.info(f"Загружена таблица {table_name} как {key}: {len(loaded[key])} строк")
+        return loaded
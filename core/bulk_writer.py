@@ -0,0 +1,272 @@
+# core/bulk_writer.py
+"""
+Пакетная запись в SQLite: executemany большими транзакциями, временные прагмы
+импорта (WAL, ослабленный synchronous) и отложенное построение вторичных индексов.
+"""
+import logging
+import sqlite3
+import time
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from pandas.io.sql import get_schema
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном executemany / одной транзакции
+BULK_BATCH_SIZE = 50_000
+
+# Прагмы на время импорта; journal_mode и synchronous после импорта восстанавливаются
+IMPORT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -64000  # 64 МБ
+}
+
+
+def _column_values(series: pd.Series) -> list:
+    """Значения столбца списком объектов Python (пропуски -> None)"""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        series = series.dt.strftime('%Y-%m-%d %H:%M:%S')
+
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'biuf':
+        values = series.to_numpy()
+        if values.dtype.kind == 'f':
+            missing = np.isnan(values)
+            if missing.any():
+                values = values.astype(object)
+                values[missing] = None
+        # tolist() сразу дает int/float Python без поэлементной проверки
+        return values.tolist()
+
+    values = series.to_numpy(dtype=object, na_value=None)
+    if any(isinstance(value, np.generic) for value in values):
+        return [value.item() if isinstance(value, np.generic) else value for value in values]
+    return values.tolist()
+
+
+def iter_frame_rows(df: pd.DataFrame) -> Iterator[tuple]:
+    """Ленивый поток строк фрейма в виде кортежей значений Python, пригодных для sqlite3
+    (пропуски -> None, даты -> 'YYYY-MM-DD HH:MM:SS' как у pandas.to_sql).
+    Преобразование идет по столбцам, кортежи строк создаются по мере вставки."""
+    return zip(*(_column_values(df[col]) for col in df.columns))
+
+
+def frame_to_sql_rows(df: pd.DataFrame) -> List[tuple]:
+    """Все строки фрейма списком кортежей (см. iter_frame_rows)"""
+    return list(iter_frame_rows(df))
+
+
+class BulkSQLiteWriter:
+    """
+    Компонент массовой записи в SQLite.
+
+    Используется как контекстный менеджер: на входе включаются прагмы импорта,
+    на выходе транзакция фиксируется (или откатывается), удаленные вторичные
+    индексы перестраиваются, прагмы восстанавливаются. Режим журнала
+    возвращается к исходному, чтобы база снова была одним файлом (резервные
+    копии делаются простым копированием файла).
+
+    Внешнее соединение (connection=...) writer не фиксирует и не откатывает -
+    транзакцией управляет вызывающий код.
+    """
+
+    def __init__(self, db_path: str = 'neuro_data.db', connection: Optional[sqlite3.Connection] = None,
+                 batch_size: int = BULK_BATCH_SIZE, import_pragmas: bool = True):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.import_pragmas = import_pragmas
+        self.rows_written = 0
+        self._connection = connection
+        self._owns_connection = connection is None
+        self._saved_pragmas: Dict[str, str] = {}
+        self._deferred_indexes: List[str] = []
+        # False - пакеты executemany не фиксируются по одному (замена таблицы одной транзакцией)
+        self._batch_commits = True
+        self._started: Optional[float] = None
+        self._elapsed = 0.0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.open()
+        return self._connection
+
+    def __enter__(self) -> 'BulkSQLiteWriter':
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close(commit=exc_type is None)
+
+    def open(self):
+        """Открытие соединения и включение прагм импорта"""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.db_path)
+        self._started = time.perf_counter()
+        if self.import_pragmas:
+            self._apply_import_pragmas()
+
+    def close(self, commit: bool = True):
+        """Фиксация/откат своего соединения, перестройка индексов, восстановление прагм"""
+        if self._connection is None:
+            return
+        try:
+            if self._owns_connection:
+                if commit:
+                    self._connection.commit()
+                else:
+                    self._connection.rollback()
+            # Индексы восстанавливаются и при ошибке - иначе они были бы потеряны
+            self.rebuild_indexes()
+        finally:
+            self._elapsed = self.elapsed
+            self._started = None
+            self._restore_pragmas()
+            if self._owns_connection:
+                self._connection.close()
+                self._connection = None
+
+    def _apply_import_pragmas(self):
+        # Режим журнала нельзя сменить внутри открытой транзакции
+        if self._connection.in_transaction:
+            logger.debug("Прагмы импорта пропущены: соединение уже в транзакции")
+            return
+        for name, value in IMPORT_PRAGMAS.items():
+            self._saved_pragmas[name] = self._connection.execute(f"PRAGMA {name}").fetchone()[0]
+            self._connection.execute(f"PRAGMA {name} = {value}")
+
+    def _restore_pragmas(self):
+        for name, value in self._saved_pragmas.items():
+            try:
+                self._connection.execute(f"PRAGMA {name} = {value}")
+            except sqlite3.Error as e:
+                # Например, WAL не снимается, пока базу держат другие соединения
+                logger.warning(f"Не удалось восстановить PRAGMA {name} = {value}: {e}")
+        self._saved_pragmas = {}
+
+    def defer_indexes(self, table: str) -> List[str]:
+        """Удаление вторичных индексов таблицы до конца загрузки.
+
+        Уникальные индексы остаются: на них опираются upsert и ограничения.
+        Возвращает имена удаленных индексов.
+        """
+        rows = self.connection.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table,)
+        ).fetchall()
+
+        dropped = []
+        for name, sql in rows:
+            if sql.upper().startswith('CREATE UNIQUE'):
+                continue
+            self._deferred_indexes.append(sql)
+            self.connection.execute(f'DROP INDEX IF EXISTS "{name}"')
+            dropped.append(name)
+
+        if dropped:
+            logger.info(f"Индексы {table} отложены до конца загрузки: {', '.join(dropped)}")
+        return dropped
+
+    def rebuild_indexes(self):
+        """Построение отложенных индексов (один проход по таблице на индекс)"""
+        if not self._deferred_indexes:
+            return
+        started = time.perf_counter()
+        for sql in self._deferred_indexes:
+            self._connection.execute(sql)
+        if self._owns_connection:
+            self._connection.commit()
+        logger.info(f"Перестроено индексов: {len(self._deferred_indexes)} за {time.perf_counter() - started:.2f} с")
+        self._deferred_indexes = []
+
+    def executemany(self, sql: str, rows: Iterable[Sequence]) -> int:
+        """executemany пакетами по batch_size строк; каждый пакет - одна транзакция
+        (для внешнего соединения транзакцией управляет вызывающий код).
+        Строки пакета не материализуются списком: sqlite3 забирает их из итератора.
+        Возвращает число затронутых строк."""
+        iterator = iter(rows)
+        total = 0
+        for first in iterator:
+            cursor = self.connection.executemany(sql, chain((first,), islice(iterator, self.batch_size - 1)))
+            if self._owns_connection and self._batch_commits:
+                self._connection.commit()
+            total += max(cursor.rowcount, 0)
+
+        self.rows_written += total
+        return total
+
+    def insert_rows(self, table: str, columns: Sequence[str], rows: Iterable[Sequence],
+                    conflict: Optional[str] = None) -> int:
+        """Вставка строк в таблицу; conflict - 'REPLACE', 'IGNORE' и т.п. для INSERT OR ..."""
+        verb = f"INSERT OR {conflict}" if conflict else "INSERT"
+        column_list = ', '.join(f'"{col}"' for col in columns)
+        placeholders = ', '.join('?' for _ in columns)
+        return self.executemany(f'{verb} INTO "{table}" ({column_list}) VALUES ({placeholders})', rows)
+
+    def write_frame(self, table: str, df: pd.DataFrame, if_exists: str = 'append') -> int:
+        """Запись фрейма: схема таблицы - по типам pandas, данные - executemany пакетами.
+        Вторичные индексы существующей таблицы на время записи удаляются.
+
+        Замена (if_exists='replace') идет одной транзакцией - удаление, создание
+        и все пакеты: при ошибке остается прежняя таблица. Свое соединение
+        фиксируется в конце замены, внешнее - вызывающим кодом."""
+        conn = self.connection
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone() is not None
+        if exists and if_exists == 'fail':
+            raise ValueError(f"Таблица {table} уже существует")
+
+        replace = exists and if_exists == 'replace'
+        if replace and not conn.in_transaction:
+            # DDL в sqlite3 не открывает транзакцию сам
+            conn.execute('BEGIN')
+
+        # Столбцы конвертируются пакетами, чтобы не держать в памяти копию всего фрейма
+        def rows():
+            for start in range(0, len(df), self.batch_size):
+                yield from iter_frame_rows(df.iloc[start:start + self.batch_size])
+
+        self._batch_commits = not replace
+        try:
+            if replace:
+                conn.execute(f'DROP TABLE "{table}"')
+                exists = False
+            if not exists:
+                # to_sql фиксирует транзакцию сам - схема берется у pandas, CREATE выполняется здесь
+                conn.execute(get_schema(df.head(0), table, con=conn))
+            else:
+                self.defer_indexes(table)
+            written = self.insert_rows(table, list(df.columns), rows())
+            if replace and self._owns_connection:
+                conn.commit()
+        except BaseException:
+            if replace and self._owns_connection:
+                conn.rollback()
+            raise
+        finally:
+            self._batch_commits = True
+        return written
+
+    def record_rows(self, count: int):
+        """Учет строк, записанных мимо writer (построчными execute на его соединении)"""
+        self.rows_written += count
+
+    @property
+    def elapsed(self) -> float:
+        if self._started is None:
+            return self._elapsed
+        return time.perf_counter() - self._started
+
+    @property
+    def rows_per_second(self) -> float:
+        elapsed = self.elapsed
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (f"записано {self.rows_written} строк за {self.elapsed:.2f} с "
+                f"({self.rows_per_second:,.0f} строк/с)")
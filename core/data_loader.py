@@ -1,12 +1,54 @@
 # core/data_loader.py
 import pandas as pd
+import numpy as np
 import os
 import sqlite3
 from tkinter import messagebox
 import logging
-from typing import Optional, Dict, Any, Tuple, List
+from typing import Optional, Dict, Any, Tuple, List, Iterator, Callable
 import sys
 import json
+import csv
+import codecs
+import warnings
+
+from core.access_extractor import AccessSession, MdbToolsExtractor, MdbToolsSession
+from core.bulk_writer import BulkSQLiteWriter
+from core.excel_reader import XlsxStreamReader
+from core.import_manifest import ImportManifest, file_signature
+from core.reaction_storage import COMPAT_VIEW, load_reaction_times
+from core.sqlite_import import ImportDelta, IncrementalImporter
+
+# Кодировки-кандидаты для CSV в порядке приоритета
+CSV_ENCODINGS = ['utf-8', 'cp1251', 'windows-1251', 'latin1']
+
+# Размер префикса файла для определения кодировки и разделителя (байт)
+CSV_SNIFF_BYTES = 64 * 1024
+
+# Размер чанка при потоковой загрузке CSV (строк)
+CSV_CHUNK_SIZE = 50_000
+
+# План типов данных: префиксы столбцов времени реакции (мс, укладываются в int16)
+RT_COLUMN_PREFIXES = ('Tst1_', 'Tst2_', 'Tst3_')
+
+# Ключевые целочисленные столбцы
+BOXBASE_INT32_COLUMNS = ['cnt', 'REG_ID']
+USERS_INT32_COLUMNS = ['ID']
+
+# Малые целочисленные столбцы (давление, счетчики ошибок, агрегаты тестов)
+BOXBASE_SMALL_INT_PREFIXES = ('AD1', 'AD2', 'RANO_POKAZ_', 'POZDNO_POKAZ_', 'result_', 'SrKvadrOtkl_', 'Active')
+USERS_SMALL_INT_COLUMNS = ['Gender', 'Active']
+
+# Категориальные столбцы с малым числом значений
+BOXBASE_CATEGORY_COLUMNS = ['VidSost', 'VidSost_txt']
+
+# Известные форматы дат выгрузок (быстрый векторизованный путь, по порядку)
+DATE_FORMATS = ('%d.%m.%Y', '%d.%m.%Y %H:%M:%S', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S')
+
+# Столбцы дат users/boxbase
+USERS_DATE_COLUMNS = ['YBorn', 'RegDate']
+BOXBASE_DATE_COLUMN = 'CurrentDate'
+BOXBASE_TIME_COLUMN = 'CurrentTime'
 
 
 class DataLoader:
@@ -19,6 +61,11 @@ class DataLoader:
         self.available_access_drivers = []
         self.new_schema_available = False
         self.db_path = "neuro_data.db"
+        self.memory_report: Dict[str, Dict[str, int]] = {}
+        self.parse_stats: Dict[str, Dict[str, Dict[str, int]]] = {}
+        # Исходные файлы загруженных таблиц: {тип: (путь, размер, mtime_ns на момент загрузки)}
+        self.source_files: Dict[str, Tuple[str, int, int]] = {}
+        self.mdbtools_available = MdbToolsExtractor.is_available()
         self._check_access_drivers()
         self._check_new_schema()
 
@@ -103,16 +150,20 @@ class DataLoader:
 
         try:
             conn = sqlite3.connect(self.db_path)
+            # Времена реакции хранятся упакованными - JSON отдает представление
+            source = COMPAT_VIEW if conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = ?", (COMPAT_VIEW,)
+            ).fetchone() else 'visual_tests'
             if patient_id:
-                query = """
+                query = f"""
                         SELECT vt.*, ts.session_date, ts.session_time
-                        FROM visual_tests vt
+                        FROM {source} vt
                                  JOIN testing_sessions ts ON vt.session_id = ts.id
                         WHERE ts.patient_id = ? \
                         """
                 df = pd.read_sql(query, conn, params=(patient_id,))
             else:
-                df = pd.read_sql("SELECT * FROM visual_tests", conn)
+                df = pd.read_sql(f"SELECT * FROM {source}", conn)
             conn.close()
             self.logger.info(f"Загружено {len(df)} визуальных тестов из новой схемы")
             return df
@@ -120,6 +171,23 @@ class DataLoader:
             self.logger.error(f"Ошибка получения визуальных тестов: {e}")
             return None
 
+    def get_reaction_times(self, test_type: Optional[str] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Времена реакции всех тестов одним массивом: (id тестов, матрица (n, 36) с NaN)"""
+        if not self.new_schema_available:
+            return None
+
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                ids, matrix = load_reaction_times(conn, test_type)
+            finally:
+                conn.close()
+            self.logger.info(f"Загружены времена реакции {len(ids)} тестов")
+            return ids, matrix
+        except Exception as e:
+            self.logger.error(f"Ошибка получения времен реакции: {e}")
+            return None
+
     def get_neurotransmitter_scores(self, patient_id: Optional[int] = None) -> Optional[pd.DataFrame]:
         """Получение нейромедиаторных показателей"""
         if not self.new_schema_available:
@@ -150,125 +218,140 @@ class DataLoader:
         try:
             # Проверяем доступность драйверов
             pyodbc_available, message = self.check_pyodbc_available()
-            if not pyodbc_available:
+            if not pyodbc_available and not self.mdbtools_available:
                 raise ImportError(message)
 
-            import pyodbc
-
             # Проверяем существование файла
             if not os.path.exists(access_file_path):
                 raise FileNotFoundError(f"Access файл не найден: {access_file_path}")
 
             self.logger.info(f"Попытка загрузки из Access: {access_file_path}")
 
-            # Формируем connection string
-            conn_str = self._get_access_connection_string(access_file_path)
-
-            # Подключаемся к базе
-            connection = pyodbc.connect(conn_str)
-            cursor = connection.cursor()
+            # Одна сессия: драйвер из кэша, одно соединение, один список таблиц
+            with self.open_access_session(access_file_path) as session:
+                available_tables = session.tables
+                self.logger.info(f"Доступные таблицы в Access: {available_tables}")
 
-            # Получаем список таблиц
-            tables = cursor.tables(tableType='TABLE')
-            available_tables = [table.table_name for table in tables]
+                # Если таблица не указана, используем логику выбора
+                if table_name is None:
+                    return self._auto_detect_and_load_tables(session)
 
-            self.logger.info(f"Доступные таблицы в Access: {available_tables}")
-
-            # Если таблица не указана, используем логику выбора
-            if table_name is None:
-                return self._auto_detect_and_load_tables(connection, available_tables)
-            else:
                 # Загружаем конкретную таблицу
                 if table_name not in available_tables:
                     raise ValueError(f"Таблица {table_name} не найдена в базе. Доступные: {available_tables}")
 
-                df = pd.read_sql(f"SELECT * FROM [{table_name}]", connection)
-                connection.close()
-
+                df = session.read_table(table_name)
                 self.logger.info(f"Загружена таблица {table_name}: {len(df)} строк")
                 return {table_name: df}
 
         except Exception as e:
             self.logger.error(f"Ошибка загрузки из Access: {e}")
-            if 'connection' in locals():
-                try:
-                    connection.close()
-                except:
-                    pass
             raise
 
-    def _get_access_connection_string(self, access_file_path: str) -> str:
-        """Получение строки подключения для Access"""
-        if not self.available_access_drivers:
-            raise ConnectionError("Нет доступных драйверов Access")
+    def open_access_session(self, access_file_path: str, chunksize: int = CSV_CHUNK_SIZE):
+        """Сессия Access: ODBC с найденными в системе драйверами, без них - mdbtools"""
+        pyodbc_available, message = self.check_pyodbc_available()
+        if pyodbc_available:
+            return AccessSession(access_file_path, self.available_access_drivers, chunksize)
+        if self.mdbtools_available:
+            # Без ODBC-драйвера читаем базу через mdbtools
+            return MdbToolsSession(access_file_path, chunksize)
+        raise ImportError(message)
+
+    def _auto_detect_and_load_tables(self, session) -> Dict[str, pd.DataFrame]:
+        """Автоматическое определение и загрузка таблиц users и boxbase за один проход"""
+        tables = self._detect_access_tables(session.tables)
 
-        # Пробуем разные драйверы в порядке приоритета
-        test_drivers = self.available_access_drivers + [
-            '{Microsoft Access Driver (*.mdb, *.accdb)}',
-            '{Microsoft Access Driver (*.mdb)}',
-            '{Microsoft Access (*.mdb)}'
-        ]
+        loaded_data = {}
+        for key, table_name in tables.items():
+            try:
+                loaded_data.update(session.extract({key: table_name}))
+            except Exception as e:
+                self.logger.warning(f"Не удалось загрузить таблицу {table_name}: {e}")
 
-        for driver in test_drivers:
+        if not loaded_data and session.tables:
+            # Если не нашли по шаблонам, пробуем загрузить первую таблицу
+            first_table = session.tables[0]
             try:
-                conn_str = f'DRIVER={driver};DBQ={access_file_path};'
-                import pyodbc
-                # Пробуем подключиться
-                test_conn = pyodbc.connect(conn_str)
-                test_conn.close()
-                self.logger.info(f"Успешный драйвер: {driver}")
-                return conn_str
+                loaded_data = session.extract({first_table: first_table})
             except Exception as e:
-                self.logger.debug(f"Драйвер {driver} не сработал: {e}")
-                continue
+                self.logger.warning(f"Не удалось загрузить таблицу {first_table}: {e}")
 
-        raise ConnectionError(
-            f"Не удалось подключиться к Access файлу ни с одним драйвером. Испробованы: {test_drivers}")
+        if not loaded_data:
+            raise ValueError("Не найдены подходящие таблицы в базе данных")
 
-    def _auto_detect_and_load_tables(self, connection, available_tables: list) -> Dict[str, pd.DataFrame]:
-        """Автоматическое определение и загрузка таблиц users и boxbase"""
-        loaded_data = {}
+        return loaded_data
+
+    def _detect_access_tables(self, available_tables: list) -> Dict[str, str]:
+        """Сопоставление таблиц Access с users/boxbase по шаблонам названий"""
+        detected = {}
 
-        # Поиск таблицы users
         users_table = self._find_table_by_pattern(available_tables,
                                                   ['user', 'patient', 'subject', 'испытуем', 'пациент'])
         if users_table:
-            try:
-                df = pd.read_sql(f"SELECT * FROM [{users_table}]", connection)
-                loaded_data['users'] = df
-                self.logger.info(f"Загружена таблица {users_table} как users: {len(df)} строк")
-            except Exception as e:
-                self.logger.warning(f"Не удалось загрузить таблицу {users_table}: {e}")
+            detected['users'] = users_table
 
-        # Поиск таблицы boxbase
-        boxbase_table = self._find_table_by_pattern(available_tables,
+        boxbase_candidates = [table for table in available_tables if table != users_table]
+        boxbase_table = self._find_table_by_pattern(boxbase_candidates,
                                                     ['box', 'test', 'result', 'data', 'base', 'реакц', 'тест'])
         if boxbase_table:
-            try:
-                df = pd.read_sql(f"SELECT * FROM [{boxbase_table}]", connection)
-                loaded_data['boxbase'] = df
-                self.logger.info(f"Загружена таблица {boxbase_table} как boxbase: {len(df)} строк")
-            except Exception as e:
-                self.logger.warning(f"Не удалось загрузить таблицу {boxbase_table}: {e}")
+            detected['boxbase'] = boxbase_table
 
-        connection.close()
+        return detected
 
-        if not loaded_data:
-            # Если не нашли по шаблонам, пробуем загрузить первую таблицу
-            try:
-                connection = pyodbc.connect(self._get_access_connection_string(access_file_path))
-                first_table = available_tables[0]
-                df = pd.read_sql(f"SELECT * FROM [{first_table}]", connection)
-                loaded_data[first_table] = df
-                self.logger.info(f"Загружена первая таблица {first_table}: {len(df)} строк")
-                connection.close()
-            except:
-                pass
+    def iter_access_chunks(self, session, data_type: str = 'boxbase',
+                           table_name: Optional[str] = None) -> Iterator[pd.DataFrame]:
+        """Потоковое чтение таблицы открытой сессии Access чанками, нормализованными как users/boxbase"""
+        if data_type not in ('users', 'boxbase'):
+            raise ValueError(f"Неизвестный тип данных: {data_type}")
 
-        if not loaded_data:
-            raise ValueError("Не найдены подходящие таблицы в базе данных")
+        if table_name is None:
+            table_name = self._detect_access_tables(session.tables).get(data_type)
+            if table_name is None:
+                raise ValueError(f"Таблица {data_type} не найдена в Access базе")
 
-        return loaded_data
+        self._reset_parse_stats(data_type)
+        for chunk in session.iter_table(table_name):
+            if data_type == 'users':
+                chunk = self._clean_users_frame(self._normalize_users_frame(chunk, quiet=True), quiet=True)
+                yield self._apply_users_dtypes(chunk)
+            else:
+                chunk = self._clean_boxbase_frame(self._normalize_boxbase_frame(chunk, quiet=True), quiet=True)
+                yield self._apply_boxbase_dtypes(chunk)
+
+    def extract_access_to_sqlite(self, access_file_path: str, db_path: Optional[str] = None,
+                                 batch_size: int = CSV_CHUNK_SIZE) -> Dict[str, int]:
+        """Перенос users/boxbase из Access в таблицы SQLite (инкрементально по ID/cnt).
+
+        Обе таблицы извлекаются за одну сессию (без ODBC-драйвера - через mdbtools),
+        читаются потоково и пишутся пакетами, поэтому в памяти одновременно
+        находится только один пакет строк.
+        """
+        db_path = db_path or self.db_path
+
+        row_counts = {}
+        importer = IncrementalImporter(db_path)
+        with BulkSQLiteWriter(db_path) as writer, \
+                self.open_access_session(access_file_path, batch_size) as session:
+            tables = self._detect_access_tables(session.tables)
+            if not tables:
+                raise ValueError("Не найдены подходящие таблицы в базе данных")
+
+            for data_type, access_table in tables.items():
+                row_counts[data_type] = 0
+                written = 0
+                # Каждый пакет импортируется инкрементально по ID/cnt
+                for chunk in self.iter_access_chunks(session, data_type, access_table):
+                    delta = importer.import_frame(writer.connection, data_type, chunk)
+                    writer.record_rows(delta.written)
+                    row_counts[data_type] += len(chunk)
+                    written += delta.written
+
+                self.logger.info(f"Таблица {access_table} перенесена в SQLite как {data_type}: "
+                                 f"{row_counts[data_type]} строк, записано новых/измененных: {written}")
+
+        self.logger.info(f"Перенос Access в SQLite: {writer.summary()}")
+        return row_counts
 
     def _find_table_by_pattern(self, tables: list, patterns: list) -> Optional[str]:
         """Поиск таблицы по шаблонам названий"""
@@ -279,28 +362,35 @@ class DataLoader:
                     return table
         return None
 
+    def _read_access_table(self, access_file_path: str, data_type: str) -> Tuple[str, pd.DataFrame]:
+        """Чтение из Access только таблицы data_type: имя определяется один раз по списку
+        таблиц сессии, вторая таблица не извлекается. Если таблица по шаблонам не найдена,
+        используется единственная найденная (или первая) таблица базы."""
+        if not os.path.exists(access_file_path):
+            raise FileNotFoundError(f"Access файл не найден: {access_file_path}")
+
+        with self.open_access_session(access_file_path) as session:
+            detected = self._detect_access_tables(session.tables)
+            table_name = detected.get(data_type)
+            if table_name is None:
+                candidates = list(detected.values()) or session.tables[:1]
+                if len(candidates) != 1:
+                    raise ValueError(f"Таблица {data_type} не найдена в Access базе")
+                table_name = candidates[0]
+                self.logger.info(f"Таблица {table_name} используется как {data_type}")
+
+            # Таблица читается чанками сессии и склеивается один раз
+            return table_name, session.read_table(table_name)
+
     def load_users_from_access(self, access_file_path: str) -> pd.DataFrame:
         """Загрузка данных users напрямую из Access"""
         try:
-            result = self.load_from_access_database(access_file_path)
-
-            if 'users' in result:
-                self.users_df = result['users']
-                self._normalize_users_columns()
-                self.clean_users_data()
-                self.logger.info(f"Users данные загружены из Access: {len(self.users_df)} строк")
-                return self.users_df
-            else:
-                # Если не нашли users, но есть одна таблица - используем её
-                if len(result) == 1:
-                    table_name, df = list(result.items())[0]
-                    self.users_df = df
-                    self._normalize_users_columns()
-                    self.clean_users_data()
-                    self.logger.info(f"Использована таблица {table_name} как users: {len(self.users_df)} строк")
-                    return self.users_df
-                else:
-                    raise ValueError("Таблица users не найдена в Access базе")
+            table_name, self.users_df = self._read_access_table(access_file_path, 'users')
+            self._normalize_users_columns()
+            self.clean_users_data()
+            self.logger.info(f"Users данные загружены из Access ({table_name}): {len(self.users_df)} строк")
+            self._remember_source('users', access_file_path)
+            return self.users_df
 
         except Exception as e:
             self.logger.error(f"Ошибка загрузки users из Access: {e}")
@@ -309,25 +399,12 @@ class DataLoader:
     def load_boxbase_from_access(self, access_file_path: str) -> pd.DataFrame:
         """Загрузка данных boxbase напрямую из Access"""
         try:
-            result = self.load_from_access_database(access_file_path)
-
-            if 'boxbase' in result:
-                self.boxbase_df = result['boxbase']
-                self._normalize_boxbase_columns()
-                self.clean_boxbase_data()
-                self.logger.info(f"Boxbase данные загружены из Access: {len(self.boxbase_df)} строк")
-                return self.boxbase_df
-            else:
-                # Если не нашли boxbase, но есть одна таблица - используем её
-                if len(result) == 1:
-                    table_name, df = list(result.items())[0]
-                    self.boxbase_df = df
-                    self._normalize_boxbase_columns()
-                    self.clean_boxbase_data()
-                    self.logger.info(f"Использована таблица {table_name} как boxbase: {len(self.boxbase_df)} строк")
-                    return self.boxbase_df
-                else:
-                    raise ValueError("Таблица boxbase не найдена в Access базе")
+            table_name, self.boxbase_df = self._read_access_table(access_file_path, 'boxbase')
+            self._normalize_boxbase_columns()
+            self.clean_boxbase_data()
+            self.logger.info(f"Boxbase данные загружены из Access ({table_name}): {len(self.boxbase_df)} строк")
+            self._remember_source('boxbase', access_file_path)
+            return self.boxbase_df
 
         except Exception as e:
             self.logger.error(f"Ошибка загрузки boxbase из Access: {e}")
@@ -371,6 +448,8 @@ class DataLoader:
                         break
 
             self.logger.info(f"✅ Загружены таблицы из Access: {', '.join(loaded_tables)}")
+            for data_type in loaded_tables:
+                self._remember_source(data_type, access_file_path)
             return {
                 'users': self.users_df,
                 'boxbase': self.boxbase_df
@@ -380,11 +459,175 @@ class DataLoader:
             self.logger.error(f"Ошибка загрузки из Access: {e}")
             raise
 
+    def _sniff_csv_format(self, file_path: str) -> Tuple[str, str]:
+        """Однократное определение кодировки и разделителя CSV по префиксу файла"""
+        with open(file_path, 'rb') as f:
+            prefix = f.read(CSV_SNIFF_BYTES)
+
+        # BOM однозначно определяет кодировку
+        if prefix.startswith(codecs.BOM_UTF8):
+            candidates = ['utf-8-sig']
+        elif prefix.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            candidates = ['utf-16']
+        else:
+            candidates = CSV_ENCODINGS
+
+        encoding, text = None, None
+        for candidate in candidates:
+            try:
+                # Инкрементальный декодер не падает на символе, обрезанном границей префикса
+                text = codecs.getincrementaldecoder(candidate)().decode(prefix, final=False)
+                encoding = candidate
+                break
+            except UnicodeDecodeError:
+                continue
+
+        if encoding is None:
+            raise ValueError(f"Не удалось определить кодировку CSV: {file_path}")
+
+        # Разделитель определяем только по целым строкам префикса
+        sample_lines = text.splitlines()
+        if len(prefix) == CSV_SNIFF_BYTES and len(sample_lines) > 1:
+            sample_lines = sample_lines[:-1]
+        sample = '\n'.join(sample_lines)
+
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=',;\t|').delimiter
+        except csv.Error:
+            delimiter = ','
+
+        self.logger.info(f"Формат CSV определен: кодировка={encoding}, разделитель={delimiter!r}")
+        return encoding, delimiter
+
+    def iter_csv_chunks(self, file_path: str, data_type: str = 'boxbase',
+                        chunksize: int = CSV_CHUNK_SIZE,
+                        progress: Optional[Callable[[int, int], None]] = None) -> Iterator[pd.DataFrame]:
+        """Потоковая загрузка CSV чанками фиксированного размера.
+
+        Кодировка и разделитель определяются один раз по префиксу файла, далее файл
+        читается C-движком pandas. Каждый чанк проходит те же нормализацию и очистку,
+        что и полная загрузка users/boxbase, поэтому его можно сразу писать в SQLite.
+        progress(строк, прочитано_байт) вызывается после каждого чанка.
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Файл не найден: {file_path}")
+        if data_type not in ('users', 'boxbase'):
+            raise ValueError(f"Неизвестный тип данных: {data_type}")
+
+        encoding, delimiter = self._sniff_csv_format(file_path)
+        self._reset_parse_stats(data_type)
+
+        # Файл открывается здесь, чтобы позиция в нем давала объем прочитанного
+        handle = open(file_path, 'rb')
+        reader = pd.read_csv(
+            handle,
+            encoding=encoding,
+            sep=delimiter,
+            engine='c',
+            chunksize=chunksize,
+            on_bad_lines='skip',
+            encoding_errors='replace'
+        )
+
+        total_rows = 0
+        with handle, reader:
+            for chunk in reader:
+                if data_type == 'users':
+                    chunk = self._clean_users_frame(self._normalize_users_frame(chunk, quiet=True), quiet=True)
+                    chunk = self._apply_users_dtypes(chunk)
+                else:
+                    chunk = self._clean_boxbase_frame(self._normalize_boxbase_frame(chunk, quiet=True), quiet=True)
+                    chunk = self._apply_boxbase_dtypes(chunk)
+
+                total_rows += len(chunk)
+                if progress is not None:
+                    progress(total_rows, handle.tell())
+                yield chunk
+
+        self.logger.info(f"CSV {data_type} загружен потоково ({encoding}): {file_path}, строк: {total_rows}")
+
+    def iter_file_chunks(self, file_path: str, data_type: str = 'boxbase',
+                         chunksize: int = CSV_CHUNK_SIZE,
+                         progress: Optional[Callable[[int, int], None]] = None) -> Iterator[pd.DataFrame]:
+        """Потоковая загрузка users/boxbase из CSV, Excel или Access.
+
+        CSV, .xlsx и Access читаются чанками; .xls загружается целиком и отдается
+        одним чанком. Чанки уже нормализованы, очищены и приведены к плану типов.
+        progress(строк, прочитано_байт) вызывается после каждого чанка.
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Файл не найден: {file_path}")
+        if data_type not in ('users', 'boxbase'):
+            raise ValueError(f"Неизвестный тип данных: {data_type}")
+
+        file_ext = os.path.splitext(file_path)[1].lower()
+        file_size = os.path.getsize(file_path)
+        self._reset_parse_stats(data_type)
+
+        if file_ext == '.csv':
+            yield from self.iter_csv_chunks(file_path, data_type, chunksize, progress)
+
+        elif file_ext == '.xlsx':
+            def on_batch(rows: int, fraction: float):
+                if progress is not None:
+                    progress(rows, int(fraction * file_size))
+
+            for chunk in XlsxStreamReader(chunksize).iter_batches(file_path, progress=on_batch):
+                if data_type == 'users':
+                    yield self._apply_users_dtypes(
+                        self._clean_users_frame(self._normalize_users_frame(chunk, quiet=True), quiet=True))
+                else:
+                    yield self._apply_boxbase_dtypes(
+                        self._clean_boxbase_frame(self._normalize_boxbase_frame(chunk, quiet=True), quiet=True))
+
+        elif file_ext == '.xls':
+            df = self.load_excel(file_path)
+            if data_type == 'users':
+                df = self._apply_users_dtypes(
+                    self._clean_users_frame(self._normalize_users_frame(df, quiet=True), quiet=True))
+            else:
+                df = self._apply_boxbase_dtypes(
+                    self._clean_boxbase_frame(self._normalize_boxbase_frame(df, quiet=True), quiet=True))
+            if progress is not None:
+                progress(len(df), file_size)
+            yield df
+
+        elif file_ext in ['.mdb', '.accdb']:
+            # Объем прочитанного из Access неизвестен до конца таблицы
+            total_rows = 0
+            with self.open_access_session(file_path, chunksize) as session:
+                for chunk in self.iter_access_chunks(session, data_type):
+                    total_rows += len(chunk)
+                    if progress is not None:
+                        progress(total_rows, 0)
+                    yield chunk
+            if progress is not None:
+                progress(total_rows, file_size)
+
+        else:
+            raise ValueError(f"Неподдерживаемый формат файла: {file_ext}")
+
     def load_csv(self, file_path: str, nrows: Optional[int] = None) -> pd.DataFrame:
         """Загрузка CSV файла с автоматическим определением кодировки"""
         try:
+            # Быстрый путь: однократное определение формата и C-движок
+            try:
+                encoding, delimiter = self._sniff_csv_format(file_path)
+                df = pd.read_csv(
+                    file_path,
+                    encoding=encoding,
+                    nrows=nrows,
+                    sep=delimiter,
+                    engine='c',
+                    on_bad_lines='skip'
+                )
+                self.logger.info(f"CSV загружен ({encoding}): {file_path}, строк: {len(df)}")
+                return df
+            except Exception as e:
+                self.logger.debug(f"Быстрая загрузка CSV не удалась, перебор кодировок: {e}")
+
             # Пробуем разные кодировки
-            encodings = ['utf-8', 'cp1251', 'windows-1251', 'latin1']
+            encodings = CSV_ENCODINGS
 
             for encoding in encodings:
                 try:
@@ -427,13 +670,10 @@ class DataLoader:
     def load_excel(self, file_path: str, nrows: Optional[int] = None) -> pd.DataFrame:
         """Загрузка Excel файла с оптимизацией памяти"""
         try:
-            # Используем openpyxl для .xlsx
+            # .xlsx разбирается пакетами (openpyxl read_only) и склеивается в один фрейм;
+            # с плоской памятью .xlsx читается только через iter_file_chunks
             if file_path.endswith('.xlsx'):
-                df = pd.read_excel(
-                    file_path,
-                    nrows=nrows,
-                    engine='openpyxl'
-                )
+                df = XlsxStreamReader().read_frame(file_path, nrows=nrows)
             else:
                 # Для .xls используем xlrd
                 df = pd.read_excel(
@@ -489,6 +729,43 @@ class DataLoader:
         else:
             raise ValueError(f"Неподдерживаемый формат файла: {file_ext}")
 
+    def _remember_source(self, data_type: str, file_path: str):
+        """Запоминание исходного файла таблицы (для манифеста импорта)"""
+        self.source_files[data_type] = (file_path, *file_signature(file_path))
+
+    def import_file(self, file_path: str, data_type: str, db_path: Optional[str] = None,
+                    force: bool = False) -> ImportDelta:
+        """Импорт одного файла users/boxbase в SQLite с учетом манифеста.
+
+        Неизмененный файл (по размеру/времени изменения или SHA-256) не разбирается;
+        измененный - разбирается потоково и импортируется инкрементально по ID/cnt
+        чанк за чанком на одном соединении, так что в памяти находится один чанк.
+        """
+        db_path = db_path or self.db_path
+        manifest = ImportManifest(db_path)
+        state = manifest.check(file_path, data_type)
+        if state.unchanged and not force:
+            self.logger.info(f"{data_type}: файл {file_path} не изменился с прошлого импорта, пропуск")
+            return ImportDelta(data_type, source_unchanged=True)
+
+        delta = ImportDelta(data_type)
+        summary = None
+        importer = IncrementalImporter(db_path)
+        with BulkSQLiteWriter(db_path) as writer:
+            for chunk in self.iter_file_chunks(file_path, data_type):
+                chunk_delta = importer.import_frame(writer.connection, data_type, chunk)
+                writer.record_rows(chunk_delta.written)
+                delta.merge(chunk_delta)
+                # Для манифеста от чанка остаются только строки, столбцы и период
+                summary = ImportManifest.extend_summary(summary, data_type, chunk)
+
+        if summary is None:
+            raise ValueError(f"Файл не содержит данных: {file_path}")
+
+        self.logger.info(f"Импорт {file_path}: {delta}, {writer.summary()}")
+        manifest.record_summary(state, summary)
+        return delta
+
     def load_users_data(self, file_path: str, nrows: Optional[int] = None) -> pd.DataFrame:
         """Специализированная загрузка данных users"""
         try:
@@ -518,6 +795,7 @@ class DataLoader:
 
             self.logger.info(f"Users данные подготовлены: {len(self.users_df)} строк")
             self.logger.info(f"Финальные столбцы users: {self.users_df.columns.tolist()}")
+            self._remember_source('users', file_path)
             return self.users_df
 
         except Exception as e:
@@ -550,6 +828,7 @@ class DataLoader:
 
             self.logger.info(f"Boxbase данные подготовлены: {len(self.boxbase_df)} строк")
             self.logger.info(f"Финальные столбцы boxbase: {self.boxbase_df.columns.tolist()}")
+            self._remember_source('boxbase', file_path)
             return self.boxbase_df
 
         except Exception as e:
@@ -561,12 +840,13 @@ class DataLoader:
         if self.users_df is None:
             return
 
-        # Сохраняем оригинальные названия для отладки
-        original_columns = self.users_df.columns.tolist()
+        self.users_df = self._normalize_users_frame(self.users_df)
 
+    def _normalize_users_frame(self, df: pd.DataFrame, quiet: bool = False) -> pd.DataFrame:
+        """Нормализация названий столбцов произвольного фрейма (или чанка) users"""
         # Создаем mapping для нормализации
         column_mapping = {}
-        for col in self.users_df.columns:
+        for col in df.columns:
             col_upper = col.upper()
             if col_upper == 'ID' or col_upper == 'SUBJECT_ID':
                 column_mapping[col] = 'ID'
@@ -579,18 +859,24 @@ class DataLoader:
             # Остальные столбцы оставляем как есть
 
         # Применяем замены
-        self.users_df.rename(columns=column_mapping, inplace=True)
+        df = df.rename(columns=column_mapping)
 
-        self.logger.info(f"Столбцы users после нормализации: {self.users_df.columns.tolist()}")
+        if not quiet:
+            self.logger.info(f"Столбцы users после нормализации: {df.columns.tolist()}")
+        return df
 
     def _normalize_boxbase_columns(self):
         """Нормализация названий столбцов boxbase - минимальная"""
         if self.boxbase_df is None:
             return
 
+        self.boxbase_df = self._normalize_boxbase_frame(self.boxbase_df)
+
+    def _normalize_boxbase_frame(self, df: pd.DataFrame, quiet: bool = False) -> pd.DataFrame:
+        """Нормализация названий столбцов произвольного фрейма (или чанка) boxbase"""
         # Создаем mapping для нормализации
         column_mapping = {}
-        for col in self.boxbase_df.columns:
+        for col in df.columns:
             col_upper = col.upper()
             if col_upper == 'REG_ID' or col_upper == 'REGID':
                 column_mapping[col] = 'REG_ID'
@@ -605,118 +891,297 @@ class DataLoader:
             # Остальные столбцы оставляем как есть
 
         # Применяем замены
-        self.boxbase_df.rename(columns=column_mapping, inplace=True)
+        df = df.rename(columns=column_mapping)
 
-        self.logger.info(f"Столбцы boxbase после нормализации: {self.boxbase_df.columns.tolist()}")
+        if not quiet:
+            self.logger.info(f"Столбцы boxbase после нормализации: {df.columns.tolist()}")
+        return df
 
     def clean_users_data(self):
         """Очистка и подготовка данных users"""
         if self.users_df is None:
             return
 
+        self._reset_parse_stats('users')
+        self.users_df = self._clean_users_frame(self.users_df)
+
+        memory_before = int(self.users_df.memory_usage(deep=True).sum())
+        self.users_df = self._apply_users_dtypes(self.users_df)
+        self._record_memory('users', memory_before, self.users_df)
+
+    def _clean_users_frame(self, df: pd.DataFrame, quiet: bool = False) -> pd.DataFrame:
+        """Очистка произвольного фрейма (или чанка) users"""
+        log = self.logger.debug if quiet else self.logger.info
+
         # Удаляем полностью пустые строки
-        initial_count = len(self.users_df)
-        self.users_df = self.users_df.dropna(how='all')
-        if initial_count != len(self.users_df):
-            self.logger.info(f"Удалено пустых строк users: {initial_count - len(self.users_df)}")
+        initial_count = len(df)
+        df = df.dropna(how='all')
+        if initial_count != len(df):
+            log(f"Удалено пустых строк users: {initial_count - len(df)}")
 
         # Находим столбец ID (в любом регистре)
         id_column = None
-        for col in self.users_df.columns:
+        for col in df.columns:
             if col.upper() == 'ID':
                 id_column = col
                 break
 
         if id_column and id_column != 'ID':
             # Переименовываем в стандартный ID
-            self.users_df.rename(columns={id_column: 'ID'}, inplace=True)
+            df = df.rename(columns={id_column: 'ID'})
             id_column = 'ID'
 
-        if 'ID' in self.users_df.columns:
+        if 'ID' in df.columns:
             # Удаляем строки с пустыми ID и преобразуем к int
-            self.users_df = self.users_df.dropna(subset=['ID'])
-            self.users_df['ID'] = pd.to_numeric(self.users_df['ID'], errors='coerce')
-            self.users_df = self.users_df.dropna(subset=['ID'])
-            self.users_df['ID'] = self.users_df['ID'].astype(int)
+            df = df.dropna(subset=['ID'])
+            df['ID'] = pd.to_numeric(df['ID'], errors='coerce')
+            df = df.dropna(subset=['ID'])
+            df['ID'] = df['ID'].astype(int)
         else:
             self.logger.warning("Столбец ID не найден в данных users")
 
-        # Преобразуем даты с правильным форматом DD.MM.YYYY
-        date_columns = ['YBorn', 'RegDate']
-        for col in date_columns:
-            if col in self.users_df.columns:
+        # Преобразуем даты: известные форматы DD.MM.YYYY и т.п., разбор с угадыванием - только для остатка
+        for col in USERS_DATE_COLUMNS:
+            if col in df.columns:
                 try:
-                    self.users_df[col] = pd.to_datetime(
-                        self.users_df[col],
-                        dayfirst=True,
-                        errors='coerce'
-                    )
-                    success_count = self.users_df[col].notna().sum()
-                    self.logger.info(f"Преобразовано дат {col}: {success_count}/{len(self.users_df)}")
+                    df[col] = self._parse_dates('users', col, df[col])
+                    success_count = df[col].notna().sum()
+                    log(f"Преобразовано дат {col}: {success_count}/{len(df)}")
                 except Exception as e:
                     self.logger.warning(f"Не удалось преобразовать даты в столбце {col}: {e}")
 
         # Нормализуем пол (0-жен, 1-муж)
-        if 'Gender' in self.users_df.columns:
-            self.users_df['Gender'] = pd.to_numeric(self.users_df['Gender'], errors='coerce')
-            self.users_df['Gender'] = self.users_df['Gender'].fillna(0).astype(int)
-            self.users_df['Gender'] = self.users_df['Gender'].clip(0, 1)
+        if 'Gender' in df.columns:
+            df['Gender'] = pd.to_numeric(df['Gender'], errors='coerce')
+            df['Gender'] = df['Gender'].fillna(0).astype(int)
+            df['Gender'] = df['Gender'].clip(0, 1)
 
             # Логируем распределение
-            gender_counts = self.users_df['Gender'].value_counts()
-            self.logger.info(f"Распределение по полу: ♂{gender_counts.get(1, 0)} ♀{gender_counts.get(0, 0)}")
+            gender_counts = df['Gender'].value_counts()
+            log(f"Распределение по полу: ♂{gender_counts.get(1, 0)} ♀{gender_counts.get(0, 0)}")
+
+        return df
 
     def clean_boxbase_data(self):
         """Очистка и подготовка данных boxbase"""
         if self.boxbase_df is None:
             return
 
+        self._reset_parse_stats('boxbase')
+        self.boxbase_df = self._clean_boxbase_frame(self.boxbase_df)
+
+        memory_before = int(self.boxbase_df.memory_usage(deep=True).sum())
+        self.boxbase_df = self._apply_boxbase_dtypes(self.boxbase_df)
+        self._record_memory('boxbase', memory_before, self.boxbase_df)
+
+    def _clean_boxbase_frame(self, df: pd.DataFrame, quiet: bool = False) -> pd.DataFrame:
+        """Очистка произвольного фрейма (или чанка) boxbase"""
+        log = self.logger.debug if quiet else self.logger.info
+
         # Удаляем полностью пустые строки
-        initial_count = len(self.boxbase_df)
-        self.boxbase_df = self.boxbase_df.dropna(how='all')
-        if initial_count != len(self.boxbase_df):
-            self.logger.info(f"Удалено пустых строк boxbase: {initial_count - len(self.boxbase_df)}")
+        initial_count = len(df)
+        df = df.dropna(how='all')
+        if initial_count != len(df):
+            log(f"Удалено пустых строк boxbase: {initial_count - len(df)}")
 
         # Находим столбец REG_ID (в любом регистре)
         reg_id_column = None
-        for col in self.boxbase_df.columns:
+        for col in df.columns:
             if col.upper() == 'REG_ID':
                 reg_id_column = col
                 break
 
         if reg_id_column and reg_id_column != 'REG_ID':
             # Переименовываем в стандартный REG_ID
-            self.boxbase_df.rename(columns={reg_id_column: 'REG_ID'}, inplace=True)
+            df = df.rename(columns={reg_id_column: 'REG_ID'})
             reg_id_column = 'REG_ID'
 
-        if 'REG_ID' in self.boxbase_df.columns:
+        if 'REG_ID' in df.columns:
             # Удаляем строки с пустыми REG_ID и преобразуем к int
-            self.boxbase_df = self.boxbase_df.dropna(subset=['REG_ID'])
-            self.boxbase_df['REG_ID'] = pd.to_numeric(self.boxbase_df['REG_ID'], errors='coerce')
-            self.boxbase_df = self.boxbase_df.dropna(subset=['REG_ID'])
-            self.boxbase_df['REG_ID'] = self.boxbase_df['REG_ID'].astype(int)
+            df = df.dropna(subset=['REG_ID'])
+            df['REG_ID'] = pd.to_numeric(df['REG_ID'], errors='coerce')
+            df = df.dropna(subset=['REG_ID'])
+            df['REG_ID'] = df['REG_ID'].astype(int)
         else:
             self.logger.warning("Столбец REG_ID не найден в данных boxbase")
 
-        # Преобразуем даты
-        if 'CurrentDate' in self.boxbase_df.columns:
+        # Преобразуем даты и время сессии
+        if BOXBASE_DATE_COLUMN in df.columns:
             try:
-                self.boxbase_df['CurrentDate'] = pd.to_datetime(
-                    self.boxbase_df['CurrentDate'],
-                    dayfirst=True,
-                    errors='coerce'
-                )
-                success_count = self.boxbase_df['CurrentDate'].notna().sum()
-                self.logger.info(f"Преобразовано дат CurrentDate: {success_count}/{len(self.boxbase_df)}")
+                session_date = self._parse_dates('boxbase', BOXBASE_DATE_COLUMN, df[BOXBASE_DATE_COLUMN])
+                df[BOXBASE_DATE_COLUMN] = session_date
+                success_count = session_date.notna().sum()
+                log(f"Преобразовано дат CurrentDate: {success_count}/{len(df)}")
+
+                if BOXBASE_TIME_COLUMN in df.columns:
+                    # Единая метка сессии: секунды от эпохи Unix (дата + время суток)
+                    time_of_day = self._parse_times('boxbase', BOXBASE_TIME_COLUMN, df[BOXBASE_TIME_COLUMN])
+                    session_start = session_date.dt.normalize() + time_of_day.fillna(pd.Timedelta(0))
+                    session_timestamp = self._epoch_seconds(session_start).rename('SessionTimestamp')
+                    df = pd.concat([df.drop(columns='SessionTimestamp', errors='ignore'), session_timestamp], axis=1)
             except Exception as e:
                 self.logger.warning(f"Не удалось преобразовать даты в CurrentDate: {e}")
 
         # Преобразуем числовые колонки тестов
-        test_columns = [col for col in self.boxbase_df.columns if col.startswith(('Tst1_', 'Tst2_', 'Tst3_'))]
+        test_columns = [col for col in df.columns if col.startswith(('Tst1_', 'Tst2_', 'Tst3_'))]
         for col in test_columns:
-            self.boxbase_df[col] = pd.to_numeric(self.boxbase_df[col], errors='coerce')
-
-        self.logger.info(f"Обработано тестовых колонок: {len(test_columns)}")
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+        log(f"Обработано тестовых колонок: {len(test_columns)}")
+        return df
+
+    def _record_parse_stats(self, data_type: str, column: str, stats: Dict[str, int]):
+        """Накопление статистики разбора дат (чанки одного файла суммируются)"""
+        column_stats = self.parse_stats.setdefault(data_type, {}).setdefault(
+            column, {'total': 0, 'fast': 0, 'fallback': 0, 'failed': 0})
+        for key, value in stats.items():
+            column_stats[key] += value
+
+    def _reset_parse_stats(self, data_type: str):
+        self.parse_stats[data_type] = {}
+
+    def _parse_dates(self, data_type: str, column: str, series: pd.Series) -> pd.Series:
+        """Векторизованный разбор дат: сначала известные форматы (DATE_FORMATS),
+        разбор с угадыванием формата - только для строк, не подошедших ни к одному"""
+        if pd.api.types.is_datetime64_any_dtype(series):
+            present = int(series.notna().sum())
+            self._record_parse_stats(data_type, column, {'total': present, 'fast': present})
+            return series
+
+        present = series.notna() & (series.astype(str).str.strip() != '')
+        result = pd.Series(pd.NaT, index=series.index, dtype='datetime64[ns]')
+        remaining = present.copy()
+
+        # Быстрый путь: каждый формат применяется векторно к еще не разобранным строкам
+        for date_format in DATE_FORMATS:
+            if not remaining.any():
+                break
+            parsed = pd.to_datetime(series[remaining], format=date_format, errors='coerce')
+            ok = parsed.notna()
+            result[ok[ok].index] = parsed[ok]
+            remaining[ok[ok].index] = False
+        fast = int(present.sum() - remaining.sum())
+
+        # Медленный путь (угадывание формата) только для оставшихся значений
+        fallback = 0
+        if remaining.any():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                parsed = series[remaining].map(lambda value: pd.to_datetime(value, dayfirst=True, errors='coerce'))
+            parsed = pd.to_datetime(parsed, errors='coerce')
+            ok = parsed.notna()
+            result[ok[ok].index] = parsed[ok]
+            fallback = int(ok.sum())
+
+        total = int(present.sum())
+        self._record_parse_stats(data_type, column, {
+            'total': total, 'fast': fast, 'fallback': fallback, 'failed': total - fast - fallback
+        })
+        return result
+
+    def _parse_times(self, data_type: str, column: str, series: pd.Series) -> pd.Series:
+        """Время суток H:MM:SS -> timedelta; значения вида 'дата время' (например,
+        30.12.1899 09:59:10 из Access/Excel) разбираются медленным путем"""
+        if pd.api.types.is_timedelta64_dtype(series):
+            present = int(series.notna().sum())
+            self._record_parse_stats(data_type, column, {'total': present, 'fast': present})
+            return series
+
+        present = series.notna() & (series.astype(str).str.strip() != '')
+        text = series.astype(str).str.strip()
+
+        # Быстрый путь: H:MM:SS векторно через to_timedelta
+        result = pd.to_timedelta(text.where(present), errors='coerce')
+        remaining = present & result.isna()
+        fast = int(present.sum() - remaining.sum())
+
+        fallback = 0
+        if remaining.any():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                parsed = pd.to_datetime(
+                    text[remaining].map(lambda value: pd.to_datetime(value, dayfirst=True, errors='coerce')),
+                    errors='coerce'
+                )
+            ok = parsed.notna()
+            result[ok[ok].index] = parsed[ok] - parsed[ok].dt.normalize()
+            fallback = int(ok.sum())
+
+        total = int(present.sum())
+        self._record_parse_stats(data_type, column, {
+            'total': total, 'fast': fast, 'fallback': fallback, 'failed': total - fast - fallback
+        })
+        return result
+
+    @staticmethod
+    def _epoch_seconds(timestamps: pd.Series) -> pd.Series:
+        """datetime64 -> секунды от эпохи Unix (Int64, пропуск - <NA>)"""
+        seconds = (timestamps - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+        if seconds.isna().any():
+            return seconds.astype('Int64')
+        return seconds.astype('int64')
+
+    @staticmethod
+    def _downcast_integer(series: pd.Series, dtype: str) -> pd.Series:
+        """Приведение столбца к компактному целому типу.
+
+        Без пропусков используется обычный numpy-тип, с пропусками - nullable-аналог
+        (Int16/Int32). Если значения дробные или не помещаются в тип, столбец
+        остается float64: float32 теряет точность целых больше 2**24 (ключи cnt, REG_ID)
+        и десятичных дробей, которые затем записываются в SQLite.
+        """
+        values = pd.to_numeric(series, errors='coerce')
+        if not pd.api.types.is_numeric_dtype(values):
+            return series
+
+        info = np.iinfo(dtype)
+        present = values.dropna()
+        if len(present) and ((present % 1 != 0).any() or present.min() < info.min or present.max() > info.max):
+            return values.astype('float64')
+
+        if present.size == values.size:
+            return values.astype(dtype)
+        return values.astype(dtype.capitalize())
+
+    def _apply_boxbase_dtypes(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Применение компактного плана типов к фрейму boxbase"""
+        columns = {}
+        for col in df.columns:
+            if col.startswith(RT_COLUMN_PREFIXES):
+                columns[col] = self._downcast_integer(df[col], 'int16')
+            elif col in BOXBASE_INT32_COLUMNS:
+                columns[col] = self._downcast_integer(df[col], 'int32')
+            elif col.startswith(BOXBASE_SMALL_INT_PREFIXES):
+                columns[col] = self._downcast_integer(df[col], 'int16')
+            elif col in BOXBASE_CATEGORY_COLUMNS:
+                columns[col] = df[col].astype('category')
+            else:
+                columns[col] = df[col]
+
+        # Фрейм собирается целиком, чтобы не фрагментировать блоки по столбцам
+        return pd.DataFrame(columns, index=df.index)
+
+    def _apply_users_dtypes(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Применение компактного плана типов к фрейму users"""
+        df = df.copy()
+
+        for col in USERS_INT32_COLUMNS:
+            if col in df.columns:
+                df[col] = self._downcast_integer(df[col], 'int32')
+        for col in USERS_SMALL_INT_COLUMNS:
+            if col in df.columns:
+                df[col] = self._downcast_integer(df[col], 'int8')
+
+        return df
+
+    def _record_memory(self, data_type: str, memory_before: int, df: pd.DataFrame):
+        """Сохранение объема памяти фрейма до и после применения плана типов"""
+        memory_after = int(df.memory_usage(deep=True).sum())
+        self.memory_report[data_type] = {'before': memory_before, 'after': memory_after}
+        self.logger.info(
+            f"Память {data_type}: {memory_before / 1024:.0f} КБ -> {memory_after / 1024:.0f} КБ "
+            f"после применения плана типов"
+        )
 
     def get_data_info(self) -> Dict[str, Any]:
         """Получение подробной информации о загруженных данных"""
@@ -731,14 +1196,18 @@ class DataLoader:
             'boxbase_sample': [],
             'users_memory_usage': 0,
             'boxbase_memory_usage': 0,
+            'users_memory_before': self.memory_report.get('users', {}).get('before', 0),
+            'boxbase_memory_before': self.memory_report.get('boxbase', {}).get('before', 0),
             'access_drivers_available': self.access_drivers_available,
             'available_access_drivers': self.available_access_drivers,
+            'mdbtools_available': self.mdbtools_available,
+            'parse_stats': self.parse_stats,
             'new_schema_available': self.new_schema_available
         }
 
         if self.users_df is not None:
             info['users_columns'] = self.users_df.columns.tolist()
-            info['users_sample'] = self.users_df.head(3).fillna('').to_dict('records')
+            info['users_sample'] = self.users_df.head(3).astype(object).fillna('').to_dict('records')
             info['users_memory_usage'] = self.users_df.memory_usage(deep=True).sum()
 
             if 'Gender' in self.users_df.columns:
@@ -756,7 +1225,7 @@ class DataLoader:
 
         if self.boxbase_df is not None:
             info['boxbase_columns'] = self.boxbase_df.columns.tolist()
-            info['boxbase_sample'] = self.boxbase_df.head(3).fillna('').to_dict('records')
+            info['boxbase_sample'] = self.boxbase_df.head(3).astype(object).fillna('').to_dict('records')
             info['boxbase_memory_usage'] = self.boxbase_df.memory_usage(deep=True).sum()
 
             test_cols = [col for col in self.boxbase_df.columns if col.startswith(('Tst1_', 'Tst2_', 'Tst3_'))]
@@ -770,22 +1239,49 @@ class DataLoader:
 
         return info
 
-    def save_to_sqlite(self, db_path: str = 'neuro_data.db') -> str:
-        """Сохранение данных в SQLite базу"""
-        try:
-            self.db_connection = sqlite3.connect(db_path)
-
-            if self.users_df is not None:
-                self.users_df.to_sql('users', self.db_connection,
-                                     if_exists='replace', index=False)
-                self.logger.info(f"Users сохранены в SQLite: {db_path}")
+    def save_to_sqlite(self, db_path: str = 'neuro_data.db', incremental: bool = True) -> Dict[str, ImportDelta]:
+        """Сохранение данных в SQLite базу.
 
-            if self.boxbase_df is not None:
-                self.boxbase_df.to_sql('boxbase', self.db_connection,
-                                       if_exists='replace', index=False)
-                self.logger.info(f"Boxbase сохранены в SQLite: {db_path}")
-
-            return db_path
+        По умолчанию импорт инкрементальный: строки сопоставляются по ID/cnt,
+        записываются только новые и измененные. incremental=False - полная замена таблиц.
+        """
+        frames = {name: df for name, df in (('users', self.users_df), ('boxbase', self.boxbase_df))
+                  if df is not None}
+        try:
+            if incremental:
+                manifest = ImportManifest(db_path)
+                deltas, states = {}, {}
+                for name in list(frames):
+                    if name not in self.source_files:
+                        continue
+                    file_path, size, mtime_ns = self.source_files[name]
+                    if not os.path.exists(file_path):
+                        continue
+                    state = manifest.check(file_path, name)
+                    if (state.size, state.mtime_ns) != (size, mtime_ns):
+                        # Файл изменился после загрузки - импортируем, но в манифест не записываем
+                        continue
+                    if state.unchanged:
+                        deltas[name] = ImportDelta(name, source_unchanged=True)
+                        del frames[name]
+                    else:
+                        states[name] = state
+
+                deltas.update(IncrementalImporter(db_path).import_frames(frames))
+                for name, state in states.items():
+                    manifest.record(state, frames[name])
+                for delta in deltas.values():
+                    self.logger.info(f"Сохранено в SQLite {db_path}: {delta}")
+                return deltas
+
+            deltas = {}
+            with BulkSQLiteWriter(db_path) as writer:
+                for name, df in frames.items():
+                    writer.write_frame(name, df, if_exists='replace')
+                    deltas[name] = ImportDelta(name, inserted=len(df), rebuilt=True)
+                    self.logger.info(f"{name} сохранены в SQLite: {db_path}")
+            self.logger.info(f"Полная запись в SQLite: {writer.summary()}")
+            return deltas
 
         except Exception as e:
             self.logger.error(f"Ошибка сохранения в SQLite: {e}")
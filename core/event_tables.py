@@ -0,0 +1,289 @@
+# core/event_tables.py
+"""
+Событийные таблицы модели данных v4: stimulus_events (одно предъявление
+стимула - одна строка) и response_events (одна реакция - одна строка).
+Строятся пакетно из visual_tests и test_metadata. Физическая раскладка
+компактная: тип теста, цвет и позиция - целые коды, таблицы WITHOUT ROWID
+кластеризованы по (session_id, test_type, stimulus_number), покрывающие индексы
+по (color, position, psi) отвечают на сценарные запросы без чтения таблиц.
+Версия метаданных, по которой построены таблицы, записывается в
+derived_table_versions (event_tables_current() сравнивает ее с текущей).
+"""
+import logging
+import math
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.bulk_writer import BulkSQLiteWriter
+from core.reaction_matrix import STIMULI_PER_TEST, TEST_TYPE_ORDER
+from core.reaction_storage import PACKED_COLUMN, reaction_times_from_json, unpack_reaction_times
+from core.test_metadata import (COLOR_CODES, POSITION_CODES, TestMetadataManager, current_metadata_version,
+                                 derived_table_version, load_metadata_manager, stamp_derived_table)
+
+logger = logging.getLogger(__name__)
+
+STIMULUS_EVENTS_TABLE = 'stimulus_events'
+RESPONSE_EVENTS_TABLE = 'response_events'
+EVENT_CODES_TABLE = 'event_codes'
+
+# Целые коды типов теста (с 1), как коды цветов и позиций в core.test_metadata
+TEST_TYPE_CODES = {test_type: code for code, test_type in enumerate(TEST_TYPE_ORDER, start=1)}
+
+# Тип теста в visual_tests -> тип теста в метаданных
+VISUAL_TEST_ALIASES = {'simple_color': 'simple'}
+
+# Тестов visual_tests в одном пакете построения (36 событий на тест)
+EVENT_BATCH_SIZE = 20_000
+
+# Атрибуты дизайна, по которым группируются сценарные запросы
+DESIGN_COLUMNS = ('color', 'position', 'psi')
+
+
+def test_type_code(test_type: str) -> Optional[int]:
+    """Код типа теста visual_tests / метаданных (None - неизвестный тип)"""
+    return TEST_TYPE_CODES.get(VISUAL_TEST_ALIASES.get(test_type, test_type))
+
+
+def create_event_tables(conn: sqlite3.Connection, indexes: bool = True):
+    """Таблицы событий и справочник кодов (существующие таблицы пересоздаются)"""
+    for table in (STIMULUS_EVENTS_TABLE, RESPONSE_EVENTS_TABLE, EVENT_CODES_TABLE):
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+    conn.execute(f'''
+        CREATE TABLE {EVENT_CODES_TABLE} (
+            dimension TEXT NOT NULL,
+            code INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (dimension, code)
+        ) WITHOUT ROWID
+    ''')
+    conn.executemany(
+        f"INSERT INTO {EVENT_CODES_TABLE} (dimension, code, name) VALUES (?, ?, ?)",
+        [(dimension, code, name)
+         for dimension, codes in (('test_type', TEST_TYPE_CODES), ('color', COLOR_CODES),
+                                  ('position', POSITION_CODES))
+         for name, code in codes.items()]
+    )
+
+    conn.execute(f'''
+        CREATE TABLE {STIMULUS_EVENTS_TABLE} (
+            session_id INTEGER NOT NULL,
+            test_type INTEGER NOT NULL,
+            stimulus_number INTEGER NOT NULL,
+            test_id INTEGER NOT NULL,
+            color INTEGER,
+            position INTEGER,
+            psi INTEGER,
+            shift_parameter INTEGER,
+            PRIMARY KEY (session_id, test_type, stimulus_number)
+        ) WITHOUT ROWID
+    ''')
+    # Атрибуты дизайна продублированы в реакциях: группировка по ним не требует соединения
+    conn.execute(f'''
+        CREATE TABLE {RESPONSE_EVENTS_TABLE} (
+            session_id INTEGER NOT NULL,
+            test_type INTEGER NOT NULL,
+            stimulus_number INTEGER NOT NULL,
+            color INTEGER,
+            position INTEGER,
+            psi INTEGER,
+            rt INTEGER NOT NULL,
+            PRIMARY KEY (session_id, test_type, stimulus_number)
+        ) WITHOUT ROWID
+    ''')
+    if indexes:
+        create_event_indexes(conn)
+
+
+def create_event_indexes(conn: sqlite3.Connection):
+    """Покрывающие индексы по атрибутам дизайна.
+    В таблицах WITHOUT ROWID индекс дополнительно хранит первичный ключ,
+    поэтому индекс реакций содержит все столбцы, нужные сценарным запросам."""
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_stimulus_events_design "
+                 f"ON {STIMULUS_EVENTS_TABLE} (color, position, psi)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_response_events_design "
+                 f"ON {RESPONSE_EVENTS_TABLE} (test_type, color, position, psi, rt)")
+
+
+def design_arrays(metadata: TestMetadataManager) -> Dict[str, np.ndarray]:
+    """Метаданные стимулов -> массивы (число типов теста + 1, 36) по коду типа и номеру стимула.
+    Отсутствующие значения - -1 (в таблицу пишутся как NULL)."""
+    shape = (len(TEST_TYPE_CODES) + 1, STIMULI_PER_TEST)
+    arrays = {name: np.full(shape, -1, dtype=np.int64)
+              for name in ('color', 'position', 'psi', 'shift_parameter')}
+    sequences = metadata.get_metadata_arrays()
+
+    for test_type, code in TEST_TYPE_CODES.items():
+        if test_type not in sequences.test_types:
+            logger.warning(f"Нет метаданных теста {test_type}: атрибуты дизайна его событий не заполнены")
+            continue
+        test_arrays = sequences.test_arrays(test_type)
+        count = min(len(test_arrays['color']), STIMULI_PER_TEST)
+        for name, source in (('color', 'color'), ('position', 'position'), ('psi', 'psi'),
+                             ('shift_parameter', 'shift')):
+            arrays[name][code, :count] = test_arrays[source][:count]
+    return arrays
+
+
+def _nullable(values: np.ndarray) -> List[Optional[int]]:
+    """Целые коды -> значения для SQLite (-1 -> NULL)"""
+    return [None if value < 0 else value for value in values.tolist()]
+
+
+class EventTableBuilder:
+    """
+    Пакетное построение stimulus_events / response_events.
+
+    visual_tests читается пакетами по id, времена реакции декодируются
+    матрицей (упакованные BLOB-ы или JSON), атрибуты дизайна подставляются
+    индексированием массивов метаданных. Таблицы строятся заново одной
+    транзакцией, индексы - после загрузки.
+    """
+
+    def __init__(self, db_path: str = 'neuro_data.db', batch_size: int = EVENT_BATCH_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+
+    def _iter_test_batches(self, conn: sqlite3.Connection):
+        """Пакеты (id, session_id, код типа теста, матрица (n, 36)) в порядке id"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(visual_tests)")]
+        packed_column = PACKED_COLUMN if PACKED_COLUMN in columns else 'NULL'
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                f"SELECT id, session_id, test_type, {packed_column}, raw_reaction_times FROM visual_tests "
+                f"WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, self.batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            codes = np.array([test_type_code(row[2]) or 0 for row in rows], dtype=np.int64)
+            if not codes.all():
+                unknown = sorted({row[2] for row, code in zip(rows, codes) if not code}, key=str)
+                logger.warning(f"Тесты с неизвестным типом пропущены: {', '.join(map(str, unknown))}")
+                rows = [row for row, code in zip(rows, codes) if code]
+                codes = codes[codes > 0]
+            if not rows:
+                continue
+
+            packed = np.array([row[3] is not None for row in rows], dtype=bool)
+            matrix = np.full((len(rows), STIMULI_PER_TEST), np.nan, dtype=np.float32)
+            if packed.any():
+                matrix[packed] = unpack_reaction_times([row[3] for row in rows if row[3] is not None])
+            if not packed.all():
+                matrix[~packed] = reaction_times_from_json([row[4] for row in rows if row[3] is None])
+
+            yield (np.array([row[0] for row in rows], dtype=np.int64),
+                   np.array([row[1] for row in rows], dtype=np.int64), codes, matrix)
+
+    @staticmethod
+    def _event_rows(design: Dict[str, np.ndarray], test_ids: np.ndarray, session_ids: np.ndarray,
+                    codes: np.ndarray, matrix: np.ndarray) -> Tuple[list, list]:
+        """Строки событий пакета: все столбцы вычисляются векторно из формы матрицы"""
+        n_tests = len(test_ids)
+        stimulus_numbers = np.tile(np.arange(1, STIMULI_PER_TEST + 1), n_tests)
+        event_codes = np.repeat(codes, STIMULI_PER_TEST)
+        columns = np.tile(np.arange(STIMULI_PER_TEST), n_tests)
+        sessions = np.repeat(session_ids, STIMULI_PER_TEST)
+        color = design['color'][event_codes, columns]
+        position = design['position'][event_codes, columns]
+        psi = design['psi'][event_codes, columns]
+
+        stimulus_rows = list(zip(sessions.tolist(), event_codes.tolist(), stimulus_numbers.tolist(),
+                                 np.repeat(test_ids, STIMULI_PER_TEST).tolist(), _nullable(color),
+                                 _nullable(position), _nullable(psi),
+                                 _nullable(design['shift_parameter'][event_codes, columns])))
+
+        reaction_times = matrix.reshape(-1)
+        answered = ~np.isnan(reaction_times)
+        response_rows = list(zip(sessions[answered].tolist(), event_codes[answered].tolist(),
+                                 stimulus_numbers[answered].tolist(), _nullable(color[answered]),
+                                 _nullable(position[answered]), _nullable(psi[answered]),
+                                 np.rint(reaction_times[answered]).astype(np.int64).tolist()))
+        return stimulus_rows, response_rows
+
+    def build(self) -> dict:
+        """Построение таблиц событий заново; возвращает счетчики"""
+        stats = {'tests': 0, 'stimulus_events': 0, 'response_events': 0}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            metadata = load_metadata_manager(conn)
+            design = design_arrays(metadata)
+            with BulkSQLiteWriter(self.db_path, connection=conn) as writer:
+                conn.execute('BEGIN IMMEDIATE')
+                create_event_tables(conn, indexes=False)
+
+                for test_ids, session_ids, codes, matrix in self._iter_test_batches(conn):
+                    stimulus_rows, response_rows = self._event_rows(design, test_ids, session_ids, codes, matrix)
+                    writer.insert_rows(STIMULUS_EVENTS_TABLE,
+                                       ('session_id', 'test_type', 'stimulus_number', 'test_id',
+                                        'color', 'position', 'psi', 'shift_parameter'), stimulus_rows)
+                    writer.insert_rows(RESPONSE_EVENTS_TABLE,
+                                       ('session_id', 'test_type', 'stimulus_number',
+                                        'color', 'position', 'psi', 'rt'), response_rows)
+                    stats['tests'] += len(test_ids)
+                    stats['stimulus_events'] += len(stimulus_rows)
+                    stats['response_events'] += len(response_rows)
+
+                # Индексы строятся одним проходом по загруженным таблицам
+                create_event_indexes(conn)
+                for table in (STIMULUS_EVENTS_TABLE, RESPONSE_EVENTS_TABLE):
+                    stamp_derived_table(conn, table, metadata.version)
+                # Соединение свое, writer его не фиксирует; фиксация - до восстановления прагм
+                conn.commit()
+            conn.execute('ANALYZE')
+
+            logger.info(f"Таблицы событий построены: {stats['tests']} тестов, "
+                        f"{stats['stimulus_events']} стимулов, {stats['response_events']} реакций "
+                        f"({writer.summary()})")
+            return stats
+        finally:
+            conn.close()
+
+
+def event_tables_current(conn: sqlite3.Connection) -> bool:
+    """Таблицы событий построены по текущей версии метаданных тестирования
+    (False - не построены или метаданные с тех пор изменились)"""
+    version = current_metadata_version(conn)
+    return all(derived_table_version(conn, table) == version
+               for table in (STIMULUS_EVENTS_TABLE, RESPONSE_EVENTS_TABLE))
+
+
+def design_group_stats(conn: sqlite3.Connection, test_type: str,
+                       by: Sequence[str] = ('color',)) -> Dict[object, Dict[str, float]]:
+    """Статистика времени реакции по группам атрибутов дизайна (SQL по покрывающему индексу).
+
+    Результат в формате групп TestAnalyzer (by_color и т. п.): ключ - имя цвета/позиции или
+    значение psi (кортеж при нескольких атрибутах), значение - mean, std, count.
+    """
+    unknown = [column for column in by if column not in DESIGN_COLUMNS]
+    if unknown:
+        raise ValueError(f"Неизвестные атрибуты дизайна: {', '.join(unknown)}")
+    code = test_type_code(test_type)
+    if code is None:
+        raise ValueError(f"Неизвестный тип теста: {test_type}")
+
+    group_list = ', '.join(by)
+    rows = conn.execute(
+        f"SELECT {group_list}, COUNT(rt), SUM(rt), SUM(rt * rt) FROM {RESPONSE_EVENTS_TABLE} "
+        f"WHERE test_type = ? GROUP BY {group_list} ORDER BY {group_list}",
+        (code,)
+    ).fetchall()
+
+    names = {'color': {value: name for name, value in COLOR_CODES.items()},
+             'position': {value: name for name, value in POSITION_CODES.items()}}
+    result = {}
+    for row in rows:
+        key = tuple(names.get(column, {}).get(value, value) for column, value in zip(by, row))
+        count, total, squares = row[len(by):]
+        mean = total / count
+        result[key[0] if len(key) == 1 else key] = {
+            'mean': float(mean),
+            'std': math.sqrt(max(squares / count - mean * mean, 0.0)),
+            'count': int(count)
+        }
+    return result
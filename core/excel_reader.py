@@ -0,0 +1,126 @@
+# core/excel_reader.py
+"""
+Потоковое чтение .xlsx через openpyxl в режиме read_only: книга не строится в
+памяти целиком, строки листа разбираются по мере чтения и отдаются пакетами
+DataFrame фиксированного размера.
+"""
+import logging
+import os
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Размер пакета строк при потоковом чтении листа
+EXCEL_BATCH_SIZE = 5000
+
+
+class XlsxStreamReader:
+    """Потоковое чтение первого (или указанного) листа .xlsx пакетами"""
+
+    def __init__(self, batch_size: int = EXCEL_BATCH_SIZE):
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _map_header(header_row: tuple) -> List[str]:
+        """Заголовок листа -> имена столбцов (пустые - как у pandas, 'Unnamed: N')"""
+        columns = []
+        for i, value in enumerate(header_row):
+            name = str(value).strip() if value is not None else ''
+            columns.append(name or f'Unnamed: {i}')
+        return columns
+
+    def iter_rows(self, file_path: str, sheet_name: Optional[str] = None,
+                  nrows: Optional[int] = None) -> Iterator[Tuple[List[str], List[tuple], float]]:
+        """Пакеты строк: (столбцы, строки, доля прочитанного листа 0..1).
+
+        Заголовок разбирается один раз; полностью пустые строки пропускаются.
+        Доля прочитанного оценивается по размеру листа из его заголовка (dimension).
+        """
+        from openpyxl import load_workbook
+
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Файл не найден: {file_path}")
+
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = workbook[sheet_name] if sheet_name else workbook.worksheets[0]
+            declared_rows = sheet.max_row or 0
+            # Размер листа в заголовке бывает неверным - читаем до фактического конца
+            sheet.reset_dimensions()
+
+            rows = sheet.iter_rows(values_only=True)
+            header_row = next(rows, None)
+            if header_row is None:
+                return
+
+            # Хвостовые пустые ячейки заголовка не образуют столбцов
+            width = len(header_row)
+            while width and header_row[width - 1] is None:
+                width -= 1
+            columns = self._map_header(header_row[:width])
+
+            batch = []
+            total = 0
+            for row in rows:
+                row = tuple(row[:width])
+                if len(row) < width:
+                    row += (None,) * (width - len(row))
+                if all(value is None for value in row):
+                    continue
+
+                batch.append(row)
+                total += 1
+                if nrows is not None and total >= nrows:
+                    break
+                if len(batch) >= self.batch_size:
+                    yield columns, batch, min(total / declared_rows, 1.0) if declared_rows else 0.0
+                    batch = []
+
+            if batch:
+                yield columns, batch, 1.0
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def _typed_frame(columns: List[str], rows: List[tuple]) -> pd.DataFrame:
+        """Пакет строк -> DataFrame с типами, как у pandas.read_excel.
+
+        Числа, сохраненные в ячейках как текст, приводятся к числовым столбцам;
+        пустые строки считаются пропусками.
+        """
+        df = pd.DataFrame.from_records(rows, columns=columns)
+        columns_data = {}
+        for col in df.columns:
+            series = df[col]
+            if series.dtype == object or pd.api.types.is_string_dtype(series):
+                series = series.replace('', None)
+                try:
+                    series = pd.to_numeric(series)
+                except (ValueError, TypeError):
+                    series = series.infer_objects()
+            columns_data[col] = series
+        return pd.DataFrame(columns_data, index=df.index)
+
+    def iter_batches(self, file_path: str, sheet_name: Optional[str] = None, nrows: Optional[int] = None,
+                     progress: Optional[Callable[[int, float], None]] = None) -> Iterator[pd.DataFrame]:
+        """Пакеты DataFrame; progress(строк, доля прочитанного) после каждого пакета"""
+        total = 0
+        for columns, rows, fraction in self.iter_rows(file_path, sheet_name, nrows):
+            df = self._typed_frame(columns, rows)
+            total += len(df)
+            if progress is not None:
+                progress(total, fraction)
+            yield df
+
+    def read_frame(self, file_path: str, sheet_name: Optional[str] = None,
+                   nrows: Optional[int] = None) -> pd.DataFrame:
+        """Чтение листа целиком: пакеты склеиваются в конце, так что в памяти оказывается
+        весь лист (для плоской памяти - iter_batches)"""
+        batches = list(self.iter_batches(file_path, sheet_name, nrows))
+        if not batches:
+            return pd.DataFrame()
+        df = pd.concat(batches, ignore_index=True) if len(batches) > 1 else batches[0]
+        logger.info(f"Excel прочитан пакетами: {file_path}, строк: {len(df)}")
+        return df
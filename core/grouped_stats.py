@@ -0,0 +1,169 @@
+# core/grouped_stats.py
+"""
+Групповая статистика времен реакции за один проход по матрице (сессии, стимулы).
+
+Группировка задается кодом группы каждого столбца-стимула (-1 - стимул не входит
+ни в одну группу), например по цвету, позиции или предстимульному интервалу.
+Результат - одна таблица: строка на группу каждой группировки, столбцы count,
+mean, std, median и квантили.
+
+Времена реакции - целые миллисекунды, поэтому основной путь - гистограммы:
+один np.bincount по парам (стимул, значение) дает гистограммы всех стимулов,
+гистограмма группы - сумма гистограмм ее стимулов, а моменты и квантили
+считаются по гистограммам, размер которых не зависит от числа сессий. Для
+дробных значений или слишком широкого диапазона - сортировка: каждый стимул
+сортируется один раз, отсортированные стимулы группы сливаются устойчивой
+сортировкой (timsort).
+"""
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Квантили в таблице помимо медианы (столбцы q25, q75)
+GROUP_QUANTILES = (0.25, 0.75)
+
+# Наибольший диапазон значений (max - min + 1), при котором считается по гистограммам
+HISTOGRAM_MAX_RANGE = 1 << 16
+
+# Столбцы таблицы до столбцов квантилей
+STATS_COLUMNS = ('grouping', 'group', 'count', 'mean', 'std', 'median')
+
+
+def quantile_column(quantile: float) -> str:
+    """Имя столбца квантиля: 0.25 -> q25"""
+    return f"q{quantile * 100:g}"
+
+
+def _order_positions(counts: np.ndarray, quantiles: Sequence[float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Номера порядковых статистик (нижняя, верхняя) и доля между ними для квантилей
+    групп - линейная интерполяция, как np.quantile по умолчанию"""
+    position = np.asarray(quantiles, dtype=np.float64)[None, :] * (counts[:, None] - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    return lower, upper, position - lower
+
+
+def _column_histograms(matrix: np.ndarray) -> Optional[Tuple[np.ndarray, int]]:
+    """Гистограммы значений стимулов (стимулы, значения) и значение первого столбца
+    гистограмм; None - значения не целые или диапазон шире HISTOGRAM_MAX_RANGE"""
+    missing = np.isnan(matrix)
+    if missing.all():
+        return np.zeros((matrix.shape[1], 1), dtype=np.int64), 0
+    low, high = np.floor(np.nanmin(matrix)), np.ceil(np.nanmax(matrix))
+    if high - low + 1 > HISTOGRAM_MAX_RANGE:
+        return None
+
+    # Один bincount по всей матрице: у каждого стимула свой блок значений,
+    # последнее значение блока - пропуски (отбрасывается)
+    n_bins = int(high - low) + 2
+    shifted = np.where(missing, n_bins - 1, matrix - low)
+    keys = shifted.astype(np.intp)
+    if not np.array_equal(keys, shifted):
+        return None
+    keys += np.arange(matrix.shape[1]) * n_bins
+    hist = np.bincount(keys.ravel(), minlength=matrix.shape[1] * n_bins).reshape(matrix.shape[1], n_bins)
+    return hist[:, :-1], int(low)
+
+
+def _histogram_stats(column_hist: np.ndarray, offset: int, codes: np.ndarray, n_groups: int,
+                     quantiles: Sequence[float]) -> Tuple[np.ndarray, ...]:
+    """Статистика групп по гистограммам стимулов (стимулы, значения)"""
+    member = np.zeros((n_groups, len(codes)))
+    in_group = codes >= 0
+    member[codes[in_group], np.nonzero(in_group)[0]] = 1.0
+    # Счетчики меньше 2**53 - сумма в float64 точная
+    hist = member @ column_hist
+    counts = hist.sum(axis=1)
+    values = np.arange(offset, offset + column_hist.shape[1], dtype=np.float64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = hist @ values / counts
+        stds = np.sqrt((hist * (values[None, :] - means[:, None]) ** 2).sum(axis=1) / counts)
+
+    # k-я порядковая статистика группы - первое значение, где накопленный счетчик больше k;
+    # строки накопленных гистограмм сдвинуты, чтобы искать во всех группах одним searchsorted
+    cumulative = np.cumsum(hist, axis=1)
+    shift = (np.arange(n_groups) * (counts.max(initial=0) + 1))[:, None]
+    lower, upper, fraction = _order_positions(counts, quantiles)
+    flat = (cumulative + shift).ravel()
+    bins = np.arange(n_groups)[:, None] * len(values)
+    last = len(values) - 1
+    low = values[np.clip(np.searchsorted(flat, lower + shift, side='right') - bins, 0, last)]
+    high = values[np.clip(np.searchsorted(flat, upper + shift, side='right') - bins, 0, last)]
+    return counts.astype(np.int64), means, stds, low + (high - low) * fraction
+
+
+def _sorted_stats(sorted_matrix: np.ndarray, column_counts: np.ndarray, codes: np.ndarray, n_groups: int,
+                  quantiles: Sequence[float]) -> Tuple[np.ndarray, ...]:
+    """Статистика групп по матрице, отсортированной по столбцам (пропуски в конце столбцов)"""
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    counts = np.bincount(codes[order], weights=column_counts[order], minlength=n_groups).astype(np.int64)
+    starts = np.cumsum(counts) - counts
+    grouped = (np.concatenate([sorted_matrix[:column_counts[column], column] for column in order])
+               if len(order) else np.empty(0)).astype(np.float64)
+    # Группа - подряд идущие отсортированные столбцы: устойчивая сортировка (timsort) сливает их
+    for start, count in zip(starts, counts):
+        grouped[start:start + count].sort(kind='stable')
+
+    means = np.full(n_groups, np.nan)
+    stds = np.full(n_groups, np.nan)
+    present = counts > 0
+    if present.any():
+        means[present] = np.add.reduceat(grouped, starts[present]) / counts[present]
+        deviations = grouped - np.repeat(means[present], counts[present])
+        stds[present] = np.sqrt(np.add.reduceat(deviations * deviations, starts[present]) / counts[present])
+
+    lower, upper, fraction = _order_positions(counts, quantiles)
+    if not len(grouped):
+        return counts, means, stds, np.full(lower.shape, np.nan)
+    last = len(grouped) - 1
+    low = grouped[np.clip(starts[:, None] + lower, 0, last)]
+    high = grouped[np.clip(starts[:, None] + upper, 0, last)]
+    return counts, means, stds, low + (high - low) * fraction
+
+
+def grouped_stats(reaction_times: np.ndarray, groupings: Dict[str, Tuple[Sequence, np.ndarray]],
+                  quantiles: Sequence[float] = GROUP_QUANTILES) -> pd.DataFrame:
+    """
+    Статистика времен реакции по группам стимулов для всех группировок сразу.
+
+    reaction_times - матрица (сессии, стимулы), пропуски - NaN.
+    groupings - {имя группировки: (ключи групп, коды групп столбцов)}, код - номер
+    ключа или -1. Строки таблицы - в порядке группировок и ключей, пустые группы
+    пропускаются; std - стандартное отклонение совокупности (ddof=0).
+    """
+    matrix = np.asarray(reaction_times)
+    matrix = matrix.reshape(-1, matrix.shape[-1])
+    quantiles = (0.5, *quantiles)
+
+    histograms = _column_histograms(matrix)
+    if histograms is None:
+        # Каждый стимул сортируется один раз; пропуски (NaN) - в конце столбца
+        sorted_matrix = np.sort(matrix, axis=0)
+        column_counts = (~np.isnan(matrix)).sum(axis=0)
+
+    frames = []
+    for name, (keys, codes) in groupings.items():
+        codes = np.asarray(codes, dtype=np.int64)
+        if histograms is not None:
+            counts, means, stds, values = _histogram_stats(*histograms, codes, len(keys), quantiles)
+        else:
+            counts, means, stds, values = _sorted_stats(sorted_matrix, column_counts, codes, len(keys), quantiles)
+        present = counts > 0
+        frame = pd.DataFrame({
+            'grouping': name,
+            'group': [key for key, keep in zip(keys, present) if keep],
+            'count': counts[present],
+            'mean': means[present],
+            'std': stds[present],
+        })
+        for column, quantile_values in zip(['median', *map(quantile_column, quantiles[1:])], values[present].T):
+            frame[column] = quantile_values
+        frames.append(frame)
+
+    columns_order = [*STATS_COLUMNS, *map(quantile_column, quantiles[1:])]
+    if not frames:
+        return pd.DataFrame(columns=columns_order)
+    return pd.concat(frames, ignore_index=True)[columns_order]
@@ -0,0 +1,292 @@
+# core/import_manifest.py
+"""
+Манифест импортированных исходных файлов: путь, тип, размер, время изменения,
+SHA-256 содержимого, число строк, схема (столбцы и ее версия) и период данных.
+По манифесту повторный импорт неизменного файла пропускается без разбора.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+from core.sqlite_import import ROW_HASH_COLUMN
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_TABLE = 'import_manifest'
+
+# Размер блока при потоковом хэшировании файла
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Столбец, по которому определяется период данных файла
+PERIOD_COLUMNS = {'users': 'RegDate', 'boxbase': 'CurrentDate'}
+
+
+def file_sha256(file_path: str, block_size: int = HASH_BLOCK_SIZE) -> str:
+    """SHA-256 файла, читаемого блоками (файл целиком в память не загружается)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_signature(file_path: str) -> Tuple[int, int]:
+    """(размер, время изменения в нс) - быстрая проверка без чтения файла"""
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def table_content_version(conn: sqlite3.Connection, table: str) -> Optional[str]:
+    """Отпечаток содержимого таблицы импорта: число строк и сумма хэшей строк.
+    None - таблицы нет или она записана мимо инкрементального импорта (без хэшей строк)"""
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+    if ROW_HASH_COLUMN not in columns:
+        return None
+    count, total = conn.execute(f'SELECT COUNT(*), TOTAL("{ROW_HASH_COLUMN}") FROM "{table}"').fetchone()
+    return f"{count}:{total:.17g}"
+
+
+def schema_version(columns: Sequence[str]) -> str:
+    """Короткий идентификатор набора столбцов (меняется при изменении схемы выгрузки)"""
+    return hashlib.sha1('\x1f'.join(columns).encode('utf-8')).hexdigest()[:12]
+
+
+@dataclass
+class SourceState:
+    """Состояние исходного файла относительно манифеста"""
+    path: str
+    data_type: str
+    size: int
+    mtime_ns: int
+    sha256: Optional[str]
+    status: str  # new | changed | unchanged
+
+    @property
+    def unchanged(self) -> bool:
+        return self.status == 'unchanged'
+
+
+@dataclass
+class ManifestEntry:
+    """Запись манифеста об импортированном файле"""
+    path: str
+    data_type: str
+    file_type: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    rows: int
+    schema_version: str
+    columns: List[str] = field(default_factory=list)
+    period_start: Optional[str] = None
+    period_end: Optional[str] = None
+    imported_at: Optional[str] = None
+    table_version: Optional[str] = None
+
+
+class ImportManifest:
+    """
+    Таблица import_manifest в базе импорта.
+
+    Файл считается неизменным, если совпадают размер и время изменения, либо
+    (при другом времени изменения) совпадает SHA-256 содержимого. Кроме того,
+    таблица должна остаться такой же, какой была после импорта файла (см.
+    table_content_version): после замены, очистки или импорта другого файла
+    в ту же таблицу файл импортируется снова. Файл, для таблицы которого в
+    базе нет данных, всегда считается новым.
+    """
+
+    _COLUMNS = ('path', 'data_type', 'file_type', 'size', 'mtime_ns', 'sha256', 'rows',
+                'schema_version', 'columns', 'period_start', 'period_end', 'imported_at', 'table_version')
+
+    def __init__(self, db_path: str = 'neuro_data.db'):
+        self.db_path = db_path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path)
+        self.ensure_table(conn)
+        return conn
+
+    @staticmethod
+    def ensure_table(conn: sqlite3.Connection):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                path TEXT NOT NULL,
+                data_type TEXT NOT NULL,
+                file_type TEXT,
+                size INTEGER,
+                mtime_ns INTEGER,
+                sha256 TEXT,
+                rows INTEGER,
+                schema_version TEXT,
+                columns TEXT,
+                period_start TEXT,
+                period_end TEXT,
+                imported_at TEXT,
+                table_version TEXT,
+                PRIMARY KEY (path, data_type)
+            )
+        ''')
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({MANIFEST_TABLE})")}
+        if 'table_version' not in columns:
+            # Манифест, созданный до появления отпечатка таблицы
+            conn.execute(f"ALTER TABLE {MANIFEST_TABLE} ADD COLUMN table_version TEXT")
+
+    @staticmethod
+    def _entry_from_row(row: tuple) -> ManifestEntry:
+        values = dict(zip(ImportManifest._COLUMNS, row))
+        values['columns'] = json.loads(values['columns'] or '[]')
+        return ManifestEntry(**values)
+
+    def get(self, file_path: str, data_type: str) -> Optional[ManifestEntry]:
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM {MANIFEST_TABLE} WHERE path = ? AND data_type = ?",
+                (os.path.abspath(file_path), data_type)
+            ).fetchone()
+        finally:
+            conn.close()
+        return self._entry_from_row(row) if row else None
+
+    def entries(self) -> List[ManifestEntry]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM {MANIFEST_TABLE} ORDER BY imported_at"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [self._entry_from_row(row) for row in rows]
+
+    def check(self, file_path: str, data_type: str) -> SourceState:
+        """Сравнение файла с манифестом. Хэш считается, только если размер и
+        время изменения не позволяют решить без чтения файла."""
+        path = os.path.abspath(file_path)
+        size, mtime_ns = file_signature(path)
+
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                f"SELECT size, mtime_ns, sha256, table_version FROM {MANIFEST_TABLE} "
+                f"WHERE path = ? AND data_type = ?",
+                (path, data_type)
+            ).fetchone()
+            table_version = table_content_version(conn, data_type)
+
+            if row is None or table_version is None:
+                return SourceState(path, data_type, size, mtime_ns, file_sha256(path), 'new')
+
+            known_size, known_mtime_ns, known_sha256, known_table_version = row
+            if table_version != known_table_version:
+                # Таблицу после импорта файла переписали - данных файла в ней может не быть
+                logger.info(f"Таблица {data_type} изменилась после импорта {path}: файл импортируется снова")
+                return SourceState(path, data_type, size, mtime_ns, file_sha256(path), 'changed')
+
+            if size == known_size and mtime_ns == known_mtime_ns:
+                return SourceState(path, data_type, size, mtime_ns, known_sha256, 'unchanged')
+
+            sha256 = file_sha256(path)
+            if size == known_size and sha256 == known_sha256:
+                # Файл переписан тем же содержимым - запоминаем новое время изменения
+                with conn:
+                    conn.execute(f"UPDATE {MANIFEST_TABLE} SET mtime_ns = ? WHERE path = ? AND data_type = ?",
+                                 (mtime_ns, path, data_type))
+                return SourceState(path, data_type, size, mtime_ns, sha256, 'unchanged')
+
+            return SourceState(path, data_type, size, mtime_ns, sha256, 'changed')
+        finally:
+            conn.close()
+
+    def record(self, state: SourceState, frames: Union[pd.DataFrame, List[pd.DataFrame]]) -> ManifestEntry:
+        """Запись в манифест после успешного импорта файла (frames - фрейм или чанки файла)"""
+        return self.record_summary(state, self.summarize(state.data_type, frames))
+
+    @staticmethod
+    def summarize(data_type: str, frames: Union[pd.DataFrame, List[pd.DataFrame]]) -> Dict[str, Any]:
+        """Сводка файла для манифеста: строки, столбцы и период данных"""
+        if isinstance(frames, pd.DataFrame):
+            frames = [frames]
+        period_start, period_end = ImportManifest._period(data_type, frames)
+        return {
+            'rows': sum(len(frame) for frame in frames),
+            'columns': list(frames[0].columns) if frames else [],
+            'period_start': period_start,
+            'period_end': period_end
+        }
+
+    @staticmethod
+    def extend_summary(summary: Optional[Dict[str, Any]], data_type: str, frame: pd.DataFrame) -> Dict[str, Any]:
+        """Сводка, дополненная очередным чанком файла (summary=None - первый чанк):
+        чанки не нужно держать до записи в манифест"""
+        chunk = ImportManifest.summarize(data_type, frame)
+        if summary is None:
+            return chunk
+        starts = [value for value in (summary['period_start'], chunk['period_start']) if value]
+        ends = [value for value in (summary['period_end'], chunk['period_end']) if value]
+        return {
+            'rows': summary['rows'] + chunk['rows'],
+            'columns': summary['columns'],
+            'period_start': min(starts) if starts else None,
+            'period_end': max(ends) if ends else None
+        }
+
+    def record_summary(self, state: SourceState, summary: Dict[str, Any]) -> ManifestEntry:
+        """Запись в манифест по готовой сводке (см. summarize); вызывается после
+        фиксации импорта - вместе с файлом запоминается отпечаток его таблицы"""
+        columns = summary['columns']
+        entry = ManifestEntry(
+            path=state.path,
+            data_type=state.data_type,
+            file_type=os.path.splitext(state.path)[1].lower().lstrip('.'),
+            size=state.size,
+            mtime_ns=state.mtime_ns,
+            sha256=state.sha256 or file_sha256(state.path),
+            rows=summary['rows'],
+            schema_version=schema_version(columns),
+            columns=columns,
+            period_start=summary['period_start'],
+            period_end=summary['period_end'],
+            imported_at=datetime.now().isoformat(timespec='seconds')
+        )
+
+        conn = self._connect()
+        try:
+            entry.table_version = table_content_version(conn, entry.data_type)
+            values = [getattr(entry, name) for name in self._COLUMNS]
+            values[self._COLUMNS.index('columns')] = json.dumps(columns, ensure_ascii=False)
+            with conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {MANIFEST_TABLE} ({', '.join(self._COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in self._COLUMNS)})",
+                    values
+                )
+        finally:
+            conn.close()
+
+        logger.info(f"Манифест: {entry.data_type} {entry.path}, строк {entry.rows}, "
+                    f"схема {entry.schema_version}, период {entry.period_start} - {entry.period_end}")
+        return entry
+
+    @staticmethod
+    def _period(data_type: str, frames: List[pd.DataFrame]) -> Tuple[Optional[str], Optional[str]]:
+        """Период данных файла по столбцу дат (минимум и максимум по всем чанкам)"""
+        column = PERIOD_COLUMNS.get(data_type)
+        starts, ends = [], []
+        for frame in frames:
+            if column not in frame.columns:
+                continue
+            dates = pd.to_datetime(frame[column], errors='coerce').dropna()
+            if len(dates):
+                starts.append(dates.min())
+                ends.append(dates.max())
+        if not starts:
+            return None, None
+        return min(starts).strftime('%Y-%m-%d'), max(ends).strftime('%Y-%m-%d')
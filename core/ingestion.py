@@ -0,0 +1,266 @@
+# core/ingestion.py
+"""
+Параллельная загрузка users/boxbase: каждый файл разбирается в отдельном процессе,
+готовые чанки передаются через ограниченную очередь в основной процесс, где
+единственный писатель собирает их в итоговые таблицы и импортирует в SQLite.
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from core.data_loader import CSV_CHUNK_SIZE, DataLoader
+from core.import_manifest import ImportManifest, SourceState
+from core.sqlite_import import ImportDelta, IncrementalImporter
+
+logger = logging.getLogger(__name__)
+
+# Максимум чанков в очереди между разборщиками и писателем (ограничивает память)
+INGEST_QUEUE_SIZE = 8
+
+# Период опроса очереди и флага отмены (секунд)
+QUEUE_POLL_SECONDS = 0.1
+
+
+class IngestionCancelled(Exception):
+    """Загрузка остановлена по запросу пользователя"""
+
+
+@dataclass
+class IngestionTask:
+    """Один файл для загрузки: тип данных ('users' или 'boxbase') и путь"""
+    data_type: str
+    file_path: str
+
+
+@dataclass
+class IngestionProgress:
+    """Прогресс разбора одного файла"""
+    data_type: str
+    file_path: str
+    total_bytes: int
+    rows_parsed: int = 0
+    bytes_read: int = 0
+    status: str = 'pending'  # pending | running | done | skipped | error | cancelled
+    error: Optional[str] = None
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def fraction(self) -> float:
+        """Доля прочитанного файла (0..1)"""
+        if self.status in ('done', 'skipped'):
+            return 1.0
+        if self.total_bytes <= 0:
+            return 0.0
+        return min(self.bytes_read / self.total_bytes, 1.0)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """Оценка оставшегося времени по скорости чтения (None, пока оценки нет)"""
+        if self.status in ('done', 'skipped'):
+            return 0.0
+        if self.bytes_read <= 0 or self.total_bytes <= 0:
+            return None
+        return self.elapsed * max(self.total_bytes - self.bytes_read, 0) / self.bytes_read
+
+
+def _parse_file(index: int, task: IngestionTask, chunk_queue, cancel_event, chunksize: int):
+    """Разбор одного файла в процессе пула: чанки и прогресс уходят в очередь"""
+    state = {'rows': 0, 'bytes': 0}
+
+    def on_chunk(rows: int, bytes_read: int):
+        state['rows'], state['bytes'] = rows, bytes_read
+
+    try:
+        loader = DataLoader()
+        for chunk in loader.iter_file_chunks(task.file_path, task.data_type, chunksize, progress=on_chunk):
+            if cancel_event.is_set():
+                chunk_queue.put(('cancelled', index))
+                return
+            chunk_queue.put(('chunk', index, chunk, state['rows'], state['bytes']))
+
+        chunk_queue.put(('done', index, state['rows'], state['bytes']))
+    except Exception as e:
+        chunk_queue.put(('error', index, f"{type(e).__name__}: {e}"))
+
+
+class ConcurrentIngestor:
+    """
+    Оркестратор параллельной загрузки нескольких файлов (users и один или
+    несколько boxbase). Прогресс по каждому файлу передается в callback,
+    вызываемый в потоке, запустившем run(); cancel() можно вызвать из любого потока.
+    С манифестом импорта файлы, не изменившиеся с прошлого импорта, не разбираются.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, chunksize: int = CSV_CHUNK_SIZE,
+                 queue_size: int = INGEST_QUEUE_SIZE, manifest: Optional[ImportManifest] = None):
+        self.max_workers = max_workers
+        self.chunksize = chunksize
+        self.queue_size = queue_size
+        self.manifest = manifest
+        self.progress: List[IngestionProgress] = []
+        self.errors: Dict[str, str] = {}
+        self._sources: Dict[int, SourceState] = {}
+        self._summaries: Dict[int, Dict] = {}
+        self._cancel_requested = threading.Event()
+        self._loader = DataLoader()
+
+    def cancel(self):
+        """Запрос отмены: разборщики останавливаются на границе чанка"""
+        self._cancel_requested.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_requested.is_set()
+
+    def run(self, tasks: List[IngestionTask],
+            on_progress: Optional[Callable[[IngestionProgress], None]] = None) -> Dict[str, pd.DataFrame]:
+        """Загрузка всех файлов; возвращает {тип данных: объединенный DataFrame}.
+
+        Файлы с ошибками не прерывают остальные: ошибки собираются в self.errors.
+        При отмене возбуждается IngestionCancelled, частичные результаты отбрасываются.
+        """
+        for task in tasks:
+            if task.data_type not in ('users', 'boxbase'):
+                raise ValueError(f"Неизвестный тип данных: {task.data_type}")
+            if not os.path.exists(task.file_path):
+                raise FileNotFoundError(f"Файл не найден: {task.file_path}")
+
+        self.errors = {}
+        self.progress = [IngestionProgress(task.data_type, task.file_path, os.path.getsize(task.file_path))
+                         for task in tasks]
+        chunks: List[List[pd.DataFrame]] = [[] for _ in tasks]
+        self._sources, self._summaries = {}, {}
+
+        def report(index: int):
+            if on_progress is not None:
+                on_progress(self.progress[index])
+
+        pending = set(range(len(tasks)))
+        if self.manifest is not None:
+            for index, task in enumerate(tasks):
+                state = self.manifest.check(task.file_path, task.data_type)
+                if state.unchanged:
+                    self.progress[index].status = 'skipped'
+                    pending.discard(index)
+                    logger.info(f"{task.data_type}: {task.file_path} не изменился с прошлого импорта, пропуск")
+                    report(index)
+                else:
+                    self._sources[index] = state
+
+        if not pending:
+            return {}
+
+        max_workers = self.max_workers or min(len(pending), os.cpu_count() or 1)
+
+        with multiprocessing.Manager() as manager:
+            chunk_queue = manager.Queue(maxsize=self.queue_size)
+            cancel_event = manager.Event()
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    index: executor.submit(_parse_file, index, tasks[index], chunk_queue, cancel_event,
+                                           self.chunksize)
+                    for index in sorted(pending)
+                }
+                for index in futures:
+                    self.progress[index].status = 'running'
+                    report(index)
+
+                while pending:
+                    if self._cancel_requested.is_set() and not cancel_event.is_set():
+                        cancel_event.set()
+                        logger.info("Загрузка отменена, ожидание остановки процессов")
+
+                    try:
+                        message = chunk_queue.get(timeout=QUEUE_POLL_SECONDS)
+                    except queue.Empty:
+                        # Процесс пула мог упасть, не успев отправить сообщение
+                        for index in list(pending):
+                            if futures[index].done() and futures[index].exception() is not None:
+                                self._fail(index, str(futures[index].exception()))
+                                pending.discard(index)
+                                report(index)
+                        continue
+
+                    kind, index = message[0], message[1]
+                    progress = self.progress[index]
+
+                    if kind == 'chunk':
+                        chunks[index].append(message[2])
+                        progress.rows_parsed, progress.bytes_read = message[3], message[4]
+                    elif kind == 'done':
+                        progress.rows_parsed, progress.bytes_read = message[2], message[3]
+                        progress.status = 'done'
+                        pending.discard(index)
+                    elif kind == 'error':
+                        self._fail(index, message[2])
+                        pending.discard(index)
+                    elif kind == 'cancelled':
+                        progress.status = 'cancelled'
+                        pending.discard(index)
+
+                    report(index)
+
+        if self._cancel_requested.is_set():
+            raise IngestionCancelled("Загрузка отменена")
+
+        # Сводки для манифеста считаются до объединения, пока чанки разделены по файлам
+        for index in self._sources:
+            if self.progress[index].status == 'done':
+                self._summaries[index] = ImportManifest.summarize(tasks[index].data_type, chunks[index])
+
+        return self._merge(tasks, chunks)
+
+    def _fail(self, index: int, error: str):
+        progress = self.progress[index]
+        progress.status = 'error'
+        progress.error = error
+        self.errors[progress.file_path] = error
+        logger.error(f"Ошибка загрузки {progress.data_type} из {progress.file_path}: {error}")
+
+    def _merge(self, tasks: List[IngestionTask], chunks: List[List[pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+        """Объединение чанков по типу данных в порядке файлов и чанков"""
+        frames: Dict[str, pd.DataFrame] = {}
+        for data_type in ('users', 'boxbase'):
+            parts = [chunk for index, task in enumerate(tasks)
+                     if task.data_type == data_type and self.progress[index].status == 'done'
+                     for chunk in chunks[index]]
+            if not parts:
+                continue
+
+            df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+            # Категории и nullable-типы чанков могут различаться - план типов применяется к итогу
+            if data_type == 'users':
+                df = self._loader._apply_users_dtypes(df)
+            else:
+                df = self._loader._apply_boxbase_dtypes(df)
+
+            frames[data_type] = df
+            logger.info(f"Объединено {data_type}: {len(df)} строк из {len(parts)} чанков")
+
+        return frames
+
+    def write_to_sqlite(self, frames: Dict[str, pd.DataFrame],
+                        db_path: str = 'neuro_data.db') -> Dict[str, ImportDelta]:
+        """Единственный писатель: инкрементальный импорт объединенных таблиц одним соединением.
+        После успешного импорта загруженные файлы записываются в манифест."""
+        deltas = IncrementalImporter(db_path).import_frames(frames)
+        for delta in deltas.values():
+            logger.info(f"Сохранено в SQLite: {delta}")
+
+        if self.manifest is not None:
+            for index, summary in self._summaries.items():
+                self.manifest.record_summary(self._sources[index], summary)
+        return deltas
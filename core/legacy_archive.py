@@ -0,0 +1,209 @@
+# core/legacy_archive.py
+"""
+Сжатый архив исходных строк raw_legacy_data: JSON строки users/boxbase хранится
+в raw_blob, сжатый zlib со словарем (zdict), общим для всех строк одной схемы
+источника. Словарь - шаблон ключей схемы, поэтому 130 повторяющихся имен
+столбцов boxbase в каждой строке сжимаются в ссылки на словарь.
+Строки распаковываются только по запросу: поштучно или пакетами.
+"""
+import json
+import logging
+import sqlite3
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from core.import_manifest import schema_version
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_DICT_TABLE = 'raw_schema_dicts'
+
+# Уровень сжатия zlib (6 - стандартный баланс скорости и размера)
+COMPRESSION_LEVEL = 6
+
+# Строк в одном пакете при потоковом чтении и при пересжатии архива
+ARCHIVE_BATCH_SIZE = 5000
+
+
+def schema_zdict(columns: Sequence[str]) -> bytes:
+    """Словарь zlib для схемы: ключи JSON-объекта строки в исходном порядке.
+    Наиболее частые подстроки должны стоять в конце словаря - ключи идут в том же
+    порядке, что и в строке, поэтому ближайшие ссылки оказываются самыми короткими."""
+    return ('{' + ', '.join(json.dumps(str(column)) + ': ' for column in columns)).encode('utf-8')
+
+
+class LegacyArchive:
+    """
+    Чтение и запись сжатых строк raw_legacy_data.
+
+    Строка архива хранится либо сжатой (schema_id + raw_blob), либо, для строк,
+    записанных до появления архива, JSON-текстом в raw_data.
+    """
+
+    def __init__(self, db_path: str = 'neuro_data.db', level: int = COMPRESSION_LEVEL):
+        self.db_path = db_path
+        self.level = level
+        self._zdicts: Dict[int, bytes] = {}
+
+    @staticmethod
+    def ensure_schema(conn: sqlite3.Connection):
+        """Таблица словарей схем и столбцы schema_id/raw_blob в raw_legacy_data"""
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {SCHEMA_DICT_TABLE} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source_table TEXT NOT NULL,
+                schema_version TEXT NOT NULL,
+                columns JSON,
+                zdict BLOB,
+                UNIQUE (source_table, schema_version)
+            )
+        ''')
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(raw_legacy_data)")]
+        if columns and 'schema_id' not in columns:
+            conn.execute("ALTER TABLE raw_legacy_data ADD COLUMN schema_id INTEGER")
+        if columns and 'raw_blob' not in columns:
+            conn.execute("ALTER TABLE raw_legacy_data ADD COLUMN raw_blob BLOB")
+
+    def schema_id(self, conn: sqlite3.Connection, source_table: str, columns: Sequence[str]) -> int:
+        """Идентификатор схемы источника (словарь создается при первом обращении)"""
+        # Словарь ищется в базе при каждом обращении: запись, сделанная в откаченной
+        # транзакции, не должна остаться в кэше
+        columns = [str(column) for column in columns]
+        key = (source_table, schema_version(columns))
+        row = conn.execute(
+            f"SELECT id, zdict FROM {SCHEMA_DICT_TABLE} WHERE source_table = ? AND schema_version = ?", key
+        ).fetchone()
+        if row is None:
+            zdict = schema_zdict(columns)
+            cursor = conn.execute(
+                f"INSERT INTO {SCHEMA_DICT_TABLE} (source_table, schema_version, columns, zdict) VALUES (?, ?, ?, ?)",
+                (*key, json.dumps(columns, ensure_ascii=False), zdict)
+            )
+            row = (cursor.lastrowid, zdict)
+
+        self._zdicts[row[0]] = row[1]
+        return row[0]
+
+    def compress(self, conn: sqlite3.Connection, source_table: str, columns: Sequence[str],
+                 texts: Iterable[str]) -> Tuple[int, List[bytes]]:
+        """JSON-тексты строк одной схемы -> (schema_id, сжатые BLOB-ы)"""
+        schema = self.schema_id(conn, source_table, columns)
+        return schema, self.compress_texts(texts, self._zdicts[schema], self.level)
+
+    @staticmethod
+    def compress_texts(texts: Iterable[str], zdict: bytes, level: int = COMPRESSION_LEVEL) -> List[bytes]:
+        """Сжатие JSON-текстов со словарем схемы без обращения к базе
+        (для процессов, готовящих строки к записи)"""
+        # Компрессор со словарем инициализируется один раз, строки сжимаются его копиями
+        primed = zlib.compressobj(level, zdict=zdict)
+        blobs = []
+        for text in texts:
+            compressor = primed.copy()
+            blobs.append(compressor.compress(text.encode('utf-8')) + compressor.flush())
+        return blobs
+
+    def _zdict(self, conn: sqlite3.Connection, schema: int) -> bytes:
+        if schema not in self._zdicts:
+            row = conn.execute(f"SELECT zdict FROM {SCHEMA_DICT_TABLE} WHERE id = ?", (schema,)).fetchone()
+            if row is None:
+                raise ValueError(f"Словарь схемы {schema} не найден в {SCHEMA_DICT_TABLE}")
+            self._zdicts[schema] = row[0]
+        return self._zdicts[schema]
+
+    def decompress(self, conn: sqlite3.Connection, schema: int, blob: bytes) -> str:
+        """Сжатый BLOB -> JSON-текст исходной строки"""
+        decompressor = zlib.decompressobj(zdict=self._zdict(conn, schema))
+        return (decompressor.decompress(blob) + decompressor.flush()).decode('utf-8')
+
+    def _row_text(self, conn: sqlite3.Connection, schema: Optional[int], blob: Optional[bytes],
+                  raw_data: Optional[str]) -> Optional[str]:
+        if blob is not None:
+            return self.decompress(conn, schema, blob)
+        return raw_data
+
+    def get(self, legacy_id: int) -> Optional[dict]:
+        """Исходная строка по id raw_legacy_data (распаковывается только она)"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute(
+                "SELECT schema_id, raw_blob, raw_data FROM raw_legacy_data WHERE id = ?", (legacy_id,)
+            ).fetchone()
+            text = self._row_text(conn, *row) if row else None
+        finally:
+            conn.close()
+        return json.loads(text) if text is not None else None
+
+    def iter_records(self, source_table: Optional[str] = None,
+                     batch_size: int = ARCHIVE_BATCH_SIZE) -> Iterator[List[Tuple[int, object, dict]]]:
+        """Пакеты (id, original_id, исходная строка) в порядке id; в памяти - один пакет"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            condition = "AND source_table = ?" if source_table else ""
+            params = (source_table,) if source_table else ()
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    f"SELECT id, original_id, schema_id, raw_blob, raw_data FROM raw_legacy_data "
+                    f"WHERE id > ? {condition} ORDER BY id LIMIT ?",
+                    (last_id, *params, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                yield [(legacy_id, original_id, json.loads(self._row_text(conn, schema, blob, raw_data) or 'null'))
+                       for legacy_id, original_id, schema, blob, raw_data in rows]
+        finally:
+            conn.close()
+
+    def iter_frames(self, source_table: str, batch_size: int = ARCHIVE_BATCH_SIZE) -> Iterator[pd.DataFrame]:
+        """Пакеты исходных строк источника как DataFrame (индекс - id raw_legacy_data)"""
+        for records in self.iter_records(source_table, batch_size):
+            frame = pd.DataFrame.from_records([record for _, _, record in records],
+                                              index=pd.Index([legacy_id for legacy_id, _, _ in records], name='id'))
+            yield frame
+
+    def compress_existing(self, batch_size: int = ARCHIVE_BATCH_SIZE) -> dict:
+        """Пересжатие строк raw_legacy_data, записанных JSON-текстом.
+        Сжатая строка проверяется распаковкой до удаления JSON."""
+        stats = {'compressed': 0, 'bytes_before': 0, 'bytes_after': 0}
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                self.ensure_schema(conn)
+
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    "SELECT id, source_table, raw_data FROM raw_legacy_data "
+                    "WHERE id > ? AND raw_data IS NOT NULL AND raw_blob IS NULL ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                updates = []
+                with conn:
+                    for legacy_id, source_table, raw_data in rows:
+                        record = json.loads(raw_data)
+                        if not isinstance(record, dict):
+                            continue
+                        schema, (blob,) = self.compress(conn, source_table, list(record), [raw_data])
+                        if self.decompress(conn, schema, blob) != raw_data:
+                            raise ValueError(f"Строка raw_legacy_data {legacy_id} не восстанавливается после сжатия")
+                        updates.append((schema, blob, legacy_id))
+                        stats['bytes_before'] += len(raw_data.encode('utf-8'))
+                        stats['bytes_after'] += len(blob)
+                    conn.executemany(
+                        "UPDATE raw_legacy_data SET schema_id = ?, raw_blob = ?, raw_data = NULL WHERE id = ?",
+                        updates
+                    )
+                stats['compressed'] += len(updates)
+
+            logger.info(f"Архив raw_legacy_data: сжато {stats['compressed']} строк, "
+                        f"{stats['bytes_before']:,} -> {stats['bytes_after']:,} байт")
+            return stats
+        finally:
+            conn.close()
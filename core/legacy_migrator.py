@@ -1,16 +1,138 @@
 # core/legacy_migrator.py
 import sqlite3
 import json
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import os
 import logging
+from dataclasses import dataclass, field
+from itertools import repeat
+from typing import List, Optional
+
+from core.bulk_writer import BulkSQLiteWriter, iter_frame_rows
+from core.excel_reader import XlsxStreamReader
+from core.legacy_archive import LegacyArchive, SCHEMA_DICT_TABLE, schema_zdict
+from core.migration_checkpoint import CHECKPOINT_TABLE, CheckpointStore, SourceChangedError
+from core.reaction_matrix import ReactionTimeCube, TEST_PREFIXES
+from core.reaction_storage import ensure_packed_schema, pack_reaction_times, packable_reaction_times
+
+# Сессий boxbase в одной транзакции пакетной миграции
+MIGRATION_BATCH_SIZE = 10_000
+
+# Типы визуальных тестов в порядке Tst1..Tst3
+VISUAL_TEST_TYPES = ('simple_color', 'color_red', 'shift')
+
+# Таблица отклоненных при пакетной миграции строк
+REJECTS_TABLE = 'migration_rejects'
+
+
+# Наибольший диапазон целых, для которого строится таблица строковых представлений
+_INTEGER_TEXT_TABLE_LIMIT = 1 << 20
+
+
+def _format_integers(values, prefix='', suffix=''):
+    """Массив целых -> массив строк prefix + число + suffix; при небольшом диапазоне
+    значений каждое число форматируется один раз (таблица + выборка по индексу)"""
+    values = np.asarray(values, dtype=np.int64)
+    if values.size == 0:
+        return np.empty(values.shape, dtype=object)
+    low, high = int(values.min()), int(values.max())
+    if high - low <= _INTEGER_TEXT_TABLE_LIMIT:
+        table = np.array([f'{prefix}{number}{suffix}' for number in range(low, high + 1)], dtype=object)
+        return table[values - low]
+    return np.array([f'{prefix}{number}{suffix}' for number in values.ravel().tolist()],
+                    dtype=object).reshape(values.shape)
+
+
+def _json_values(series, key):
+    """Пары '"ключ": значение' столбца в том виде, в каком их пишет
+    json.dumps(row.to_dict(), default=str) при построчной миграции"""
+    prefix = json.dumps(str(key)) + ': '
+    values = series.to_numpy()
+
+    if values.dtype.kind in 'iu':
+        return _format_integers(values, prefix)
+
+    if values.dtype.kind == 'f':
+        missing = np.isnan(values)
+        whole = np.where(missing, 0, values)
+        # Целые float (188.0) json.dumps пишет как '188.0'; экспоненциальная запись - с 1e16
+        if (whole == np.round(whole)).all() and np.abs(whole).max(initial=0) < 1e16:
+            text = _format_integers(whole, prefix, '.0')
+            text[missing] = prefix + 'NaN'
+            return text
+
+    if values.dtype == np.float64:
+        # Дробные значения форматируются по одному разу на различное значение (по битам:
+        # -0.0 и 0.0 пишутся по-разному)
+        uniques, inverse = np.unique(values.view(np.int64), return_inverse=True)
+        table = np.array([prefix + json.dumps(value) for value in uniques.view(np.float64).tolist()], dtype=object)
+        return table[inverse.ravel()]
+
+    if values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        # Строки (даты, время, справочные тексты) сильно повторяются: json.dumps - на различное значение,
+        # пропуски (None -> null, NaN -> NaN) форматируются поштучно
+        missing = pd.isna(values)
+        codes, uniques = pd.factorize(values)
+        table = np.array([prefix + json.dumps(value) for value in uniques.tolist()], dtype=object)
+        text = table[np.where(missing, 0, codes)] if len(uniques) else np.empty(len(values), dtype=object)
+        if missing.any():
+            text[missing] = [prefix + json.dumps(value, default=str) for value in values[missing].tolist()]
+        return text
+
+    return np.array([prefix + json.dumps(value, default=str) for value in series.to_numpy(dtype=object).tolist()],
+                    dtype=object)
+
+
+def _frame_column(df, name, default=None):
+    """Столбец фрейма или столбец значений по умолчанию, если его нет"""
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _as_text(series):
+    """Как str(row.get(...)) в построчной миграции"""
+    return [str(value) for value in series.tolist()]
+
+
+def _as_objects(series):
+    """Значения Python для sqlite3 (пропуски -> None)"""
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def _json_objects(columns):
+    """Столбцы пар '"ключ": значение' -> JSON-объект на каждую строку"""
+    rows = np.stack(columns, axis=1)
+    return ['{' + ', '.join(row) + '}' for row in rows.tolist()]
+
+
+@dataclass
+class BoxbaseBatchRows:
+    """Пакет boxbase, подготовленный к записи (идентификаторы выделяет писатель)"""
+    rows_read: int
+    last_key: Optional[int]
+    columns: List[str]
+    original_ids: list = field(default_factory=list)
+    raw_blobs: List[bytes] = field(default_factory=list)
+    sessions: List[tuple] = field(default_factory=list)
+    packed_times: list = field(default_factory=list)
+    json_times: list = field(default_factory=list)
+    aggregates: List[str] = field(default_factory=list)
+    reject_ids: list = field(default_factory=list)
+    reject_reasons: List[str] = field(default_factory=list)
+    reject_json: List[str] = field(default_factory=list)
 
 
 class LegacyMigrator:
     def __init__(self, db_path='neuro_data.db'):
         self.db_path = db_path
         self.logger = logging.getLogger(__name__)
+        # Исходные строки хранятся сжатыми со словарем схемы источника
+        self.archive = LegacyArchive(db_path)
+        # Контрольные точки пакетной миграции (продолжение после прерывания)
+        self.checkpoints = CheckpointStore()
 
     def initialize_new_schema(self):
         """Создание новой схемы базы данных с поддержкой нейромедиаторного анализа"""
@@ -24,6 +146,9 @@ class LegacyMigrator:
                 conn.execute('DROP TABLE IF EXISTS motor_tests')
                 conn.execute('DROP TABLE IF EXISTS test_relationships')
                 conn.execute('DROP TABLE IF EXISTS neurotransmitter_profiles')
+                conn.execute(f'DROP TABLE IF EXISTS {REJECTS_TABLE}')
+                conn.execute(f'DROP TABLE IF EXISTS {SCHEMA_DICT_TABLE}')
+                conn.execute(f'DROP TABLE IF EXISTS {CHECKPOINT_TABLE}')
 
                 # Таблица для сырых исторических данных
                 conn.execute('''
@@ -33,9 +158,14 @@ class LegacyMigrator:
                                  source_table TEXT,
                                  original_id  INTEGER,
                                  raw_data     JSON,
-                                 imported_at  DATETIME DEFAULT CURRENT_TIMESTAMP
+                                 imported_at  DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                 schema_id    INTEGER,
+                                 raw_blob     BLOB
                              )
                              ''')
+                # Словари сжатия исходных строк по схемам источников
+                LegacyArchive.ensure_schema(conn)
+                self.archive = LegacyArchive(self.db_path)
 
                 # Основные таблицы пациентов
                 conn.execute('''
@@ -88,9 +218,20 @@ class LegacyMigrator:
                                  analysis_version        TEXT     DEFAULT '1.0',
                                  is_processed            BOOLEAN  DEFAULT FALSE,
                                  processed_at            DATETIME,
-                                 created_at              DATETIME DEFAULT CURRENT_TIMESTAMP
+                                 created_at              DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                 reaction_times_packed   BLOB,
+                                 metrics_input_hash      TEXT,
+                                 metadata_version        TEXT
                              )
                              ''')
+                # JSON-представление времен реакции для старых инструментов
+                ensure_packed_schema(conn)
+
+                # Строки, отклоненные при миграции (с причиной и исходными данными)
+                self._ensure_rejects_table(conn)
+
+                # Контрольные точки пакетной миграции
+                self.checkpoints.ensure_table(conn)
 
                 print("✅ Новая схема базы данных создана")
 
@@ -98,20 +239,92 @@ class LegacyMigrator:
             print(f"❌ Ошибка создания схемы БД: {e}")
             raise
 
-    def migrate_patients_from_xlsx(self, xlsx_path):
-        """Миграция пациентов из users.xlsx"""
+    @staticmethod
+    def _read_excel(path):
+        """Чтение Excel целиком: .xlsx - пакетами через openpyxl read_only со склейкой
+        в один фрейм, остальное - через pandas.
+
+        Память здесь не плоская: миграции нужен весь источник - boxbase упорядочивается
+        по cnt для контрольных точек, а сырые данные сериализуются с типами столбцов
+        всего файла, а не отдельного пакета."""
+        if path.endswith('.xlsx'):
+            return XlsxStreamReader().read_frame(path)
+        return pd.read_excel(path)
+
+    @staticmethod
+    def _ensure_rejects_table(conn):
+        conn.execute(f'''
+                     CREATE TABLE IF NOT EXISTS {REJECTS_TABLE}
+                     (
+                         id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                         source_table TEXT,
+                         original_id  TEXT,
+                         reason       TEXT,
+                         raw_data     JSON,
+                         rejected_at  DATETIME DEFAULT CURRENT_TIMESTAMP
+                     )
+                     ''')
+
+    def _record_rejects(self, conn, source_table, original_ids, reasons, rows):
+        """Запись отклоненных строк исходной таблицы в migration_rejects"""
+        raw_json = _json_objects([_json_values(rows[col], col) for col in rows.columns]) if len(rows.columns) \
+            else ['{}'] * len(rows)
+        self._insert_rejects(conn, source_table,
+                             [None if value is None else str(value) for value in _as_objects(original_ids)],
+                             reasons, raw_json)
+
+    def _insert_rejects(self, conn, source_table, original_ids, reasons, raw_json):
+        self._ensure_rejects_table(conn)
+        conn.executemany(
+            f'INSERT INTO {REJECTS_TABLE} (source_table, original_id, raw_data, reason) VALUES (?, ?, ?, ?)',
+            zip(repeat(source_table), original_ids, raw_json, reasons)
+        )
+
+    def migrate_patients_from_xlsx(self, xlsx_path, bulk=True):
+        """Миграция пациентов из users.xlsx.
+
+        bulk=True - пакетный режим: обе таблицы пишутся executemany в одной транзакции
+        вместе с контрольной точкой, строки без корректного ID попадают в migration_rejects.
+        Уже мигрированный файл (по контрольной точке) повторно не переносится.
+        bulk=False - прежняя построчная миграция.
+        """
         try:
-            df = pd.read_excel(xlsx_path)
+            checkpoint = None
+            if bulk:
+                checkpoint = self._start_checkpoint('users', xlsx_path)
+                if checkpoint.completed:
+                    print(f"⏭️ Пациенты из {os.path.basename(xlsx_path)} уже мигрированы "
+                          f"({checkpoint.migrated}), пропуск")
+                    return
+
+            df = self._read_excel(xlsx_path)
             print(f"📊 Загружено {len(df)} пациентов из XLSX")
 
-            with sqlite3.connect(self.db_path) as conn:
+            if bulk:
+                with BulkSQLiteWriter(self.db_path) as writer:
+                    migrated, rejected = self._migrate_patients_bulk(writer.connection, df, checkpoint)
+                    writer.record_rows(migrated * 2 + rejected)
+
+                print(f"✅ Мигрировано пациентов: {migrated}")
+                if rejected:
+                    print(f"⚠️ Отклонено пациентов: {rejected}, подробности - в {REJECTS_TABLE}")
+                print(f"⏱️ Пациенты: {writer.summary()}")
+                return
+
+            migrated = 0
+            with BulkSQLiteWriter(self.db_path) as writer:
+                conn = writer.connection
                 for _, row in df.iterrows():
                     try:
                         # Сохраняем сырые данные
                         raw_data = row.to_dict()
+                        schema_id, (raw_blob,) = self.archive.compress(
+                            conn, 'users', list(raw_data), [json.dumps(raw_data, default=str)]
+                        )
                         cursor = conn.execute(
-                            'INSERT INTO raw_legacy_data (source_table, original_id, raw_data) VALUES (?, ?, ?)',
-                            ('users', row['ID'], json.dumps(raw_data, default=str))
+                            'INSERT INTO raw_legacy_data (source_table, original_id, schema_id, raw_blob) '
+                            'VALUES (?, ?, ?, ?)',
+                            ('users', row['ID'], schema_id, raw_blob)
                         )
                         legacy_id = cursor.lastrowid
 
@@ -130,23 +343,122 @@ class LegacyMigrator:
                                          row.get('Gender', 0),
                                          legacy_id
                                      ))
+                        migrated += 1
                     except Exception as e:
                         print(f"⚠️ Ошибка миграции пациента ID {row.get('ID', 'unknown')}: {e}")
                         continue
 
-                print(f"✅ Мигрировано пациентов: {len(df)}")
+                # Две строки на пациента: raw_legacy_data и patients
+                writer.record_rows(migrated * 2)
 
+            print(f"✅ Мигрировано пациентов: {len(df)}")
+            print(f"⏱️ Пациенты: {writer.summary()}")
+
+        except SourceChangedError:
+            # Продолжать полную миграцию нельзя - ошибка передается вызывающему
+            raise
         except Exception as e:
             print(f"❌ Ошибка миграции пациентов: {e}")
             import traceback
             traceback.print_exc()
 
-    def migrate_boxbase_data(self, source_path):
-        """Миграция данных тестирования из boxbase"""
+    def _start_checkpoint(self, source_table, source_path):
+        """Контрольная точка источника: сохраненная или новая"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                return self.checkpoints.start(conn, source_table, source_path)
+        finally:
+            conn.close()
+
+    def _migrate_patients_bulk(self, conn, df, checkpoint=None):
+        """Пакетная миграция пациентов; возвращает (мигрировано, отклонено)"""
+        if 'ID' in df.columns:
+            ids = pd.to_numeric(df['ID'], errors='coerce')
+            valid = (ids.notna() & (ids == ids.round())).to_numpy()
+            reasons = np.where(df['ID'].isna(), 'ID отсутствует', 'ID не является целым числом')
+        else:
+            ids = pd.Series(np.nan, index=df.index)
+            valid = np.zeros(len(df), dtype=bool)
+            reasons = np.full(len(df), 'Нет столбца ID', dtype=object)
+
+        # Сырые данные всех строк сериализуются за один проход по столбцам
+        raw_json = np.array(_json_objects([_json_values(df[col], col) for col in df.columns]), dtype=object) \
+            if len(df) else np.empty(0, dtype=object)
+
+        accepted = df[valid]
+        n_patients = len(accepted)
+
+        with conn:
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+
+            if not valid.all():
+                rejected = df[~valid]
+                self._record_rejects(conn, 'users', _frame_column(rejected, 'ID'), reasons[~valid].tolist(), rejected)
+
+            legacy_start = self._next_id(conn, 'raw_legacy_data')
+            patient_start = self._next_id(conn, 'patients')
+            legacy_ids = list(range(legacy_start, legacy_start + n_patients))
+            external_ids = ids[valid].astype(np.int64).tolist()
+            schema_id, raw_blobs = self.archive.compress(conn, 'users', list(df.columns), raw_json[valid].tolist())
+
+            conn.executemany(
+                'INSERT INTO raw_legacy_data (id, source_table, original_id, schema_id, raw_blob) '
+                'VALUES (?, ?, ?, ?, ?)',
+                zip(legacy_ids, repeat('users'), external_ids, repeat(schema_id), raw_blobs)
+            )
+
+            conn.executemany('''
+                             INSERT INTO patients
+                             (id, external_id, fname, sname, lname, yborn, regdate, gender, legacy_data_id)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                             ''', zip(
+                                 range(patient_start, patient_start + n_patients),
+                                 external_ids,
+                                 _as_text(_frame_column(accepted, 'FName', '')),
+                                 _as_text(_frame_column(accepted, 'SName', '')),
+                                 _as_text(_frame_column(accepted, 'LName', '')),
+                                 _as_text(_frame_column(accepted, 'YBorn', '')),
+                                 _as_text(_frame_column(accepted, 'RegDate', '')),
+                                 _as_objects(_frame_column(accepted, 'Gender', 0)),
+                                 legacy_ids
+                             ))
+
+            if checkpoint is not None:
+                checkpoint.advance(max(external_ids) if external_ids else None,
+                                   len(df), n_patients, len(df) - n_patients)
+                checkpoint.completed = True
+                self.checkpoints.save(conn, checkpoint)
+
+        return n_patients, len(df) - n_patients
+
+    def migrate_boxbase_data(self, source_path, bulk=True, workers=None):
+        """Миграция данных тестирования из boxbase.
+
+        bulk=True - пакетный режим: идентификаторы выделяются блоками, строки всех
+        таблиц собираются массивами и пишутся executemany, одна транзакция на пакет
+        вместе с контрольной точкой (последний cnt). Прерванная миграция того же
+        файла продолжается с пакета, следующего за последним зафиксированным.
+        workers=N - пакетный режим конвейером: подготовка пакетов в N процессах,
+        запись - единственным процессом-писателем (см. core.migration_pipeline).
+        bulk=False - прежняя построчная миграция.
+        """
         try:
+            checkpoint = None
+            if bulk or workers:
+                checkpoint = self._start_checkpoint('boxbase', source_path)
+                if checkpoint.completed:
+                    print(f"⏭️ Сессии из {os.path.basename(source_path)} уже мигрированы "
+                          f"({checkpoint.migrated}), пропуск")
+                    return
+                if checkpoint.batch_no:
+                    print(f"⏩ Продолжение миграции с пакета {checkpoint.batch_no + 1} "
+                          f"(последний cnt: {checkpoint.last_key}, мигрировано: {checkpoint.migrated})")
+
             # Загрузка данных
             if source_path.endswith('.xlsx'):
-                data = pd.read_excel(source_path)
+                data = self._read_excel(source_path)
             elif source_path.endswith('.csv'):
                 data = pd.read_csv(source_path)
             else:
@@ -155,34 +467,300 @@ class LegacyMigrator:
 
             print(f"📊 Загружено {len(data)} записей тестирования")
 
-            migrated_sessions = 0
-            migrated_tests = 0
+            if workers:
+                from core.migration_pipeline import MigrationPipeline
+
+                pipeline = MigrationPipeline(self.db_path, workers)
+                migrated_sessions, rejected = pipeline.run(data, checkpoint)
+                if rejected:
+                    print(f"⚠️ Пропущено сессий: {rejected}, пациенты не найдены в mapping, "
+                          f"подробности - в {REJECTS_TABLE}")
+                print(f"✅ Мигрировано сессий: {migrated_sessions}, "
+                      f"тестов: {migrated_sessions * len(VISUAL_TEST_TYPES)}")
+                print(f"⏱️ Boxbase: {pipeline.writer_summary}")
+                for line in pipeline.stats_report():
+                    print(line)
+                return
 
-            with sqlite3.connect(self.db_path) as conn:
-                # Создаем mapping external_id -> internal_id
-                cursor = conn.execute("SELECT id, external_id FROM patients")
-                patient_mapping = {row[1]: row[0] for row in cursor.fetchall()}
-                print(f"🔍 Создан mapping пациентов: {len(patient_mapping)} записей")
+            with BulkSQLiteWriter(self.db_path) as writer:
+                conn = writer.connection
+                if bulk:
+                    migrated_sessions, migrated_tests = self._migrate_boxbase_bulk(conn, data, checkpoint)
+                else:
+                    migrated_sessions, migrated_tests = self._migrate_boxbase_rows(conn, data)
 
-                for _, record in data.iterrows():
-                    try:
-                        session_id = self._migrate_single_test_session(conn, record, patient_mapping)
-                        if session_id:
-                            migrated_sessions += 1
-                            migrated_tests += 3  # По три теста на сессию
-                    except Exception as e:
-                        session_id = record.get('cnt', 'unknown')
-                        print(f"⚠️ Ошибка миграции сессии {session_id}: {e}")
-                        continue
+                # raw_legacy_data + testing_sessions на сессию и строки visual_tests
+                writer.record_rows(migrated_sessions * 2 + migrated_tests)
 
             print(f"✅ Мигрировано сессий: {migrated_sessions}, тестов: {migrated_tests}")
+            print(f"⏱️ Boxbase: {writer.summary()}")
 
+        except SourceChangedError:
+            # Продолжать полную миграцию нельзя - ошибка передается вызывающему
+            raise
         except Exception as e:
             print(f"❌ Ошибка миграции boxbase: {e}")
             import traceback
             traceback.print_exc()
 
-    def _migrate_single_test_session(self, conn, record, patient_mapping):
+    def _migrate_boxbase_rows(self, conn, data):
+        """Построчная миграция boxbase; возвращает (число сессий, число тестов)"""
+        migrated_sessions = 0
+        migrated_tests = 0
+
+        # Создаем mapping external_id -> internal_id
+        cursor = conn.execute("SELECT id, external_id FROM patients")
+        patient_mapping = {row[1]: row[0] for row in cursor.fetchall()}
+        print(f"🔍 Создан mapping пациентов: {len(patient_mapping)} записей")
+
+        # Времена реакции всех сессий собираются в один массив (n_sessions, 3, 36)
+        cube = ReactionTimeCube.from_boxbase(data)
+
+        for position, (_, record) in enumerate(data.iterrows()):
+            try:
+                session_id = self._migrate_single_test_session(conn, record, patient_mapping,
+                                                               cube.reaction_times[position])
+                if session_id:
+                    migrated_sessions += 1
+                    migrated_tests += 3  # По три теста на сессию
+            except Exception as e:
+                session_id = record.get('cnt', 'unknown')
+                print(f"⚠️ Ошибка миграции сессии {session_id}: {e}")
+                continue
+
+        return migrated_sessions, migrated_tests
+
+    def _migrate_boxbase_bulk(self, conn, data, checkpoint=None):
+        """Пакетная миграция boxbase; возвращает (число сессий, число тестов).
+
+        Пакет - MIGRATION_BATCH_SIZE строк источника по возрастанию cnt; его сессии,
+        отклоненные строки и контрольная точка фиксируются одной транзакцией."""
+        data = self._resume_order(data, checkpoint)
+        patients = self._patient_lookup(conn)
+        print(f"🔍 Создан mapping пациентов: {len(patients)} записей")
+
+        reg_ids = data['REG_ID'] if 'REG_ID' in data.columns else pd.Series(np.nan, index=data.index)
+        matched, patient_ids = self._match_patients(patients, reg_ids)
+        cube = ReactionTimeCube.from_boxbase(data)
+
+        migrated_sessions = 0
+        for start in range(0, len(data), MIGRATION_BATCH_SIZE):
+            stop = min(start + MIGRATION_BATCH_SIZE, len(data))
+            batch = data.iloc[start:stop]
+            accepted = matched[start:stop]
+
+            rows = self._build_boxbase_batch(batch, accepted, patient_ids[start:stop],
+                                             cube.reaction_times[start:stop])
+            self._commit_boxbase_batch(conn, rows, checkpoint, completed=stop == len(data))
+
+            migrated_sessions += int(accepted.sum())
+            if len(data) > MIGRATION_BATCH_SIZE:
+                print(f"   • пакет {checkpoint.batch_no if checkpoint else start // MIGRATION_BATCH_SIZE + 1}: "
+                      f"{stop}/{len(data)} строк")
+
+        if checkpoint is not None and not len(data):
+            with conn:
+                checkpoint.completed = True
+                self.checkpoints.save(conn, checkpoint)
+
+        if not matched.all():
+            missing = pd.unique(reg_ids[~matched])
+            print(f"⚠️ Пропущено сессий: {int((~matched).sum())}, пациенты не найдены в mapping "
+                  f"(REG_ID: {', '.join(str(value) for value in missing[:10])}"
+                  f"{' ...' if len(missing) > 10 else ''}), подробности - в {REJECTS_TABLE}")
+
+        return migrated_sessions, migrated_sessions * len(VISUAL_TEST_TYPES)
+
+    @staticmethod
+    def _resume_order(data, checkpoint=None):
+        """Строки boxbase по возрастанию cnt без уже мигрированных (по контрольной точке)"""
+        if 'cnt' in data.columns:
+            # Контрольная точка хранит последний cnt - строки обрабатываются по возрастанию
+            if not data['cnt'].is_monotonic_increasing:
+                data = data.sort_values('cnt', kind='stable')
+            if checkpoint is not None and checkpoint.last_key is not None:
+                done = (data['cnt'] <= checkpoint.last_key).to_numpy()
+                print(f"   • пропущено уже мигрированных строк: {int(done.sum())}")
+                data = data[~done]
+            data = data.reset_index(drop=True)
+        return data
+
+    @staticmethod
+    def _patient_lookup(conn):
+        """external_id -> patients.id (при повторах external_id - последний)"""
+        patients = pd.read_sql("SELECT id, external_id FROM patients", conn)
+        return patients.drop_duplicates('external_id', keep='last')
+
+    @staticmethod
+    def _match_patients(patients, reg_ids):
+        """Векторное сопоставление REG_ID -> patients.id: (маска найденных, id пациентов)"""
+        positions = pd.Index(patients['external_id']).get_indexer(reg_ids)
+        matched = positions >= 0
+        patient_ids = patients['id'].to_numpy()[np.where(matched, positions, 0)] if len(patients) \
+            else np.zeros(len(reg_ids), dtype=np.int64)
+        return matched, patient_ids
+
+    @staticmethod
+    def _build_boxbase_batch(batch, accepted, patient_ids, reaction_times):
+        """Строки пакета boxbase для записи: все, кроме идентификаторов.
+
+        Не обращается к базе, поэтому может выполняться в отдельном процессе.
+        accepted - маска строк с найденным пациентом, остальные становятся отклоненными.
+        """
+        keys = _as_objects(_frame_column(batch, 'cnt'))
+        rows = BoxbaseBatchRows(rows_read=len(batch), last_key=None if not keys or keys[-1] is None
+                                else int(keys[-1]), columns=[str(col) for col in batch.columns])
+
+        if not accepted.all():
+            rejected = batch[~accepted]
+            rows.reject_ids = [None if value is None else str(value)
+                               for value in _as_objects(_frame_column(rejected, 'cnt'))]
+            rows.reject_reasons = [f"Пациент REG_ID={value} не найден в mapping"
+                                   for value in _as_text(_frame_column(rejected, 'REG_ID'))]
+            rows.reject_json = _json_objects([_json_values(rejected[col], col) for col in rejected.columns]) \
+                if len(rejected.columns) else ['{}'] * len(rejected)
+
+        if not accepted.any():
+            return rows
+
+        batch = batch[accepted]
+        reaction_times = reaction_times[accepted]
+
+        def column(name, default=None):
+            return _frame_column(batch, name, default)
+
+        raw_json = _json_objects([_json_values(batch[col], col) for col in batch.columns])
+        rows.original_ids = _as_objects(column('cnt'))
+        rows.raw_blobs = LegacyArchive.compress_texts(raw_json, schema_zdict(rows.columns))
+
+        rows.sessions = list(iter_frame_rows(pd.DataFrame({
+            'patient_id': patient_ids[accepted],
+            'session_date': _as_text(column('CurrentDate', '')),
+            'session_time': _as_text(column('CurrentTime', '')),
+            'systolic_bp': column('AD1').to_numpy(),
+            'diastolic_bp': column('AD2').to_numpy(),
+            'conditions': column('VidSost_txt').to_numpy(),
+            'validity': column('VidSost').to_numpy()
+        })))
+
+        # Агрегаты трех тестов: JSON на каждую пару (сессия, тест), строки в порядке (сессия, тест)
+        aggregate_fields = []
+        for prefix in TEST_PREFIXES:
+            number = prefix[-1]
+            aggregate_fields.append(np.stack([
+                _json_values(column(f'result_{number}'), 'result'),
+                _json_values(column(f'SrKvadrOtkl_{number}'), 'std_dev'),
+                _json_values(column(f'RANO_POKAZ_{number}', 0), 'early_responses'),
+                _json_values(column(f'POZDNO_POKAZ_{number}', 0), 'late_responses')
+            ], axis=1))
+        rows.aggregates = _json_objects(list(np.stack(aggregate_fields, axis=1).reshape(-1, 4).T))
+        rows.packed_times, rows.json_times = LegacyMigrator._reaction_times_storage(
+            reaction_times.reshape(-1, reaction_times.shape[-1]))
+        return rows
+
+    def _commit_boxbase_batch(self, conn, rows, checkpoint=None, completed=False):
+        """Пакет и его контрольная точка - одной транзакцией"""
+        with conn:
+            # Идентификаторы выделяются блоками внутри транзакции записи
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            self._write_boxbase_batch(conn, rows)
+
+            if checkpoint is not None:
+                checkpoint.advance(rows.last_key, rows.rows_read, len(rows.sessions), len(rows.reject_ids))
+                checkpoint.completed = completed
+                self.checkpoints.save(conn, checkpoint)
+
+    def _write_boxbase_batch(self, conn, rows):
+        """Запись подготовленного пакета: отклоненные строки, raw_legacy_data,
+        testing_sessions и visual_tests (в транзакции вызывающего)"""
+        if rows.reject_ids:
+            self._insert_rejects(conn, 'boxbase', rows.reject_ids, rows.reject_reasons, rows.reject_json)
+
+        n_sessions = len(rows.sessions)
+        if not n_sessions:
+            return
+        n_tests = len(VISUAL_TEST_TYPES)
+
+        legacy_start = self._next_id(conn, 'raw_legacy_data')
+        session_start = self._next_id(conn, 'testing_sessions')
+        test_start = self._next_id(conn, 'visual_tests')
+        legacy_ids = range(legacy_start, legacy_start + n_sessions)
+        session_ids = range(session_start, session_start + n_sessions)
+
+        # Текстовые столбцы уже готовы - строки собираются напрямую из списков
+        schema_id = self.archive.schema_id(conn, 'boxbase', rows.columns)
+        conn.executemany(
+            'INSERT INTO raw_legacy_data (id, source_table, original_id, schema_id, raw_blob) '
+            'VALUES (?, ?, ?, ?, ?)',
+            zip(legacy_ids, repeat('boxbase'), rows.original_ids, repeat(schema_id), rows.raw_blobs)
+        )
+
+        conn.executemany('''
+                         INSERT INTO testing_sessions
+                         (id, patient_id, session_date, session_time, systolic_bp, diastolic_bp,
+                          conditions, validity, legacy_data_id)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                         ''', ((session_id, *session, legacy_id)
+                               for session_id, session, legacy_id in zip(session_ids, rows.sessions, legacy_ids)))
+
+        # Строки тестов упорядочены (сессия, тест), как в кубе
+        conn.executemany(
+            'INSERT INTO visual_tests '
+            '(id, session_id, test_type, raw_reaction_times, reaction_times_packed, raw_aggregates) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            zip(range(test_start, test_start + n_sessions * n_tests),
+                np.repeat(np.arange(session_start, session_start + n_sessions), n_tests).tolist(),
+                VISUAL_TEST_TYPES * n_sessions,
+                rows.json_times,
+                rows.packed_times,
+                rows.aggregates)
+        )
+
+    @staticmethod
+    def _next_id(conn, table):
+        """Первый свободный id таблицы с AUTOINCREMENT (с учетом sqlite_sequence)"""
+        max_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]
+        try:
+            row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        return max(max_id, row[0] if row else 0) + 1
+
+    @classmethod
+    def _reaction_times_storage(cls, matrix):
+        """Строки матрицы (n, 36) -> (упакованные BLOB, JSON-списки).
+
+        Строки, представимые в int16 без потерь, сохраняются упакованными (JSON - None);
+        остальные (дробные или слишком большие значения) - в прежнем JSON-формате."""
+        packable = packable_reaction_times(matrix)
+        packed = [None] * len(matrix)
+        json_times = [None] * len(matrix)
+        for index, blob in zip(np.flatnonzero(packable).tolist(), pack_reaction_times(matrix[packable])):
+            packed[index] = blob
+        if not packable.all():
+            rest = np.flatnonzero(~packable)
+            for index, text in zip(rest.tolist(), cls._reaction_times_json(matrix[rest])):
+                json_times[index] = text
+        return packed, json_times
+
+    @classmethod
+    def _reaction_times_json(cls, matrix):
+        """Строки матрицы (n, 36) -> JSON-списки, как json.dumps(_reaction_times_to_list(...)).
+
+        Целые значения форматируются векторно; строки с дробными значениями -
+        через построчное преобразование."""
+        valid = ~np.isnan(matrix)
+        whole = np.where(valid, matrix, 0)
+        integral = (whole == np.round(whole)).all(axis=1)
+
+        text = np.where(valid, _format_integers(whole.astype(np.int64)), 'null')
+        result = ['[' + ', '.join(row) + ']' for row in text.tolist()]
+        for index in np.flatnonzero(~integral):
+            result[index] = json.dumps(cls._reaction_times_to_list(matrix[index]))
+        return result
+
+    def _migrate_single_test_session(self, conn, record, patient_mapping, reaction_times=None):
         """Миграция одной сессии тестирования"""
         try:
             reg_id = record.get('REG_ID')
@@ -193,9 +771,12 @@ class LegacyMigrator:
             patient_id = patient_mapping[reg_id]
 
             # Сохранение сырых данных
+            schema_id, (raw_blob,) = self.archive.compress(
+                conn, 'boxbase', list(record.index), [json.dumps(record.to_dict(), default=str)]
+            )
             cursor = conn.execute(
-                'INSERT INTO raw_legacy_data (source_table, original_id, raw_data) VALUES (?, ?, ?)',
-                ('boxbase', record.get('cnt'), json.dumps(record.to_dict(), default=str))
+                'INSERT INTO raw_legacy_data (source_table, original_id, schema_id, raw_blob) VALUES (?, ?, ?, ?)',
+                ('boxbase', record.get('cnt'), schema_id, raw_blob)
             )
             legacy_id = cursor.lastrowid
 
@@ -217,10 +798,12 @@ class LegacyMigrator:
                                   ))
             session_id = cursor.lastrowid
 
-            # Миграция трех тестов
-            self._migrate_visual_test(conn, session_id, 'simple_color', record, 'Tst1')
-            self._migrate_visual_test(conn, session_id, 'color_red', record, 'Tst2')
-            self._migrate_visual_test(conn, session_id, 'shift', record, 'Tst3')
+            # Миграция трех тестов (строка куба (3, 36) уже содержит времена реакции)
+            for test_index, test_type in enumerate(VISUAL_TEST_TYPES):
+                self._migrate_visual_test(
+                    conn, session_id, test_type, record, TEST_PREFIXES[test_index],
+                    reaction_times[test_index] if reaction_times is not None else None
+                )
 
             return session_id
 
@@ -228,14 +811,14 @@ class LegacyMigrator:
             print(f"❌ Ошибка миграции сессии: {e}")
             return None
 
-    def _migrate_visual_test(self, conn, session_id, test_type, record, prefix):
+    def _migrate_visual_test(self, conn, session_id, test_type, record, prefix, reaction_times=None):
         """Миграция отдельного визуального теста"""
         try:
             # Сбор сырых данных реакций
-            reaction_times = []
-            for i in range(1, 37):
-                col_name = f'{prefix}_{i}'
-                reaction_times.append(record.get(col_name))
+            if reaction_times is None:
+                cube = ReactionTimeCube.from_boxbase(record.to_frame().T)
+                reaction_times = cube.reaction_times[0, TEST_PREFIXES.index(prefix)]
+            packed, json_times = self._reaction_times_storage(np.asarray(reaction_times, dtype=np.float64)[None, :])
 
             # Сбор агрегированных данных
             aggregates = {
@@ -247,18 +830,25 @@ class LegacyMigrator:
 
             conn.execute('''
                          INSERT INTO visual_tests
-                             (session_id, test_type, raw_reaction_times, raw_aggregates)
-                         VALUES (?, ?, ?, ?)
+                             (session_id, test_type, raw_reaction_times, reaction_times_packed, raw_aggregates)
+                         VALUES (?, ?, ?, ?, ?)
                          ''', (
                              session_id,
                              test_type,
-                             json.dumps(reaction_times),
+                             json_times[0],
+                             packed[0],
                              json.dumps(aggregates)
                          ))
 
         except Exception as e:
             print(f"⚠️ Ошибка миграции теста {test_type}: {e}")
 
+    @staticmethod
+    def _reaction_times_to_list(reaction_times):
+        """Строка из 36 времен реакции -> JSON-совместимый список (NaN -> None)"""
+        return [None if np.isnan(value) else (int(value) if value.is_integer() else float(value))
+                for value in reaction_times.tolist()]
+
     def verify_migration(self):
         """Проверка корректности миграции данных"""
         try:
@@ -333,15 +923,22 @@ class LegacyMigrator:
             print(f"❌ Ошибка проверки миграции: {e}")
             return None
 
-    def run_complete_migration(self, users_path=None, boxbase_path=None):
-        """Полная миграция всех данных"""
+    def run_complete_migration(self, users_path=None, boxbase_path=None, resume=False):
+        """Полная миграция всех данных.
+
+        resume=True - продолжение прерванной миграции: схема не пересоздается,
+        источники переносятся с последней зафиксированной контрольной точки.
+        """
         try:
             print("🚀 Запуск полной миграции данных")
             print("=" * 50)
 
             # 1. Инициализация новой схемы
-            print("📊 Шаг 1: Создание новой схемы БД...")
-            self.initialize_new_schema()
+            if resume and CheckpointStore.has_progress(self.db_path):
+                print("📊 Шаг 1: Продолжение прерванной миграции (схема БД сохраняется)...")
+            else:
+                print("📊 Шаг 1: Создание новой схемы БД...")
+                self.initialize_new_schema()
 
             # 2. Миграция пациентов
             if users_path and os.path.exists(users_path):
@@ -370,6 +967,9 @@ class LegacyMigrator:
 
             return verification
 
+        except SourceChangedError as e:
+            print(f"❌ Миграция не продолжена: {e}")
+            return None
         except Exception as e:
             print(f"❌ Критическая ошибка миграции: {e}")
             import traceback
@@ -384,10 +984,10 @@ def verify_migration(db_path='neuro_data.db'):
     return migrator.verify_migration()
 
 
-def run_migration(users_path, boxbase_path, db_path='neuro_data.db'):
-    """Запустить миграцию"""
+def run_migration(users_path, boxbase_path, db_path='neuro_data.db', resume=False):
+    """Запустить миграцию (resume=True - продолжить прерванную)"""
     migrator = LegacyMigrator(db_path)
-    return migrator.run_complete_migration(users_path, boxbase_path)
+    return migrator.run_complete_migration(users_path, boxbase_path, resume)
 
 
 if __name__ == "__main__":
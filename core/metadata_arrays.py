@@ -0,0 +1,213 @@
+# core/metadata_arrays.py
+"""
+Метаданные тестов в виде структуры массивов: по строке на тип теста, по столбцу
+на стимул - коды цвета и позиции (int8), предстимульный интервал и параметр
+сдвига (int16), код последовательности кругов (int16, таблица строк отдельно).
+Отсутствующее значение - -1.
+
+Массивы публикуются один раз в небольшой файл и отображаются в память
+(mmap) процессами пула только для чтения: процессу не нужно строить
+TestMetadataManager, а версия (хэш содержимого) у всех процессов одна.
+Вместе с массивами публикуется версия метаданных базы (metadata_version),
+которой процессы пула метрик отмечают рассчитанные строки.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from core.reaction_matrix import TEST_TYPE_ORDER
+from core.test_metadata import COLOR_CODES, POSITION_CODES
+
+logger = logging.getLogger(__name__)
+
+# Сигнатура файла и формат заголовка: сигнатура, длина JSON-заголовка
+_MAGIC = b'NTAMETA1'
+_PREFIX = struct.Struct('<8sI')
+
+# Выравнивание массивов в файле (байт)
+_ALIGNMENT = 8
+
+# Числовые массивы структуры и их типы (порядок - порядок в файле)
+ARRAY_DTYPES = {
+    'color': np.dtype('i1'),
+    'position': np.dtype('i1'),
+    'psi': np.dtype('<i2'),
+    'shift': np.dtype('<i2'),
+    'circle': np.dtype('<i2'),
+}
+
+MISSING_CODE = -1
+
+# Процесс пула: подключенные метаданные (attach_worker_metadata)
+_worker_arrays: Optional['MetadataArrays'] = None
+
+
+@dataclass(eq=False)
+class MetadataArrays:
+    """Последовательности стимулов всех тестов как массивы (тест, стимул).
+    Экземпляры сравниваются по версии (хэшу содержимого)."""
+    test_types: Tuple[str, ...]
+    colors: Tuple[str, ...]
+    positions: Tuple[str, ...]
+    circle_sequences: Tuple[str, ...]
+    counts: np.ndarray
+    arrays: Dict[str, np.ndarray]
+    version: str = ''
+    # Версия метаданных базы (testing_system_parameters.METADATA_VERSION), по которой построены массивы
+    metadata_version: str = ''
+    _mapping: Optional[mmap.mmap] = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not self.version:
+            self.version = self._content_hash()
+
+    @classmethod
+    def from_manager(cls, manager) -> 'MetadataArrays':
+        """Структура массивов из загруженного TestMetadataManager"""
+        available = manager.get_all_test_types()
+        test_types = tuple([test_type for test_type in TEST_TYPE_ORDER if test_type in available] +
+                           sorted(test_type for test_type in available if test_type not in TEST_TYPE_ORDER))
+        n_stimuli = max((manager.get_stimulus_count(test_type) for test_type in test_types), default=0)
+
+        arrays = {name: np.full((len(test_types), n_stimuli), MISSING_CODE, dtype=dtype)
+                  for name, dtype in ARRAY_DTYPES.items()}
+        counts = np.zeros(len(test_types), dtype=np.int16)
+        circles: Dict[str, int] = {}
+        for row, test_type in enumerate(test_types):
+            stimuli = manager.get_test_metadata(test_type).stimuli
+            counts[row] = len(stimuli)
+            for column, stimulus in enumerate(stimuli):
+                arrays['color'][row, column] = COLOR_CODES.get(stimulus.color, MISSING_CODE)
+                arrays['position'][row, column] = POSITION_CODES.get(stimulus.position, MISSING_CODE)
+                arrays['psi'][row, column] = stimulus.prestimulus_interval
+                if stimulus.shift_parameter is not None:
+                    arrays['shift'][row, column] = stimulus.shift_parameter
+                if stimulus.circle_sequence:
+                    arrays['circle'][row, column] = circles.setdefault(stimulus.circle_sequence, len(circles))
+
+        return cls(test_types, tuple(COLOR_CODES), tuple(POSITION_CODES), tuple(circles), counts, arrays,
+                   metadata_version=manager.version)
+
+    def _content_hash(self) -> str:
+        digest = hashlib.sha256(json.dumps(self._tables(), ensure_ascii=False).encode('utf-8'))
+        digest.update(self.metadata_version.encode('utf-8'))
+        digest.update(self.counts.astype('<i2').tobytes())
+        for name in ARRAY_DTYPES:
+            digest.update(np.ascontiguousarray(self.arrays[name], dtype=ARRAY_DTYPES[name]).tobytes())
+        return digest.hexdigest()[:32]
+
+    def _tables(self) -> dict:
+        return {'test_types': list(self.test_types), 'colors': list(self.colors),
+                'positions': list(self.positions), 'circle_sequences': list(self.circle_sequences)}
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MetadataArrays) and self.version == other.version
+
+    def __hash__(self) -> int:
+        return hash(self.version)
+
+    def row(self, test_type: str) -> int:
+        """Номер строки массивов для типа теста"""
+        return self.test_types.index(test_type)
+
+    def test_arrays(self, test_type: str) -> Dict[str, np.ndarray]:
+        """Массивы одного теста (длина - число его стимулов), без копирования"""
+        row = self.row(test_type)
+        count = int(self.counts[row])
+        return {name: values[row, :count] for name, values in self.arrays.items()}
+
+    def to_bytes(self) -> bytes:
+        """Файловое представление: заголовок JSON и выровненные массивы"""
+        header = {**self._tables(), 'version': self.version, 'metadata_version': self.metadata_version,
+                  'shape': list(self.arrays['color'].shape), 'arrays': []}
+        offset = 0
+        for name, dtype in ARRAY_DTYPES.items():
+            header['arrays'].append([name, dtype.str, offset])
+            offset += -(-self.arrays[name].size * dtype.itemsize // _ALIGNMENT) * _ALIGNMENT
+        header['counts_offset'] = offset
+
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        start = -(-(_PREFIX.size + len(header_bytes)) // _ALIGNMENT) * _ALIGNMENT
+        buffer = bytearray(start + offset + self.counts.size * 2)
+        buffer[:_PREFIX.size] = _PREFIX.pack(_MAGIC, len(header_bytes))
+        buffer[_PREFIX.size:_PREFIX.size + len(header_bytes)] = header_bytes
+        for name, dtype, array_offset in header['arrays']:
+            data = np.ascontiguousarray(self.arrays[name], dtype=dtype).tobytes()
+            buffer[start + array_offset:start + array_offset + len(data)] = data
+        buffer[start + offset:] = self.counts.astype('<i2').tobytes()
+        return bytes(buffer)
+
+    @classmethod
+    def from_buffer(cls, buffer, mapping: Optional[mmap.mmap] = None) -> 'MetadataArrays':
+        """Структура массивов поверх буфера (массивы - представления буфера, без копирования)"""
+        magic, header_length = _PREFIX.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError("Файл не содержит метаданных тестов")
+        header = json.loads(bytes(buffer[_PREFIX.size:_PREFIX.size + header_length]).decode('utf-8'))
+        start = -(-(_PREFIX.size + header_length) // _ALIGNMENT) * _ALIGNMENT
+        shape = tuple(header['shape'])
+        size = shape[0] * shape[1]
+
+        arrays = {}
+        for name, dtype, offset in header['arrays']:
+            values = np.frombuffer(buffer, dtype=np.dtype(dtype), count=size, offset=start + offset).reshape(shape)
+            values.flags.writeable = False
+            arrays[name] = values
+        counts = np.frombuffer(buffer, dtype='<i2', count=shape[0], offset=start + header['counts_offset'])
+
+        return cls(tuple(header['test_types']), tuple(header['colors']), tuple(header['positions']),
+                   tuple(header['circle_sequences']), counts, arrays, header['version'],
+                   header.get('metadata_version', ''), mapping)
+
+    def publish(self, path: Optional[str] = None) -> str:
+        """Запись в файл для процессов пула; по умолчанию - во временный каталог,
+        имя файла содержит версию (файл с той же версией не перезаписывается)"""
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), f'neuro_metadata_{self.version}.bin')
+            if os.path.exists(path):
+                return path
+
+        # Запись через временный файл: процесс не увидит частично записанный файл
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.to_bytes())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    @classmethod
+    def attach(cls, path: str) -> 'MetadataArrays':
+        """Отображение опубликованного файла в память только для чтения"""
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls.from_buffer(mapping, mapping)
+
+
+def attach_worker_metadata(path: str, version: Optional[str] = None):
+    """Инициализатор процесса пула: подключение опубликованных метаданных.
+    Если версия задана, она должна совпасть с версией файла."""
+    global _worker_arrays
+    arrays = MetadataArrays.attach(path)
+    if version is not None and arrays.version != version:
+        raise RuntimeError(f"Версия метаданных {arrays.version} в {path} не совпадает с ожидаемой {version}")
+    _worker_arrays = arrays
+
+
+def worker_metadata() -> MetadataArrays:
+    """Метаданные, подключенные в процессе пула"""
+    if _worker_arrays is None:
+        raise RuntimeError("Метаданные не подключены: процесс пула запущен без attach_worker_metadata")
+    return _worker_arrays
@@ -0,0 +1,452 @@
+# core/metrics_engine.py
+"""
+Инкрементальный пакетный расчет метрик visual_tests: пересчитываются только
+строки без метрик, с другой версией алгоритма, с другой версией метаданных
+тестирования (visual_tests.metadata_version) или с изменившимися входами.
+Строки читаются пакетами по диапазонам id (курсор не остается открытым во время
+записи), агрегаты пакета декодируются одним разбором JSON в столбцы, метрики
+считаются по столбцам, результат пишется одним executemany на пакет. Диапазоны
+могут считаться в пуле процессов, запись - всегда один писатель. Ошибки
+отдельных тестов собираются в отчет.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.request import pathname2url
+
+import numpy as np
+
+from core.bulk_writer import BulkSQLiteWriter
+from core.metadata_arrays import attach_worker_metadata, worker_metadata
+from core.test_metadata import METADATA_VERSION_COLUMN, current_metadata_version, load_metadata_manager
+
+logger = logging.getLogger(__name__)
+
+# Тестов в одном пакете чтения / расчета / записи
+METRICS_BATCH_SIZE = 5000
+
+# Версия алгоритма базовых метрик (visual_tests.analysis_version); меняется при
+# любом изменении расчета - строки с другой версией пересчитываются
+METRICS_VERSION = '1.0'
+
+# Хэш входов расчета (агрегаты, тип теста, метаданные) в visual_tests
+INPUT_HASH_COLUMN = 'metrics_input_hash'
+
+# Строк в одном пакете просмотра при составлении плана пересчета
+PLAN_SCAN_BATCH_SIZE = 50_000
+
+# Причины пересчета строки (коды в массиве плана)
+STALE_REASONS = {1: 'new', 2: 'version', 3: 'inputs', 4: 'metadata'}
+
+# Поля агрегатов теста -> метрики (значение по умолчанию - если поля нет)
+AGGREGATE_METRICS = (
+    ('result', 'v1_latency', 0),
+    ('std_dev', 'std_deviation', 0),
+    ('early_responses', 'early_responses', 0),
+    ('late_responses', 'late_responses', 0),
+)
+
+
+class MetricsCancelled(Exception):
+    """Расчет метрик остановлен по запросу пользователя"""
+
+
+@dataclass
+class MetricsError:
+    """Ошибка расчета метрик одного теста"""
+    test_id: int
+    test_type: Optional[str]
+    error: str
+
+
+@dataclass
+class MetricsProgress:
+    """Прогресс расчета метрик"""
+    total: int
+    processed: int = 0
+    failed: int = 0
+    batches: int = 0
+    status: str = 'running'  # running | done | cancelled
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def fraction(self) -> float:
+        """Доля просмотренных тестов (0..1)"""
+        if self.status == 'done' or self.total <= 0:
+            return 1.0
+        return min((self.processed + self.failed) / self.total, 1.0)
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        """Оценка оставшегося времени по скорости расчета (None, пока оценки нет)"""
+        done = self.processed + self.failed
+        if self.status == 'done':
+            return 0.0
+        if done <= 0:
+            return None
+        return self.elapsed * max(self.total - done, 0) / done
+
+
+@dataclass
+class MetricsReport:
+    """Итог расчета: число рассчитанных тестов и собранные ошибки"""
+    processed: int = 0
+    errors: List[MetricsError] = field(default_factory=list)
+    cancelled: bool = False
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+    def error_summary(self, examples: int = 5) -> List[str]:
+        """Строки отчета об ошибках: по одной на текст ошибки, с примерами id тестов"""
+        lines = []
+        by_error: Dict[str, List[int]] = {}
+        for error in self.errors:
+            by_error.setdefault(error.error, []).append(error.test_id)
+        for text, count in Counter({text: len(ids) for text, ids in by_error.items()}).most_common():
+            ids = by_error[text]
+            more = f" и еще {len(ids) - examples}" if len(ids) > examples else ""
+            lines.append(f"{text}: {count} тестов (id {', '.join(map(str, ids[:examples]))}{more})")
+        return lines
+
+
+@dataclass
+class MetricsPlan:
+    """План пересчета: сколько строк и почему устарели, диапазоны id для расчета"""
+    total: int = 0
+    new: int = 0
+    version: int = 0
+    inputs: int = 0
+    metadata: int = 0
+    ranges: List[Tuple[int, int]] = field(default_factory=list)
+    metadata_version: str = ''
+
+    @property
+    def stale(self) -> int:
+        return self.new + self.version + self.inputs + self.metadata
+
+    def describe(self) -> str:
+        return (f"Будет пересчитано {self.stale} из {self.total} тестов "
+                f"(без метрик: {self.new}, другая версия алгоритма: {self.version}, "
+                f"другая версия метаданных: {self.metadata}, изменились входные данные: {self.inputs})")
+
+
+def ensure_metrics_schema(conn: sqlite3.Connection):
+    """Столбцы хэша входов расчета и версии метаданных в visual_tests, индекс по версии"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(visual_tests)")]
+    if not columns:
+        return
+    for column in (INPUT_HASH_COLUMN, METADATA_VERSION_COLUMN):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE visual_tests ADD COLUMN {column} TEXT")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_visual_tests_metadata_version "
+                 f"ON visual_tests({METADATA_VERSION_COLUMN})")
+
+
+def outdated_metrics_count(conn: sqlite3.Connection, metadata_version: Optional[str] = None) -> int:
+    """Тестов, метрики которых посчитаны по другой версии метаданных
+    (сравнение по индексу, без просмотра агрегатов)"""
+    if metadata_version is None:
+        metadata_version = current_metadata_version(conn)
+    return conn.execute(f"SELECT COUNT(*) FROM visual_tests WHERE {METADATA_VERSION_COLUMN} IS NOT NULL "
+                        f"AND {METADATA_VERSION_COLUMN} != ?", (metadata_version,)).fetchone()[0]
+
+
+def input_hashes(rows: Sequence[tuple], metadata: str) -> List[str]:
+    """Хэши входов расчета строк (id, test_type, raw_aggregates, ...)"""
+    return [hashlib.sha256(f"{row[1]}\x00{row[2]}\x00{metadata}".encode('utf-8')).hexdigest()[:32]
+            for row in rows]
+
+
+def stale_codes(rows: Sequence[tuple], metadata: str) -> np.ndarray:
+    """Коды причин пересчета строк (id, test_type, raw_aggregates, есть метрики,
+    analysis_version, хэш входов, версия метаданных): 0 - актуальна, иначе ключ STALE_REASONS"""
+    codes = np.zeros(len(rows), dtype=np.int8)
+    if not rows:
+        return codes
+    has_metrics = np.array([bool(row[3]) for row in rows])
+    version_ok = np.array([row[4] == METRICS_VERSION for row in rows])
+    inputs_ok = np.array([stored == current for stored, current
+                          in zip((row[5] for row in rows), input_hashes(rows, metadata))])
+    metadata_ok = np.array([row[6] == metadata for row in rows])
+    codes[~inputs_ok] = 3
+    codes[~metadata_ok] = 4
+    codes[~version_ok] = 2
+    codes[~has_metrics] = 1
+    return codes
+
+
+def decode_aggregates(texts: Sequence[Optional[str]]) -> Tuple[List[Optional[dict]], List[Optional[str]]]:
+    """JSON агрегатов пакета -> (словари, тексты ошибок); строка с ошибкой - None.
+
+    Пакет разбирается одним вызовом json.loads; построчный разбор - только если
+    в пакете есть некорректная строка.
+    """
+    records: List[Optional[dict]] = [None] * len(texts)
+    errors: List[Optional[str]] = [None] * len(texts)
+    present = [index for index, text in enumerate(texts) if text is not None]
+    for index in set(range(len(texts))) - set(present):
+        errors[index] = "Нет агрегатов теста (raw_aggregates пуст)"
+
+    try:
+        values = json.loads('[' + ', '.join(texts[index] for index in present) + ']')
+        if len(values) != len(present):
+            raise ValueError("число значений не совпадает с числом строк")
+    except ValueError:
+        values = []
+        for index in present:
+            try:
+                values.append(json.loads(texts[index]))
+            except ValueError as e:
+                values.append(None)
+                errors[index] = f"Некорректный JSON агрегатов: {e.__class__.__name__}"
+
+    for index, value in zip(present, values):
+        if isinstance(value, dict):
+            records[index] = value
+        elif errors[index] is None:
+            errors[index] = f"Агрегаты теста - не объект JSON ({type(value).__name__})"
+    return records, errors
+
+
+def _object_column(values: Sequence) -> np.ndarray:
+    """Одномерный столбец объектов (значения-списки не превращаются в измерение массива)"""
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def basic_metrics_columns(records: Sequence[dict], test_types: Sequence[str],
+                          timestamp: str) -> Dict[str, np.ndarray]:
+    """Базовые метрики пакета тестов по столбцам (значения - объекты Python для JSON)"""
+    n_tests = len(records)
+    columns = {}
+    for source, metric, default in AGGREGATE_METRICS:
+        columns[metric] = _object_column([record.get(source, default) for record in records])
+    columns['has_motor_correction'] = np.zeros(n_tests, dtype=bool)
+    columns['calculation_timestamp'] = np.full(n_tests, timestamp, dtype=object)
+    columns['test_type'] = _object_column(list(test_types))
+    return columns
+
+
+def metrics_json(columns: Dict[str, np.ndarray]) -> List[str]:
+    """Столбцы метрик -> JSON-объект на каждый тест (как json.dumps словаря метрик)"""
+    names = list(columns)
+    return [json.dumps(dict(zip(names, values)))
+            for values in zip(*(columns[name].tolist() for name in names))]
+
+
+def _read_only_connection(db_path: str) -> sqlite3.Connection:
+    """Соединение только для чтения (процессы пула не пишут в базу)"""
+    return sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True)
+
+
+# Столбцы visual_tests для определения актуальности метрик (порядок - как ждет stale_codes)
+_STATE_COLUMNS = (f"id, test_type, raw_aggregates, calculated_metrics IS NOT NULL, analysis_version, "
+                  f"{INPUT_HASH_COLUMN}, {METADATA_VERSION_COLUMN}")
+
+
+def _select_range(conn: sqlite3.Connection, first_id: int, last_id: int, metadata: str) -> List[tuple]:
+    """Устаревшие строки диапазона id: (id, test_type, raw_aggregates)"""
+    rows = conn.execute(
+        f"SELECT {_STATE_COLUMNS} FROM visual_tests WHERE id BETWEEN ? AND ? ORDER BY id",
+        (first_id, last_id)
+    ).fetchall()
+    return [row[:3] for row, code in zip(rows, stale_codes(rows, metadata)) if code]
+
+
+def _compute_range(db_path: str, first_id: int, last_id: int) -> Tuple[List[tuple], List[MetricsError]]:
+    """Задача процесса пула: расчет метрик диапазона id по соединению только для чтения.
+    Версия метаданных - из метаданных, подключенных инициализатором пула."""
+    metadata = worker_metadata().metadata_version
+    conn = _read_only_connection(db_path)
+    try:
+        return MetricsEngine.compute_batch(_select_range(conn, first_id, last_id, metadata), metadata)
+    finally:
+        conn.close()
+
+
+class MetricsEngine:
+    """
+    Инкрементальный пакетный расчет метрик visual_tests.
+
+    Строка пересчитывается, только если у нее нет метрик, метрики посчитаны
+    другой версией алгоритма (analysis_version) или по другой версии метаданных
+    тестирования (metadata_version - хэш содержимого из testing_system_parameters),
+    или изменились входы расчета (хэш агрегатов, типа теста и метаданных в
+    metrics_input_hash). План пересчета (plan()) составляется до начала расчета.
+
+    Устаревшие тесты делятся на диапазоны id по batch_size тестов. С workers > 1
+    диапазоны считаются в пуле процессов (чтение - соединениями только для чтения),
+    а записывает результаты один писатель в порядке диапазонов, поэтому результат
+    совпадает с последовательным расчетом. Пакеты фиксируются по одному: отмена
+    (cancel(), из любого потока) вступает в силу на границе пакета, уже
+    рассчитанные пакеты сохраняются. Прогресс передается в callback после
+    каждого пакета.
+    """
+
+    def __init__(self, db_path: str = 'neuro_data.db', batch_size: int = METRICS_BATCH_SIZE,
+                 workers: Optional[int] = None):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.workers = workers
+        self.progress: Optional[MetricsProgress] = None
+        self.report = MetricsReport()
+        self._cancel_requested = threading.Event()
+
+    def cancel(self):
+        """Запрос отмены: расчет останавливается после текущего пакета"""
+        self._cancel_requested.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_requested.is_set()
+
+    @staticmethod
+    def compute_batch(rows: Sequence[tuple], metadata: str = '') -> Tuple[List[tuple], List[MetricsError]]:
+        """Пакет (id, test_type, raw_aggregates) -> (параметры UPDATE, ошибки)"""
+        records, errors = decode_aggregates([row[2] for row in rows])
+        ok = np.array([record is not None for record in records], dtype=bool)
+        failed = [MetricsError(row[0], row[1], error) for row, error in zip(rows, errors) if error is not None]
+        if not ok.any():
+            return [], failed
+
+        timestamp = datetime.now().isoformat()
+        good_rows = [row for row, valid in zip(rows, ok) if valid]
+        columns = basic_metrics_columns([record for record in records if record is not None],
+                                        [row[1] for row in good_rows], timestamp)
+        updates = [(text, timestamp, METRICS_VERSION, input_hash, metadata, row[0])
+                   for text, input_hash, row in zip(metrics_json(columns), input_hashes(good_rows, metadata),
+                                                    good_rows)]
+        return updates, failed
+
+    def plan(self) -> MetricsPlan:
+        """План пересчета: просмотр всех тестов без расчета метрик"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                ensure_metrics_schema(conn)
+            plan = MetricsPlan(metadata_version=current_metadata_version(conn))
+
+            stale_ids = []
+            last_id = 0
+            while True:
+                rows = conn.execute(
+                    f"SELECT {_STATE_COLUMNS} FROM visual_tests WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, PLAN_SCAN_BATCH_SIZE)
+                ).fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+
+                codes = stale_codes(rows, plan.metadata_version)
+                counts = np.bincount(codes, minlength=len(STALE_REASONS) + 1)
+                plan.total += len(rows)
+                for code, reason in STALE_REASONS.items():
+                    setattr(plan, reason, getattr(plan, reason) + int(counts[code]))
+                stale_ids.extend(row[0] for row, code in zip(rows, codes) if code)
+        finally:
+            conn.close()
+
+        ids = np.array(stale_ids, dtype=np.int64)
+        starts = ids[::self.batch_size]
+        ends = np.append(ids[self.batch_size - 1::self.batch_size], ids[-1:])[:len(starts)]
+        plan.ranges = list(zip(starts.tolist(), ends.tolist()))
+        return plan
+
+    def _serial_batches(self, plan: MetricsPlan) -> Iterator[Tuple[List[tuple], List[MetricsError]]]:
+        conn = _read_only_connection(self.db_path)
+        try:
+            for first_id, last_id in plan.ranges:
+                rows = _select_range(conn, first_id, last_id, plan.metadata_version)
+                yield self.compute_batch(rows, plan.metadata_version)
+        finally:
+            conn.close()
+
+    def _parallel_batches(self, plan: MetricsPlan) -> Iterator[Tuple[List[tuple], List[MetricsError]]]:
+        """Результаты пула в порядке диапазонов; в работе не больше 2 * workers диапазонов.
+        Метаданные базы публикуются в файл один раз, процессы пула отображают его в память
+        при запуске и не строят TestMetadataManager."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            arrays = load_metadata_manager(conn).get_metadata_arrays()
+        finally:
+            conn.close()
+        if arrays.metadata_version != plan.metadata_version:
+            raise RuntimeError(f"План составлен по версии метаданных {plan.metadata_version}, в базе - "
+                               f"{arrays.metadata_version}: составьте план заново")
+
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=attach_worker_metadata,
+                                       initargs=(arrays.publish(), arrays.version))
+        try:
+            pending = deque()
+            ranges = iter(plan.ranges)
+            for first_id, last_id in islice(ranges, 2 * self.workers):
+                pending.append(executor.submit(_compute_range, self.db_path, first_id, last_id))
+            while pending:
+                result = pending.popleft().result()
+                for first_id, last_id in islice(ranges, 1):
+                    pending.append(executor.submit(_compute_range, self.db_path, first_id, last_id))
+                yield result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def run(self, on_progress: Optional[Callable[[MetricsProgress], None]] = None,
+            plan: Optional[MetricsPlan] = None) -> MetricsReport:
+        """Пересчет устаревших метрик по плану (без плана - составляется заново);
+        возвращает отчет. При отмене возбуждается MetricsCancelled (отчет - в self.report)."""
+        if plan is None:
+            plan = self.plan()
+        self.report = MetricsReport()
+        with BulkSQLiteWriter(self.db_path) as writer:
+            self.progress = MetricsProgress(plan.stale)
+            parallel = bool(self.workers) and self.workers > 1 and len(plan.ranges) > 1
+            batches = self._parallel_batches(plan) if parallel else self._serial_batches(plan)
+
+            try:
+                for updates, errors in batches:
+                    if self._cancel_requested.is_set():
+                        self.progress.status = 'cancelled'
+                        self.report.cancelled = True
+                        if on_progress is not None:
+                            on_progress(self.progress)
+                        raise MetricsCancelled("Расчет метрик отменен")
+
+                    # Писатель - единственное соединение, которое меняет базу
+                    writer.executemany(
+                        f"UPDATE visual_tests SET calculated_metrics = ?, is_processed = TRUE, processed_at = ?, "
+                        f"analysis_version = ?, {INPUT_HASH_COLUMN} = ?, {METADATA_VERSION_COLUMN} = ? WHERE id = ?",
+                        updates
+                    )
+
+                    self.report.processed += len(updates)
+                    self.report.errors.extend(errors)
+                    self.progress.processed += len(updates)
+                    self.progress.failed += len(errors)
+                    self.progress.batches += 1
+                    if on_progress is not None:
+                        on_progress(self.progress)
+            finally:
+                batches.close()
+
+        self.progress.status = 'done'
+        if on_progress is not None:
+            on_progress(self.progress)
+        mode = f", процессов: {self.workers}" if parallel else ""
+        logger.info(f"Метрики рассчитаны: {self.report.processed} тестов, ошибок: {self.report.failed}{mode}")
+        return self.report
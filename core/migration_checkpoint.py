@@ -0,0 +1,132 @@
+# core/migration_checkpoint.py
+"""
+Контрольные точки миграции legacy-данных: после каждого пакета в таблицу
+migration_checkpoints в той же транзакции, что и данные пакета, записываются
+номер пакета, последний обработанный ключ (cnt / ID) и счетчики. Прерванная
+миграция продолжается с последней зафиксированной точки.
+"""
+import logging
+import sqlite3
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Optional
+
+from core.import_manifest import file_sha256
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_TABLE = 'migration_checkpoints'
+
+
+class SourceChangedError(RuntimeError):
+    """Источник, часть строк которого уже перенесена в базу, изменился: продолжение
+    перенесло бы эти строки повторно, нужна миграция заново"""
+
+
+@dataclass
+class MigrationCheckpoint:
+    """Состояние миграции одного источника (источник - таблица и содержимое файла)"""
+    source_table: str
+    source_sha256: str
+    source_path: str = ''
+    batch_no: int = 0
+    last_key: Optional[int] = None
+    rows_read: int = 0
+    migrated: int = 0
+    rejected: int = 0
+    completed: bool = False
+    updated_at: Optional[str] = None
+
+    def advance(self, last_key: Optional[int], rows_read: int, migrated: int, rejected: int):
+        """Учет очередного пакета"""
+        self.batch_no += 1
+        if last_key is not None:
+            self.last_key = last_key
+        self.rows_read += rows_read
+        self.migrated += migrated
+        self.rejected += rejected
+
+
+class CheckpointStore:
+    """
+    Таблица migration_checkpoints.
+
+    Запись сохраняется методом save на соединении вызывающего кода без фиксации:
+    контрольная точка фиксируется (или откатывается) вместе с пакетом данных.
+    """
+
+    _COLUMNS = tuple(field.name for field in fields(MigrationCheckpoint))
+
+    @staticmethod
+    def ensure_table(conn: sqlite3.Connection):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                source_table TEXT NOT NULL,
+                source_sha256 TEXT NOT NULL,
+                source_path TEXT,
+                batch_no INTEGER,
+                last_key INTEGER,
+                rows_read INTEGER,
+                migrated INTEGER,
+                rejected INTEGER,
+                completed BOOLEAN DEFAULT FALSE,
+                updated_at TEXT,
+                PRIMARY KEY (source_table, source_sha256)
+            )
+        ''')
+
+    def start(self, conn: sqlite3.Connection, source_table: str, source_path: str) -> MigrationCheckpoint:
+        """Контрольная точка источника: сохраненная (продолжение) или новая.
+
+        Источник определяется содержимым файла. Если в базе уже есть пакеты миграции
+        того же типа источника из файла с другим содержимым, начать сначала нельзя -
+        зафиксированные строки были бы перенесены повторно: возбуждается SourceChangedError.
+        """
+        self.ensure_table(conn)
+        sha256 = file_sha256(source_path)
+        row = conn.execute(
+            f"SELECT {', '.join(self._COLUMNS)} FROM {CHECKPOINT_TABLE} "
+            f"WHERE source_table = ? AND source_sha256 = ?",
+            (source_table, sha256)
+        ).fetchone()
+        if row is not None:
+            checkpoint = MigrationCheckpoint(**dict(zip(self._COLUMNS, row)))
+            checkpoint.completed = bool(checkpoint.completed)
+            return checkpoint
+
+        superseded = conn.execute(
+            f"SELECT source_path, batch_no, completed FROM {CHECKPOINT_TABLE} "
+            f"WHERE source_table = ? AND batch_no > 0",
+            (source_table,)
+        ).fetchone()
+        if superseded is not None:
+            path, batch_no, completed = superseded
+            state = "завершенной" if completed else "прерванной"
+            raise SourceChangedError(
+                f"{source_table}: в базе есть данные {state} миграции {path} (пакетов: {batch_no}), "
+                f"а содержимое источника изменилось. Продолжение перенесло бы строки повторно - "
+                f"запустите миграцию заново (без resume)"
+            )
+        return MigrationCheckpoint(source_table, sha256, source_path)
+
+    def save(self, conn: sqlite3.Connection, checkpoint: MigrationCheckpoint):
+        """Запись контрольной точки в текущей транзакции соединения"""
+        checkpoint.updated_at = datetime.now().isoformat(timespec='seconds')
+        conn.execute(
+            f"INSERT OR REPLACE INTO {CHECKPOINT_TABLE} ({', '.join(self._COLUMNS)}) "
+            f"VALUES ({', '.join('?' for _ in self._COLUMNS)})",
+            [getattr(checkpoint, name) for name in self._COLUMNS]
+        )
+
+    @staticmethod
+    def has_progress(db_path: str) -> bool:
+        """Есть ли в базе контрольные точки (миграцию можно продолжить)"""
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute(
+                f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (CHECKPOINT_TABLE,)
+            ).fetchone() is not None and conn.execute(
+                f"SELECT 1 FROM {CHECKPOINT_TABLE} LIMIT 1"
+            ).fetchone() is not None
+        finally:
+            conn.close()
@@ -0,0 +1,305 @@
+# core/migration_pipeline.py
+"""
+Конвейерная миграция boxbase: читатель -> N процессов подготовки пакетов ->
+единственный процесс-писатель. Очереди между стадиями ограничены и несут пакеты
+строк: от читателя - столбцы как массивы NumPy, от подготовки - готовые строки
+таблиц (BoxbaseBatchRows). Соединение с базой есть только у писателя, поэтому
+блокировок SQLite между процессами нет. Пакеты фиксируются писателем строго по
+порядку номеров вместе с контрольной точкой, как в последовательной миграции.
+"""
+import logging
+import multiprocessing
+import queue
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from core.bulk_writer import BulkSQLiteWriter
+from core.legacy_migrator import MIGRATION_BATCH_SIZE, VISUAL_TEST_TYPES, LegacyMigrator
+from core.migration_checkpoint import MigrationCheckpoint
+from core.reaction_matrix import ReactionTimeCube
+
+logger = logging.getLogger(__name__)
+
+# Максимум пакетов в каждой очереди конвейера (ограничивает память)
+PIPELINE_QUEUE_SIZE = 4
+
+# Период опроса очередей и флага остановки (секунд)
+PIPELINE_POLL_SECONDS = 0.1
+
+
+@dataclass
+class StageStats:
+    """Счетчики стадии конвейера: работа и ожидание очередей (сумма по процессам стадии)"""
+    stage: str
+    processes: int = 1
+    batches: int = 0
+    rows: int = 0
+    busy_seconds: float = 0.0
+    wait_seconds: float = 0.0
+    # Работа самого загруженного процесса стадии (заполняется в add)
+    max_busy_seconds: float = 0.0
+
+    def add(self, other: 'StageStats'):
+        self.batches += other.batches
+        self.rows += other.rows
+        self.busy_seconds += other.busy_seconds
+        self.wait_seconds += other.wait_seconds
+        self.max_busy_seconds = max(self.max_busy_seconds, other.busy_seconds)
+
+    @property
+    def throughput(self) -> float:
+        """Строк в секунду, которые стадия обрабатывает всеми своими процессами.
+
+        Процессы работают параллельно, поэтому строки делятся на время работы самого
+        загруженного из них, а не на сумму: простаивающий процесс скорость не добавляет."""
+        seconds = self.max_busy_seconds or self.busy_seconds
+        return self.rows / seconds if seconds else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """Доля времени в работе среди работы и ожидания очередей"""
+        total = self.busy_seconds + self.wait_seconds
+        return self.busy_seconds / total if total else 0.0
+
+
+def _frame_buffers(batch: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Пакет строк -> столбцы как массивы NumPy (передаются между процессами без DataFrame)"""
+    return {col: batch[col].to_numpy() for col in batch.columns}
+
+
+def _put(target, item, stop_event, stats: StageStats, on_wait: Optional[Callable[[], None]] = None) -> bool:
+    """Запись в ограниченную очередь с учетом ожидания; False - конвейер остановлен.
+    on_wait вызывается на каждом периоде ожидания (проверка процессов конвейера)."""
+    started = time.perf_counter()
+    while not stop_event.is_set():
+        try:
+            target.put(item, timeout=PIPELINE_POLL_SECONDS)
+            stats.wait_seconds += time.perf_counter() - started
+            return True
+        except queue.Full:
+            if on_wait is not None:
+                on_wait()
+    return False
+
+
+def _get(source, stop_event, stats: StageStats):
+    """Чтение из очереди с учетом ожидания; None - конвейер остановлен"""
+    started = time.perf_counter()
+    while not stop_event.is_set():
+        try:
+            item = source.get(timeout=PIPELINE_POLL_SECONDS)
+            stats.wait_seconds += time.perf_counter() - started
+            return item
+        except queue.Empty:
+            continue
+    return None
+
+
+def _process_failure(transforms: List[multiprocessing.Process], writer: multiprocessing.Process) -> Optional[str]:
+    """Описание сбоя процесса конвейера или None. Подготовка, завершившаяся с ненулевым
+    кодом (например, убитая по памяти), не отправила писателю 'end' - ждать ее нельзя."""
+    for process in transforms:
+        if process.exitcode not in (None, 0):
+            return f"Процесс подготовки {process.name} завершился с кодом {process.exitcode}"
+    if not writer.is_alive():
+        return f"Писатель завершился с кодом {writer.exitcode}"
+    return None
+
+
+def _transform_worker(batch_queue, rows_queue, stop_event, external_ids: np.ndarray, patient_ids: np.ndarray):
+    """Процесс подготовки: сопоставление пациентов, JSON, сжатие и упаковка времен реакции"""
+    stats = StageStats('transform')
+    patients = pd.DataFrame({'id': patient_ids, 'external_id': external_ids})
+    try:
+        while True:
+            item = _get(batch_queue, stop_event, stats)
+            if item is None or item[0] == 'end':
+                break
+
+            started = time.perf_counter()
+            _, batch_no, buffers = item
+            batch = pd.DataFrame(buffers)
+            reg_ids = batch['REG_ID'] if 'REG_ID' in batch.columns else pd.Series(np.nan, index=batch.index)
+            accepted, batch_patient_ids = LegacyMigrator._match_patients(patients, reg_ids)
+            cube = ReactionTimeCube.from_boxbase(batch)
+            rows = LegacyMigrator._build_boxbase_batch(batch, accepted, batch_patient_ids, cube.reaction_times)
+            stats.busy_seconds += time.perf_counter() - started
+            stats.batches += 1
+            stats.rows += len(batch)
+
+            if not _put(rows_queue, ('rows', batch_no, rows), stop_event, stats):
+                break
+        _put(rows_queue, ('end', stats), stop_event, stats)
+    except Exception as e:
+        # Ошибку передает дальше писатель - он же останавливает конвейер
+        rows_queue.put(('error', f"Подготовка пакетов: {type(e).__name__}: {e}"))
+
+
+def _writer_process(db_path: str, rows_queue, result_queue, stop_event, transforms: int, first_batch: int,
+                    last_batch: int, checkpoint: Optional[MigrationCheckpoint]):
+    """Процесс-писатель: единственное соединение с базой, пакеты фиксируются по порядку номеров"""
+    stats = StageStats('writer')
+    transform_stats = StageStats('transform', processes=transforms)
+    migrated = rejected = 0
+    try:
+        migrator = LegacyMigrator(db_path)
+        pending: Dict[int, object] = {}
+        next_batch = first_batch
+        finished = 0
+
+        with BulkSQLiteWriter(db_path) as writer:
+            conn = writer.connection
+            while finished < transforms:
+                message = _get(rows_queue, stop_event, stats)
+                if message is None:
+                    return
+                if message[0] == 'error':
+                    stop_event.set()
+                    result_queue.put(message)
+                    return
+                if message[0] == 'end':
+                    transform_stats.add(message[1])
+                    finished += 1
+                    continue
+
+                _, batch_no, rows = message
+                pending[batch_no] = rows
+                # Пакеты приходят от процессов подготовки в произвольном порядке
+                while next_batch in pending:
+                    rows = pending.pop(next_batch)
+                    started = time.perf_counter()
+                    migrator._commit_boxbase_batch(conn, rows, checkpoint, completed=next_batch == last_batch)
+                    stats.busy_seconds += time.perf_counter() - started
+                    stats.batches += 1
+                    stats.rows += rows.rows_read
+                    migrated += len(rows.sessions)
+                    rejected += len(rows.reject_ids)
+                    writer.record_rows(len(rows.sessions) * (2 + len(VISUAL_TEST_TYPES)) + len(rows.reject_ids))
+                    next_batch += 1
+
+            if checkpoint is not None and first_batch > last_batch:
+                # Новых строк нет - источник отмечается как полностью мигрированный
+                with conn:
+                    checkpoint.completed = True
+                    migrator.checkpoints.save(conn, checkpoint)
+
+        if pending or next_batch <= last_batch:
+            result_queue.put(('error', f"Писатель: записано пакетов {next_batch - first_batch} "
+                                       f"из {last_batch - first_batch + 1}"))
+            return
+        result_queue.put(('done', migrated, rejected, stats, transform_stats, writer.summary()))
+    except Exception as e:
+        stop_event.set()
+        result_queue.put(('error', f"Писатель: {type(e).__name__}: {e}"))
+
+
+class MigrationPipeline:
+    """
+    Конвейерная миграция boxbase.
+
+    Читатель (вызывающий процесс) режет источник на пакеты по MIGRATION_BATCH_SIZE
+    строк, процессы подготовки строят строки таблиц, писатель выделяет
+    идентификаторы и фиксирует пакеты. Результат совпадает с последовательной
+    пакетной миграцией. Счетчики стадий (stats) показывают узкое место.
+    """
+
+    def __init__(self, db_path: str = 'neuro_data.db', workers: int = 2,
+                 batch_size: int = MIGRATION_BATCH_SIZE, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.db_path = db_path
+        self.workers = max(int(workers), 1)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.stats: List[StageStats] = []
+        self.writer_summary = ''
+
+    def run(self, data: pd.DataFrame, checkpoint: Optional[MigrationCheckpoint] = None) -> Tuple[int, int]:
+        """Миграция строк boxbase; возвращает (мигрировано сессий, отклонено строк).
+        Контрольная точка сохраняется в базе процессом-писателем."""
+        data = LegacyMigrator._resume_order(data, checkpoint)
+        conn = sqlite3.connect(self.db_path)
+        try:
+            patients = LegacyMigrator._patient_lookup(conn)
+        finally:
+            conn.close()
+
+        first_batch = checkpoint.batch_no + 1 if checkpoint is not None else 1
+        n_batches = (len(data) + self.batch_size - 1) // self.batch_size
+        last_batch = first_batch + n_batches - 1
+
+        reader_stats = StageStats('reader')
+        batch_queue = multiprocessing.Queue(maxsize=self.queue_size)
+        rows_queue = multiprocessing.Queue(maxsize=self.queue_size)
+        result_queue = multiprocessing.Queue()
+        stop_event = multiprocessing.Event()
+
+        transforms = [
+            multiprocessing.Process(target=_transform_worker, daemon=True,
+                                    args=(batch_queue, rows_queue, stop_event,
+                                          patients['external_id'].to_numpy(), patients['id'].to_numpy()))
+            for _ in range(self.workers)
+        ]
+        writer = multiprocessing.Process(target=_writer_process, daemon=True,
+                                         args=(self.db_path, rows_queue, result_queue, stop_event, self.workers,
+                                               first_batch, last_batch, checkpoint))
+        for process in transforms + [writer]:
+            process.start()
+
+        def check_processes():
+            # Сбой процесса останавливает конвейер, иначе читатель ждал бы места в очереди вечно
+            if _process_failure(transforms, writer) is not None:
+                stop_event.set()
+
+        # Задается до try: при ошибке читателя или Ctrl-C finally проверяет именно его
+        result = None
+        try:
+            for number, start in enumerate(range(0, len(data), self.batch_size), start=first_batch):
+                started = time.perf_counter()
+                buffers = _frame_buffers(data.iloc[start:start + self.batch_size])
+                reader_stats.busy_seconds += time.perf_counter() - started
+                reader_stats.batches += 1
+                reader_stats.rows += len(next(iter(buffers.values()))) if buffers else 0
+                if not _put(batch_queue, ('batch', number, buffers), stop_event, reader_stats, check_processes):
+                    break
+            for _ in transforms:
+                _put(batch_queue, ('end',), stop_event, reader_stats, check_processes)
+
+            while result is None:
+                try:
+                    result = result_queue.get(timeout=PIPELINE_POLL_SECONDS)
+                except queue.Empty:
+                    failure = _process_failure(transforms, writer)
+                    if failure is not None:
+                        result = ('error', failure)
+        finally:
+            if result is None or result[0] != 'done':
+                stop_event.set()
+            for process in transforms + [writer]:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+        if result[0] != 'done':
+            raise RuntimeError(f"Конвейерная миграция остановлена: {result[1]}")
+
+        _, migrated, rejected, writer_stats, transform_stats, self.writer_summary = result
+        self.stats = [reader_stats, transform_stats, writer_stats]
+        return migrated, rejected
+
+    def stats_report(self) -> List[str]:
+        """Строки отчета по стадиям; узкое место - стадия с наименьшей пропускной способностью"""
+        if not self.stats:
+            return []
+        bottleneck = min((stage for stage in self.stats if stage.busy_seconds),
+                         key=lambda stage: stage.throughput, default=None)
+        lines = ["📈 Стадии конвейера:"]
+        for stage in self.stats:
+            mark = " ← узкое место" if stage is bottleneck else ""
+            lines.append(f"   • {stage.stage} x{stage.processes}: {stage.batches} пакетов, "
+                         f"{stage.throughput:,.0f} строк/с, работа {stage.busy_seconds:.2f} с, "
+                         f"ожидание {stage.wait_seconds:.2f} с, загрузка {stage.utilization:.0%}{mark}")
+        return lines
@@ -0,0 +1 @@
+from core.neuro_analyzer.neurotransmitter_analyzer import NeurotransmitterAnalyzer
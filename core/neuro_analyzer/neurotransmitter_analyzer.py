@@ -0,0 +1,48 @@
+# core/neuro_analyzer/neurotransmitter_analyzer.py
+from typing import Callable, Optional
+
+from core.metrics_engine import (METRICS_BATCH_SIZE, MetricsCancelled, MetricsEngine, MetricsPlan,
+                                 MetricsProgress, MetricsReport)
+
+
+class NeurotransmitterAnalyzer:
+    def __init__(self, db_path='neuro_data.db'):
+        self.db_path = db_path
+        self.engine: Optional[MetricsEngine] = None
+
+    def cancel(self):
+        """Отмена идущего расчета (вступает в силу на границе пакета)"""
+        if self.engine is not None:
+            self.engine.cancel()
+
+    def plan_metrics(self) -> MetricsPlan:
+        """Сколько тестов и почему будет пересчитано (без расчета)"""
+        return MetricsEngine(self.db_path).plan()
+
+    def calculate_all_metrics(self, on_progress: Optional[Callable[[MetricsProgress], None]] = None,
+                              batch_size: int = METRICS_BATCH_SIZE,
+                              workers: Optional[int] = None) -> Optional[MetricsReport]:
+        """Пересчет устаревших метрик: тестов без метрик, с другой версией алгоритма
+        или с изменившимися входами (пакетами, см. MetricsEngine);
+        workers > 1 - расчет диапазонов в пуле процессов"""
+        self.engine = MetricsEngine(self.db_path, batch_size, workers)
+        try:
+            plan = self.engine.plan()
+            print(f"📋 {plan.describe()}")
+            report = self.engine.run(on_progress, plan)
+        except MetricsCancelled:
+            report = self.engine.report
+            print(f"⏹️ Расчет метрик отменен: рассчитано {report.processed} тестов")
+        except Exception as e:
+            print(f"❌ Ошибка в calculate_all_metrics: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+        else:
+            print(f"✅ Рассчитано метрик для {report.processed} тестов")
+
+        if report.errors:
+            print(f"⚠️ Не рассчитано тестов: {report.failed}")
+            for line in report.error_summary():
+                print(f"   • {line}")
+        return report
@@ -0,0 +1,124 @@
+"""
+Плотное представление времен реакции boxbase: широкий фрейм Tst{1..3}_{1..36}
+преобразуется в непрерывный массив (n_sessions, 3, 36)
+"""
+
+from dataclasses import dataclass
+from typing import List, NamedTuple, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Порядок тестов в кубе совпадает с нумерацией столбцов boxbase (Tst1, Tst2, Tst3)
+TEST_PREFIXES = ('Tst1', 'Tst2', 'Tst3')
+TEST_TYPE_ORDER = ('simple', 'color_red', 'shift')
+STIMULI_PER_TEST = 36
+
+# Ключи сессии, переносимые из boxbase вместе с кубом
+SESSION_KEY_COLUMNS = ['cnt', 'REG_ID']
+
+
+def reaction_time_columns(prefix: str) -> List[str]:
+    """Имена 36 столбцов времени реакции одного теста (например, Tst1_1 ... Tst1_36)"""
+    return [f'{prefix}_{i}' for i in range(1, STIMULI_PER_TEST + 1)]
+
+
+def all_reaction_time_columns() -> List[str]:
+    """Имена всех 108 столбцов времени реакции в порядке куба"""
+    return [col for prefix in TEST_PREFIXES for col in reaction_time_columns(prefix)]
+
+
+class EventView(NamedTuple):
+    """Длинный формат: один элемент - один стимул одной сессии.
+    Все поля имеют форму куба (n_sessions, 3, 36); плоские столбцы дает reshape(-1)"""
+    session_index: np.ndarray
+    test_index: np.ndarray
+    stimulus_number: np.ndarray
+    reaction_time: np.ndarray
+
+
+@dataclass
+class ReactionTimeCube:
+    """
+    Времена реакции всех сессий в виде массива (n_sessions, 3, 36)
+    NaN обозначает отсутствующее значение
+    """
+    reaction_times: np.ndarray
+    session_keys: pd.DataFrame
+
+    @classmethod
+    def from_boxbase(cls, df: pd.DataFrame) -> 'ReactionTimeCube':
+        """Построение куба из широкого фрейма boxbase (одна копия данных)"""
+        columns = all_reaction_time_columns()
+        present = [i for i, col in enumerate(columns) if col in df.columns]
+
+        flat = np.full((len(df), len(columns)), np.nan, dtype=np.float32)
+        if len(present) == len(columns):
+            flat[:] = df[columns].to_numpy(dtype=np.float32, na_value=np.nan)
+        elif present:
+            flat[:, present] = df[[columns[i] for i in present]].to_numpy(dtype=np.float32, na_value=np.nan)
+
+        key_columns = [col for col in SESSION_KEY_COLUMNS if col in df.columns]
+        session_keys = df[key_columns].reset_index(drop=True)
+
+        return cls(flat.reshape(len(df), len(TEST_PREFIXES), STIMULI_PER_TEST), session_keys)
+
+    @property
+    def n_sessions(self) -> int:
+        return self.reaction_times.shape[0]
+
+    def test_matrix(self, test_type: str) -> np.ndarray:
+        """Матрица (n_sessions, 36) одного теста - представление без копирования"""
+        return self.reaction_times[:, TEST_TYPE_ORDER.index(test_type), :]
+
+    def session_means(self, test_types: Optional[Sequence[str]] = None) -> np.ndarray:
+        """Среднее время реакции каждой сессии с пропуском NaN (NaN, если значений нет)"""
+        if test_types is None:
+            values = self.reaction_times.reshape(self.n_sessions, -1)
+        else:
+            indices = [TEST_TYPE_ORDER.index(test_type) for test_type in test_types]
+            values = self.reaction_times[:, indices, :].reshape(self.n_sessions, -1)
+
+        valid = ~np.isnan(values)
+        counts = valid.sum(axis=1)
+        sums = np.where(valid, values, 0).sum(axis=1, dtype=np.float64)
+        return np.divide(sums, counts, out=np.full(self.n_sessions, np.nan), where=counts > 0)
+
+    def event_view(self) -> EventView:
+        """Длинный формат (сессия, тест, номер стимула, время реакции) без копирования.
+
+        Время реакции - сам куб; индексные поля - только для чтения представления
+        np.broadcast_to с нулевым шагом по повторяющимся осям (память - один ряд
+        значений на поле). reshape(-1) или выборка по маске их материализуют.
+        """
+        shape = self.reaction_times.shape
+        n_tests, n_stimuli = shape[1:]
+
+        return EventView(
+            session_index=np.broadcast_to(np.arange(self.n_sessions, dtype=np.int32)[:, None, None], shape),
+            test_index=np.broadcast_to(np.arange(n_tests, dtype=np.int8)[:, None], shape),
+            stimulus_number=np.broadcast_to(np.arange(1, n_stimuli + 1, dtype=np.int8), shape),
+            reaction_time=self.reaction_times
+        )
+
+    def to_event_frame(self, dropna: bool = True) -> pd.DataFrame:
+        """Длинный фрейм событий с ключами сессии и типом теста.
+        При dropna=True материализуются только строки с временем реакции."""
+        events = self.event_view()
+        if dropna:
+            mask = ~np.isnan(events.reaction_time)
+            columns = [field[mask] for field in events]
+        else:
+            columns = [field.reshape(-1) for field in events]
+        session_index, test_index, stimulus_number, reaction_time = columns
+
+        frame = pd.DataFrame({
+            'session_index': session_index,
+            'test_type': pd.Categorical.from_codes(test_index, categories=list(TEST_TYPE_ORDER)),
+            'stimulus_number': stimulus_number,
+            'reaction_time': reaction_time
+        })
+
+        for col in self.session_keys.columns:
+            frame[col] = self.session_keys[col].to_numpy()[session_index]
+        return frame
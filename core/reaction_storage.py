@@ -0,0 +1,192 @@
+# core/reaction_storage.py
+"""
+Упакованное хранение времен реакции visual_tests: 36 значений теста - BLOB из
+36 int16 little-endian (72 байта), отсутствующее значение - -32768.
+Много строк декодируются одним np.frombuffer в массив (n_tests, 36).
+"""
+import json
+import logging
+import sqlite3
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from core.reaction_matrix import STIMULI_PER_TEST
+
+logger = logging.getLogger(__name__)
+
+PACKED_COLUMN = 'reaction_times_packed'
+REACTION_TIME_DTYPE = np.dtype('<i2')
+MISSING_REACTION_TIME = -32768
+PACKED_TEST_BYTES = STIMULI_PER_TEST * REACTION_TIME_DTYPE.itemsize
+
+# Представление с JSON-списком времен реакции для старых инструментов
+COMPAT_VIEW = 'visual_tests_json'
+
+# Строк visual_tests в одном пакете перекодирования
+PACK_BATCH_SIZE = 50_000
+
+# Декодирование BLOB в JSON средствами SQL: hex() BLOB-а, по 4 цифры на значение
+_HEX_DIGITS = "'0123456789ABCDEF'"
+
+
+def _sql_unsigned_value(hex_text: str, position: str) -> str:
+    """SQL-выражение: беззнаковое значение int16 little-endian в позиции position (0..35)"""
+    digit = lambda i: f"(instr({_HEX_DIGITS}, substr({hex_text}, {position} * 4 + {i}, 1)) - 1)"
+    return f"({digit(3)} * 4096 + {digit(4)} * 256 + {digit(1)} * 16 + {digit(2)})"
+
+
+def packable_reaction_times(matrix: np.ndarray) -> np.ndarray:
+    """Маска строк матрицы (n, 36), которые упаковываются в int16 без потерь"""
+    matrix = np.asarray(matrix, dtype=np.float64).reshape(-1, STIMULI_PER_TEST)
+    values = np.where(np.isnan(matrix), 0, matrix)
+    valid = (values == np.round(values)) & (np.abs(values) <= np.iinfo(REACTION_TIME_DTYPE).max)
+    return valid.all(axis=1)
+
+
+def pack_reaction_times(matrix: np.ndarray) -> List[bytes]:
+    """Матрица (n, 36) времен реакции (NaN - пропуск) -> BLOB по 72 байта на строку.
+
+    Значения должны быть целыми в диапазоне int16 (без -32768, это маркер пропуска).
+    """
+    matrix = np.asarray(matrix, dtype=np.float64).reshape(-1, STIMULI_PER_TEST)
+    if not packable_reaction_times(matrix).all():
+        raise ValueError("Времена реакции должны быть целыми числами в диапазоне int16")
+
+    missing = np.isnan(matrix)
+    values = np.where(missing, 0, matrix)
+    packed = np.where(missing, MISSING_REACTION_TIME, values).astype(REACTION_TIME_DTYPE).tobytes()
+    return [packed[start:start + PACKED_TEST_BYTES] for start in range(0, len(packed), PACKED_TEST_BYTES)]
+
+
+def unpack_reaction_times(blobs: Sequence[bytes]) -> np.ndarray:
+    """BLOB-ы тестов -> массив (n, 36) float32 с NaN на месте пропусков"""
+    buffer = b''.join(blobs)
+    if len(buffer) != len(blobs) * PACKED_TEST_BYTES:
+        raise ValueError(f"Ожидались BLOB-ы по {PACKED_TEST_BYTES} байт")
+
+    values = np.frombuffer(buffer, dtype=REACTION_TIME_DTYPE).reshape(len(blobs), STIMULI_PER_TEST)
+    result = values.astype(np.float32)
+    result[values == MISSING_REACTION_TIME] = np.nan
+    return result
+
+
+def reaction_times_from_json(texts: Sequence[Optional[str]]) -> np.ndarray:
+    """JSON-списки времен реакции (прежний формат) -> массив (n, 36) float64 с NaN"""
+    matrix = np.full((len(texts), STIMULI_PER_TEST), np.nan)
+    for row, text in enumerate(texts):
+        if not text:
+            continue
+        values = [np.nan if value is None else value for value in json.loads(text)][:STIMULI_PER_TEST]
+        matrix[row, :len(values)] = values
+    return matrix
+
+
+def load_reaction_times(conn: sqlite3.Connection, test_type: Optional[str] = None,
+                        test_ids: Optional[Sequence[int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Времена реакции тестов одним массивом: (id тестов, матрица (n, 36) float32).
+
+    Тесты без упакованных данных (еще в JSON) декодируются из JSON.
+    """
+    query = f"SELECT id, {PACKED_COLUMN}, raw_reaction_times FROM visual_tests"
+    conditions, params = [], []
+    if test_type is not None:
+        conditions.append("test_type = ?")
+        params.append(test_type)
+    if test_ids is not None:
+        conditions.append(f"id IN ({', '.join('?' for _ in test_ids)})")
+        params.extend(test_ids)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
+
+    rows = conn.execute(query, params).fetchall()
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    packed = np.array([row[1] is not None for row in rows], dtype=bool)
+
+    matrix = np.full((len(rows), STIMULI_PER_TEST), np.nan, dtype=np.float32)
+    if packed.any():
+        matrix[packed] = unpack_reaction_times([row[1] for row in rows if row[1] is not None])
+    if not packed.all():
+        matrix[~packed] = reaction_times_from_json([row[2] for row in rows if row[1] is None])
+    return ids, matrix
+
+
+def ensure_packed_schema(conn: sqlite3.Connection):
+    """Столбец reaction_times_packed в visual_tests и представление visual_tests_json"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(visual_tests)")]
+    if not columns:
+        return
+    if PACKED_COLUMN not in columns:
+        conn.execute(f"ALTER TABLE visual_tests ADD COLUMN {PACKED_COLUMN} BLOB")
+
+    # JSON собирается из BLOB в SQL, чтобы представление читалось любым клиентом SQLite;
+    # разделители - как у json.dumps в прежнем формате
+    unsigned = _sql_unsigned_value('digits.h', 'positions.n')
+    conn.execute(f"DROP VIEW IF EXISTS {COMPAT_VIEW}")
+    conn.execute(f'''
+        CREATE VIEW {COMPAT_VIEW} AS
+        SELECT vt.id, vt.session_id, vt.test_type, vt.test_version,
+               COALESCE(vt.raw_reaction_times, CASE WHEN vt.{PACKED_COLUMN} IS NOT NULL THEN (
+                   SELECT replace(json_group_array(CASE WHEN u = 32768 THEN NULL
+                                                        WHEN u > 32768 THEN u - 65536
+                                                        ELSE u END), ',', ', ')
+                   FROM (
+                       WITH RECURSIVE positions(n) AS (
+                           SELECT 0 UNION ALL SELECT n + 1 FROM positions WHERE n < {STIMULI_PER_TEST - 1}
+                       )
+                       SELECT {unsigned} AS u
+                       FROM positions, (SELECT hex(vt.{PACKED_COLUMN}) AS h) AS digits
+                       ORDER BY positions.n
+                   )
+               ) END) AS raw_reaction_times,
+               vt.raw_metadata, vt.raw_aggregates, vt.calculated_metrics, vt.neurotransmitter_scores,
+               vt.statistical_analysis, vt.analysis_version, vt.is_processed, vt.processed_at, vt.created_at
+        FROM visual_tests vt
+    ''')
+
+
+def migrate_reaction_times_to_packed(db_path: str = 'neuro_data.db', batch_size: int = PACK_BATCH_SIZE) -> dict:
+    """Перекодирование visual_tests.raw_reaction_times из JSON в упакованный BLOB.
+
+    Строки, которые нельзя упаковать без потерь (дробные или слишком большие
+    значения, список не из 36 значений), остаются в JSON. У упакованных строк JSON очищается.
+    """
+    stats = {'packed': 0, 'kept_json': 0}
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            ensure_packed_schema(conn)
+
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, raw_reaction_times FROM visual_tests "
+                f"WHERE id > ? AND raw_reaction_times IS NOT NULL AND {PACKED_COLUMN} IS NULL "
+                "ORDER BY id LIMIT ?",
+                (last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            matrix = reaction_times_from_json([row[1] for row in rows])
+            packable = packable_reaction_times(matrix)
+            # Упаковываются только полные списки из 36 значений (иначе JSON не восстановить)
+            packable &= np.array([len(json.loads(row[1])) == STIMULI_PER_TEST for row in rows])
+
+            blobs = pack_reaction_times(matrix[packable])
+            ids = [row[0] for row, ok in zip(rows, packable) if ok]
+            with conn:
+                conn.executemany(
+                    f"UPDATE visual_tests SET {PACKED_COLUMN} = ?, raw_reaction_times = NULL WHERE id = ?",
+                    zip(blobs, ids)
+                )
+            stats['packed'] += len(ids)
+            stats['kept_json'] += len(rows) - len(ids)
+
+        logger.info(f"Времена реакции упакованы: {stats['packed']} тестов, "
+                    f"оставлено в JSON: {stats['kept_json']}")
+        return stats
+    finally:
+        conn.close()
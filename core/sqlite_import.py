@@ -0,0 +1,218 @@
+# core/sqlite_import.py
+"""
+Инкрементальный импорт users/boxbase в SQLite: строки сопоставляются по ключу
+(ID / cnt) и хэшу содержимого, записываются только новые и измененные строки.
+"""
+import logging
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from core.bulk_writer import BulkSQLiteWriter, iter_frame_rows
+
+logger = logging.getLogger(__name__)
+
+# Ключ строки для каждой таблицы импорта
+IMPORT_KEYS = {'users': 'ID', 'boxbase': 'cnt'}
+
+# Служебный столбец с хэшем содержимого строки
+ROW_HASH_COLUMN = '_row_hash'
+
+# Временная таблица ключей импортируемого фрейма (хэши читаются только для них)
+IMPORT_KEYS_TABLE = '_import_keys'
+
+
+@dataclass
+class ImportDelta:
+    """Результат инкрементального импорта одной таблицы"""
+    table: str
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    rebuilt: bool = False
+    upgraded: bool = False
+    source_unchanged: bool = False
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated
+
+    def merge(self, other: 'ImportDelta'):
+        """Добавление дельты следующей части той же таблицы (импорт файла по чанкам)"""
+        self.inserted += other.inserted
+        self.updated += other.updated
+        self.unchanged += other.unchanged
+        self.skipped += other.skipped
+        self.elapsed += other.elapsed
+        self.rebuilt = self.rebuilt or other.rebuilt
+        self.upgraded = self.upgraded or other.upgraded
+
+    def __str__(self) -> str:
+        if self.source_unchanged:
+            return f"{self.table}: исходный файл не изменился, импорт пропущен"
+        text = (f"{self.table}: +{self.inserted} новых, ~{self.updated} измененных, "
+                f"{self.unchanged} без изменений")
+        if self.skipped:
+            text += f", {self.skipped} без ключа"
+        if self.rebuilt:
+            text += " (таблица создана)"
+        if self.upgraded:
+            text += " (таблица переведена на инкрементальный импорт)"
+        return text
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """Хэш содержимого каждой строки (int64), не зависящий от порядка столбцов и
+    от конкретного плана типов (int16/Int16/float32 с одинаковыми значениями дают один хэш)"""
+    canonical = {}
+    for col in sorted(df.columns):
+        if col == ROW_HASH_COLUMN:
+            continue
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            canonical[col] = series.to_numpy(dtype='datetime64[ns]').view('int64')
+        elif pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+            canonical[col] = series.to_numpy(dtype='float64', na_value=np.nan)
+        else:
+            canonical[col] = series.astype(object).where(series.notna(), None).astype(str).to_numpy()
+
+    frame = pd.DataFrame(canonical, index=df.index)
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy().view(np.int64)
+
+
+class IncrementalImporter:
+    """
+    Импорт фреймов в таблицы SQLite с upsert по ключу.
+    Хэши существующих строк читаются из служебного столбца только для ключей
+    импортируемого фрейма, поэтому повторный импорт выгрузки, в которой добавилось
+    2% сессий, записывает только эти 2%, а импорт частями не перечитывает таблицу.
+    Таблица, записанная раньше полной заменой (без столбца хэшей), дополняется
+    на месте: ее строки без хэша считаются измененными и перезаписываются.
+    """
+
+    def __init__(self, db_path: str = 'neuro_data.db'):
+        self.db_path = db_path
+
+    def import_frames(self, frames: Dict[str, pd.DataFrame]) -> Dict[str, ImportDelta]:
+        """Импорт нескольких таблиц одним соединением: {таблица: фрейм}"""
+        deltas = {}
+        with BulkSQLiteWriter(self.db_path) as writer:
+            for table, df in frames.items():
+                deltas[table] = self.import_frame(writer.connection, table, df)
+                writer.record_rows(deltas[table].written)
+        logger.info(f"Инкрементальный импорт: {writer.summary()}")
+        return deltas
+
+    def import_frame(self, conn: sqlite3.Connection, table: str, df: pd.DataFrame,
+                     key: Optional[str] = None) -> ImportDelta:
+        """Upsert фрейма в таблицу по ключу; возвращает дельту импорта"""
+        started = time.perf_counter()
+        key = key or IMPORT_KEYS.get(table)
+        if key is None or key not in df.columns:
+            raise ValueError(f"Не найден ключевой столбец для таблицы {table}: {key}")
+
+        delta = ImportDelta(table)
+
+        # Строки без ключа не могут быть сопоставлены; дубликаты ключа - берется последняя
+        has_key = df[key].notna()
+        delta.skipped = int((~has_key).sum())
+        df = df[has_key]
+        duplicated = df[key].duplicated(keep='last')
+        if duplicated.any():
+            logger.warning(f"{table}: {int(duplicated.sum())} повторяющихся значений {key}, берется последнее")
+            df = df[~duplicated]
+
+        df = df.assign(**{ROW_HASH_COLUMN: row_hashes(df)})
+
+        with conn:
+            existing_columns = self._table_columns(conn, table)
+            if not existing_columns:
+                self._create_table(conn, table, df, key)
+                delta.rebuilt = True
+            else:
+                if ROW_HASH_COLUMN not in existing_columns:
+                    # Таблица записана полной заменой - дополняется на месте, данные не удаляются
+                    self._upgrade_table(conn, table, key)
+                    delta.upgraded = True
+                for col in df.columns:
+                    if col not in existing_columns and col != ROW_HASH_COLUMN:
+                        conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{col}"')
+
+            existing = self._existing_hashes(conn, table, key, df[key]) if not delta.rebuilt \
+                else pd.Series(dtype=object)
+            hashes = df[ROW_HASH_COLUMN].to_numpy()
+            positions = existing.index.get_indexer(df[key])
+            is_new = positions < 0
+            # Строка без хэша (таблица до перехода на инкрементальный импорт) считается измененной
+            known_hash = existing.to_numpy(dtype=object)[np.where(is_new, 0, positions)] \
+                if len(existing) else np.full(len(df), None, dtype=object)
+            is_changed = ~is_new & (known_hash != hashes)
+
+            delta.inserted = int(is_new.sum())
+            delta.updated = int(is_changed.sum())
+            delta.unchanged = len(df) - delta.inserted - delta.updated
+
+            to_write = df[is_new | is_changed]
+            if len(to_write):
+                self._upsert(conn, table, to_write, key)
+
+        delta.elapsed = time.perf_counter() - started
+        logger.info(f"Инкрементальный импорт {delta} за {delta.elapsed:.2f} с")
+        return delta
+
+    @staticmethod
+    def _table_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+        return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+    @staticmethod
+    def _create_table(conn: sqlite3.Connection, table: str, df: pd.DataFrame, key: str):
+        """Создание отсутствующей таблицы по типам фрейма с уникальным индексом по ключу"""
+        df.head(0).to_sql(table, conn, index=False)
+        conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "idx_{table}_{key}_unique" ON "{table}" ("{key}")')
+
+    @staticmethod
+    def _upgrade_table(conn: sqlite3.Connection, table: str, key: str):
+        """Таблица без столбца хэшей -> формат импорта: столбец хэшей (пустой) и
+        уникальный индекс по ключу. Из повторов ключа остается последняя строка,
+        как при импорте фрейма."""
+        conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{ROW_HASH_COLUMN}" INTEGER')
+        removed = conn.execute(
+            f'DELETE FROM "{table}" WHERE "{key}" IS NOT NULL AND rowid NOT IN '
+            f'(SELECT MAX(rowid) FROM "{table}" WHERE "{key}" IS NOT NULL GROUP BY "{key}")'
+        ).rowcount
+        if removed:
+            logger.warning(f"{table}: удалено {removed} повторяющихся строк по {key} (оставлены последние)")
+        conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "idx_{table}_{key}_unique" ON "{table}" ("{key}")')
+        logger.info(f"{table}: таблица переведена на инкрементальный импорт")
+
+    @staticmethod
+    def _existing_hashes(conn: sqlite3.Connection, table: str, key: str, keys: pd.Series) -> pd.Series:
+        """Хэши строк таблицы для ключей фрейма: ключи - во временную таблицу,
+        хэши - соединением с таблицей по уникальному индексу ключа"""
+        conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS "{IMPORT_KEYS_TABLE}" ("value" PRIMARY KEY) WITHOUT ROWID')
+        conn.execute(f'DELETE FROM "{IMPORT_KEYS_TABLE}"')
+        conn.executemany(f'INSERT INTO "{IMPORT_KEYS_TABLE}" ("value") VALUES (?)',
+                         ((value,) for value in keys.astype(object).tolist()))
+        rows = conn.execute(
+            f'SELECT t."{key}", t."{ROW_HASH_COLUMN}" FROM "{IMPORT_KEYS_TABLE}" k '
+            f'JOIN "{table}" t ON t."{key}" = k."value"'
+        ).fetchall()
+        conn.execute(f'DELETE FROM "{IMPORT_KEYS_TABLE}"')
+        return pd.Series([row[1] for row in rows], index=[row[0] for row in rows], dtype=object)
+
+    @staticmethod
+    def _upsert(conn: sqlite3.Connection, table: str, df: pd.DataFrame, key: str):
+        columns = ', '.join(f'"{col}"' for col in df.columns)
+        placeholders = ', '.join('?' for _ in df.columns)
+        assignments = ', '.join(f'"{col}" = excluded."{col}"' for col in df.columns if col != key)
+        conn.executemany(
+            f'INSERT INTO "{table}" ({columns}) VALUES ({placeholders}) '
+            f'ON CONFLICT("{key}") DO UPDATE SET {assignments}',
+            iter_frame_rows(df)
+        )
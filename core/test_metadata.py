@@ -2,11 +2,16 @@
 Метаданные тестов СЗР - полные параметры псевдо-случайных последовательностей
 """
 
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+from itertools import combinations
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import hashlib
+import json
 import sqlite3
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 # Базовые константы (существующие)
@@ -36,6 +41,27 @@ TEST_TYPES = {
     "shift": "Реакция на сдвиг"
 }
 
+# Целые коды (с 1) цветов и позиций в порядке справочников: таблицы событий,
+# массивы метаданных для процессов пула
+COLOR_CODES = {color: code for code, color in enumerate(STIMULUS_COLORS, start=1)}
+POSITION_CODES = {position: code for code, position in enumerate(STIMULUS_POSITIONS, start=1)}
+
+# Параметр testing_system_parameters с хэшем содержимого метаданных (версия,
+# которой помечаются результаты анализаторов); в сами параметры не входит
+METADATA_VERSION_PARAMETER = "METADATA_VERSION"
+
+# Столбец версии метаданных в таблицах результатов
+METADATA_VERSION_COLUMN = "metadata_version"
+
+# Версии метаданных, по которым построены производные таблицы (таблица целиком)
+DERIVED_VERSIONS_TABLE = "derived_table_versions"
+
+# Атрибуты стимула, по которым строятся индексы и маски
+STIMULUS_ATTRIBUTES = ("color", "position", "prestimulus_interval", "shift_parameter")
+
+_EMPTY_INDEX = np.array([], dtype=np.intp)
+_EMPTY_INDEX.flags.writeable = False
+
 
 # Новые классы для управления метаданными
 @dataclass
@@ -49,20 +75,105 @@ class StimulusMetadata:
     shift_parameter: Optional[int] = None
 
 
+class StimulusIndex:
+    """
+    Индексы стимулов одного теста по значениям атрибутов и их сочетаниям.
+
+    Для каждого атрибута из STIMULUS_ATTRIBUTES и каждого их сочетания строятся
+    массивы номеров столбцов (0..35) и булевы маски, которыми матрица времен
+    реакции (сессии, 36) выбирается без обхода стимулов. Массивы только для чтения.
+    """
+
+    def __init__(self, stimuli: List[StimulusMetadata]):
+        self.n_stimuli = len(stimuli)
+        self._indices: Dict[Tuple[str, ...], Dict[tuple, np.ndarray]] = {}
+        self._masks: Dict[Tuple[str, ...], Dict[tuple, np.ndarray]] = {}
+
+        columns = {attribute: [getattr(stimulus, attribute) for stimulus in stimuli]
+                   for attribute in STIMULUS_ATTRIBUTES}
+        for size in range(1, len(STIMULUS_ATTRIBUTES) + 1):
+            for attributes in combinations(STIMULUS_ATTRIBUTES, size):
+                positions: Dict[tuple, List[int]] = {}
+                for position, key in enumerate(zip(*(columns[attribute] for attribute in attributes))):
+                    positions.setdefault(key, []).append(position)
+
+                # Группы - в порядке первого появления значения в последовательности
+                indices, masks = {}, {}
+                for key, values in positions.items():
+                    index = np.array(values, dtype=np.intp)
+                    mask = np.zeros(self.n_stimuli, dtype=bool)
+                    mask[index] = True
+                    index.flags.writeable = False
+                    mask.flags.writeable = False
+                    indices[key], masks[key] = index, mask
+                self._indices[attributes], self._masks[attributes] = indices, masks
+
+    @staticmethod
+    def _canonical(attributes: Sequence[str]) -> Tuple[str, ...]:
+        unknown = [attribute for attribute in attributes if attribute not in STIMULUS_ATTRIBUTES]
+        if unknown or not attributes or len(set(attributes)) != len(attributes):
+            raise ValueError(f"Ожидались различные атрибуты из {', '.join(STIMULUS_ATTRIBUTES)}: "
+                             f"{', '.join(attributes)}")
+        return tuple(attribute for attribute in STIMULUS_ATTRIBUTES if attribute in attributes)
+
+    def _grouped(self, table, attributes: Sequence[str]) -> Dict[Any, np.ndarray]:
+        canonical = self._canonical(attributes)
+        # Ключи - в порядке запрошенных атрибутов; один атрибут - значение без кортежа
+        order = [canonical.index(attribute) for attribute in attributes]
+        return {(key[0] if len(order) == 1 else tuple(key[i] for i in order)): value
+                for key, value in table[canonical].items()}
+
+    def groups(self, *attributes: str) -> Dict[Any, np.ndarray]:
+        """Номера столбцов стимулов по значениям атрибутов: {значение(я): массив индексов}"""
+        return self._grouped(self._indices, attributes)
+
+    def masks(self, *attributes: str) -> Dict[Any, np.ndarray]:
+        """Булевы маски стимулов по значениям атрибутов: {значение(я): маска длины n_stimuli}"""
+        return self._grouped(self._masks, attributes)
+
+    def codes(self, *attributes: str) -> Tuple[List[Any], np.ndarray]:
+        """Коды групп стимулов: (ключи групп, код группы каждого стимула - номер ключа)"""
+        groups = self.groups(*attributes)
+        codes = np.empty(self.n_stimuli, dtype=np.int16)
+        for code, index in enumerate(groups.values()):
+            codes[index] = code
+        return list(groups), codes
+
+    def select(self, **criteria) -> np.ndarray:
+        """Номера столбцов стимулов с заданными значениями атрибутов (color='red', position='left', ...)"""
+        canonical = self._canonical(tuple(criteria))
+        index = self._indices[canonical].get(tuple(criteria[attribute] for attribute in canonical))
+        return index if index is not None else _EMPTY_INDEX
+
+    def mask(self, **criteria) -> np.ndarray:
+        """Булева маска стимулов с заданными значениями атрибутов"""
+        canonical = self._canonical(tuple(criteria))
+        mask = self._masks[canonical].get(tuple(criteria[attribute] for attribute in canonical))
+        return mask if mask is not None else np.zeros(self.n_stimuli, dtype=bool)
+
+
 @dataclass
 class TestMetadata:
     """Метаданные полного теста (36 стимулов)"""
     test_type: str
     stimuli: List[StimulusMetadata]
+    _index: Optional[StimulusIndex] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def index(self) -> StimulusIndex:
+        """Индексы и маски стимулов (строятся при первом обращении или менеджером)"""
+        if self._index is None or self._index.n_stimuli != len(self.stimuli):
+            self._index = StimulusIndex(self.stimuli)
+        return self._index
 
     def get_stimulus(self, number: int) -> StimulusMetadata:
         return self.stimuli[number - 1]
 
     def get_by_color(self, color: str) -> List[StimulusMetadata]:
-        return [s for s in self.stimuli if s.color == color]
+        return [self.stimuli[i] for i in self.index.select(color=color)]
 
     def get_by_position(self, position: str) -> List[StimulusMetadata]:
-        return [s for s in self.stimuli if s.position == position]
+        return [self.stimuli[i] for i in self.index.select(position=position)]
 
 
 class TestMetadataManager:
@@ -74,6 +185,10 @@ class TestMetadataManager:
     def __init__(self):
         self._metadata_cache: Dict[str, TestMetadata] = {}
         self._system_parameters = SYSTEM_PARAMETERS.copy()
+        self._arrays = None
+        self._content_hash: Optional[str] = None
+        # Версия, записанная в testing_system_parameters (после load_from_database)
+        self.stored_version: Optional[str] = None
         self._initialize_metadata()
 
     def _initialize_metadata(self):
@@ -203,9 +318,17 @@ class TestMetadataManager:
 
 
         self._metadata_cache["shift"] = TestMetadata("shift", shift_stimuli)
+        self._build_indexes()
 
         logger.info("✅ Встроенные метаданные тестирования загружены")
 
+    def _build_indexes(self):
+        """Индексы и маски стимулов всех тестов (после каждой загрузки метаданных)"""
+        for test_meta in self._metadata_cache.values():
+            test_meta._index = StimulusIndex(test_meta.stimuli)
+        self._arrays = None
+        self._content_hash = None
+
     def load_from_database(self, db_connection):
         """Загрузить метаданные из базы данных"""
         try:
@@ -246,16 +369,22 @@ class TestMetadataManager:
 
                     self._metadata_cache[test_type].stimuli.append(stimulus)
 
+                self._build_indexes()
+
                 # Загрузить системные параметры
                 cursor.execute("SELECT parameter_name, parameter_value FROM testing_system_parameters")
                 system_params_rows = cursor.fetchall()
 
                 for param_name, param_value in system_params_rows:
+                    if param_name == METADATA_VERSION_PARAMETER:
+                        self.stored_version = param_value
+                        continue
                     try:
                         self._system_parameters[param_name] = int(param_value)
                     except ValueError:
                         # Если не число, сохраняем как строку
                         self._system_parameters[param_name] = param_value
+                self._content_hash = None
 
                 logger.info(f"✅ Метаданные загружены из БД: {len(self._metadata_cache)} тестов, "
                             f"{len(rows)} стимулов, {len(system_params_rows)} параметров")
@@ -273,6 +402,58 @@ class TestMetadataManager:
         """Получить метаданные для конкретного теста"""
         return self._metadata_cache.get(test_type)
 
+    def get_stimulus_index(self, test_type: str) -> Optional[StimulusIndex]:
+        """Индексы и маски стимулов теста для выборки столбцов матрицы (сессии, 36)"""
+        test_meta = self.get_test_metadata(test_type)
+        return test_meta.index if test_meta else None
+
+    def get_metadata_arrays(self):
+        """Последовательности всех тестов структурой массивов (core.metadata_arrays)
+        для публикации процессам пула; строится заново после перезагрузки метаданных"""
+        if self._arrays is None:
+            from core.metadata_arrays import MetadataArrays
+            self._arrays = MetadataArrays.from_manager(self)
+        return self._arrays
+
+    @property
+    def version(self) -> str:
+        """Версия метаданных - хэш загруженного содержимого. Записанная в базе версия
+        (stored_version) с ним только сверяется: правка test_metadata без обновления
+        записи все равно меняет версию."""
+        return self.content_hash
+
+    @property
+    def stored_version_outdated(self) -> bool:
+        """Записанная в базе версия не соответствует загруженному содержимому"""
+        return self.stored_version is not None and self.stored_version != self.content_hash
+
+    @property
+    def content_hash(self) -> str:
+        """Хэш содержимого загруженных последовательностей и системных параметров.
+        Не зависит от порядка загрузки и типов значений параметров (число или строка)."""
+        if self._content_hash is None:
+            content = {
+                'tests': {test_type: [[stimulus.stimulus_number, stimulus.color, stimulus.position,
+                                       stimulus.prestimulus_interval, stimulus.circle_sequence,
+                                       stimulus.shift_parameter] for stimulus in test_meta.stimuli]
+                          for test_type, test_meta in self._metadata_cache.items()},
+                'parameters': {name: str(value) for name, value in self._system_parameters.items()},
+            }
+            text = json.dumps(content, ensure_ascii=False, sort_keys=True)
+            self._content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+        return self._content_hash
+
+    def save_version(self, db_connection):
+        """Записать хэш содержимого в testing_system_parameters (в транзакции вызывающего)"""
+        db_connection.execute(
+            "INSERT OR REPLACE INTO testing_system_parameters (parameter_name, parameter_value, description) "
+            "VALUES (?, ?, ?)",
+            (METADATA_VERSION_PARAMETER, self.content_hash, "Хэш содержимого метаданных тестирования")
+        )
+        self.stored_version = self.content_hash
+        # Версия входит в структуру массивов
+        self._arrays = None
+
     def get_stimulus_metadata(self, test_type: str, stimulus_number: int) -> Optional[StimulusMetadata]:
         """Получить метаданные конкретного стимула"""
         test_meta = self.get_test_metadata(test_type)
@@ -326,3 +507,62 @@ class TestMetadataManager:
         for param, value in self._system_parameters.items():
             print(f"   • {param}: {value}")
 
+
+def _table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return row is not None
+
+
+def load_metadata_manager(conn: sqlite3.Connection) -> TestMetadataManager:
+    """Отдельный менеджер с метаданными базы: из test_metadata, если таблица есть, иначе встроенные"""
+    manager = TestMetadataManager()
+    if _table_exists(conn, 'test_metadata'):
+        manager.load_from_database(conn)
+    return manager
+
+
+def current_metadata_version(conn: sqlite3.Connection) -> str:
+    """Версия метаданных базы - хэш метаданных, которые будут загружены (test_metadata
+    и системные параметры, без таблиц - встроенные). Расхождение с записанной версией
+    (строки изменены в обход populate_metadata_tables) попадает в журнал."""
+    manager = load_metadata_manager(conn)
+    if manager.stored_version_outdated:
+        logger.warning(f"Метаданные тестирования изменены после записи версии {manager.stored_version}: "
+                       f"текущая версия {manager.version}, зависящие от них результаты устарели")
+    return manager.version
+
+
+def stamp_derived_table(conn: sqlite3.Connection, table: str, version: str):
+    """Отметить, по какой версии метаданных построена производная таблица
+    (в транзакции вызывающего)"""
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {DERIVED_VERSIONS_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            {METADATA_VERSION_COLUMN} TEXT NOT NULL,
+            built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute(f"INSERT OR REPLACE INTO {DERIVED_VERSIONS_TABLE} (table_name, {METADATA_VERSION_COLUMN}) "
+                 f"VALUES (?, ?)", (table, version))
+
+
+def derived_table_version(conn: sqlite3.Connection, table: str) -> Optional[str]:
+    """Версия метаданных, по которой построена производная таблица (None - неизвестна)"""
+    if not _table_exists(conn, DERIVED_VERSIONS_TABLE):
+        return None
+    row = conn.execute(f"SELECT {METADATA_VERSION_COLUMN} FROM {DERIVED_VERSIONS_TABLE} WHERE table_name = ?",
+                       (table,)).fetchone()
+    return row[0] if row else None
+
+
+# Общий экземпляр менеджера метаданных (создается при первом обращении)
+_metadata_manager: Optional[TestMetadataManager] = None
+
+
+def get_metadata_manager() -> TestMetadataManager:
+    """Общий менеджер метаданных. Создается при первом обращении, а не при импорте
+    модуля: процессы пула метрик импортируют модуль, но менеджер им не нужен."""
+    global _metadata_manager
+    if _metadata_manager is None:
+        _metadata_manager = TestMetadataManager()
+    return _metadata_manager
@@ -7,6 +7,8 @@ from typing import Callable, Optional
 import pandas as pd
 import sqlite3
 
+from core.ingestion import ConcurrentIngestor, IngestionTask, IngestionCancelled
+
 
 class DataLoaderUI:
     """Компонент интерфейса для загрузки данных с автоматическим сохранением в SQLite"""
@@ -20,6 +22,7 @@ class DataLoaderUI:
         self.users_data: Optional[pd.DataFrame] = None
         self.boxbase_data: Optional[pd.DataFrame] = None
         self._auto_save_shown = False  # Для отслеживания показа уведомления
+        self._ingestor: Optional[ConcurrentIngestor] = None
         self.new_schema_available = False
         self._check_new_schema()
 
@@ -394,6 +397,21 @@ class DataLoaderUI:
         ttk.Button(boxbase_frame, text="📁 Загрузить Boxbase",
                    command=self.load_boxbase_any).pack(side=tk.LEFT, padx=5)
 
+        # Параллельная загрузка Users + одного или нескольких Boxbase
+        parallel_frame = ttk.Frame(data_frame)
+        parallel_frame.pack(fill=tk.X, pady=5)
+
+        ttk.Label(parallel_frame, text="Users + Boxbase:", font=("Arial", 9, "bold")).pack(side=tk.LEFT)
+        self.parallel_button = ttk.Button(parallel_frame, text="⚡ Параллельная загрузка",
+                                          command=self.load_files_parallel)
+        self.parallel_button.pack(side=tk.LEFT, padx=5)
+        self.cancel_button = ttk.Button(parallel_frame, text="⏹ Отмена",
+                                        command=self.cancel_parallel_load, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=5)
+
+        self.ingestion_progress_label = ttk.Label(data_frame, text="", foreground="gray")
+        self.ingestion_progress_label.pack(fill=tk.X)
+
         # Кнопки управления
         button_frame = ttk.Frame(data_frame)
         button_frame.pack(fill=tk.X, pady=10)
@@ -443,12 +461,14 @@ class DataLoaderUI:
                    command=self.save_to_database).pack(side=tk.LEFT, padx=5)
 
         # Информация о Access
-        access_info = ttk.Label(
-            access_frame,
-            text="✅ Драйверы Access доступны" if self.data_loader.access_drivers_available
-            else "❌ Драйверы Access не найдены",
-            foreground="green" if self.data_loader.access_drivers_available else "red"
-        )
+        if self.data_loader.access_drivers_available:
+            access_text, access_color = "✅ Драйверы Access доступны", "green"
+        elif self.data_loader.mdbtools_available:
+            access_text, access_color = "✅ Драйверы Access не найдены, используется mdbtools", "green"
+        else:
+            access_text, access_color = "❌ Драйверы Access не найдены", "red"
+
+        access_info = ttk.Label(access_frame, text=access_text, foreground=access_color)
         access_info.pack(pady=5)
 
     def setup_database_tab(self):
@@ -555,18 +575,9 @@ class DataLoaderUI:
     def _auto_save_to_database(self):
         """Автоматическое сохранение данных в SQLite базу"""
         try:
-            conn = sqlite3.connect(self.db_path)
-
-            if self.users_data is not None:
-                self.users_data.to_sql('users', conn, if_exists='replace', index=False)
-                print("✅ Users автоматически сохранены в SQLite")
-
-            if self.boxbase_data is not None:
-                self.boxbase_data.to_sql('boxbase', conn, if_exists='replace', index=False)
-                print("✅ Boxbase автоматически сохранены в SQLite")
-
-            conn.commit()
-            conn.close()
+            deltas = self.data_loader.save_to_sqlite(self.db_path)
+            for delta in deltas.values():
+                print(f"✅ Автоматически сохранено в SQLite: {delta}")
 
             # Обновляем статистику БД
             self.update_db_stats()
@@ -588,18 +599,10 @@ class DataLoaderUI:
             return
 
         try:
-            conn = sqlite3.connect(self.db_path)
-
-            if self.users_data is not None:
-                self.users_data.to_sql('users', conn, if_exists='replace', index=False)
-
-            if self.boxbase_data is not None:
-                self.boxbase_data.to_sql('boxbase', conn, if_exists='replace', index=False)
-
-            conn.commit()
-            conn.close()
+            deltas = self.data_loader.save_to_sqlite(self.db_path)
 
-            messagebox.showinfo("Успех", "Данные успешно сохранены в базу!")
+            messagebox.showinfo("Успех", "Данные успешно сохранены в базу!\n\n" +
+                                "\n".join(str(delta) for delta in deltas.values()))
             self.update_db_stats()
 
         except Exception as e:
@@ -798,6 +801,101 @@ class DataLoaderUI:
             if self.boxbase_data is not None:
                 self.on_data_loaded('boxbase', file_path, self.boxbase_data)
 
+    def load_files_parallel(self):
+        """Параллельная загрузка Users и нескольких файлов Boxbase в пуле процессов"""
+        users_file = filedialog.askopenfilename(
+            title="Выберите файл Users (можно отменить)",
+            filetypes=[("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        boxbase_files = filedialog.askopenfilenames(
+            title="Выберите файлы Boxbase (можно несколько)",
+            filetypes=[
+                ("CSV files", "*.csv"),
+                ("Excel files", "*.xlsx *.xls"),
+                ("Access files", "*.mdb *.accdb"),
+                ("All files", "*.*")
+            ]
+        )
+
+        tasks = []
+        if users_file:
+            tasks.append(IngestionTask('users', users_file))
+        tasks.extend(IngestionTask('boxbase', file_path) for file_path in boxbase_files)
+        if not tasks:
+            return
+
+        self._ingestor = ConcurrentIngestor()
+        self.parallel_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+
+        thread = threading.Thread(target=self._run_ingestion, args=(self._ingestor, tasks))
+        thread.daemon = True
+        thread.start()
+
+    def cancel_parallel_load(self):
+        """Отмена параллельной загрузки"""
+        if self._ingestor is not None:
+            self._ingestor.cancel()
+            self.ingestion_progress_label.config(text="Отмена загрузки...")
+
+    def _run_ingestion(self, ingestor, tasks):
+        """Параллельная загрузка (выполняется в отдельном потоке)"""
+        def on_progress(progress):
+            self.parent.after(0, self._on_ingestion_progress, list(ingestor.progress))
+
+        try:
+            frames = ingestor.run(tasks, on_progress=on_progress)
+            self.parent.after(0, self._on_ingestion_finished, frames, dict(ingestor.errors))
+        except IngestionCancelled:
+            self.parent.after(0, self._on_ingestion_cancelled)
+        except Exception as e:
+            self.parent.after(0, self._on_ingestion_cancelled)
+            self.parent.after(0, self._on_load_error, f"Параллельная загрузка: {str(e)}")
+
+    def _on_ingestion_progress(self, progress_list):
+        """Обновление строки прогресса: строки, объем и оставшееся время по каждому файлу"""
+        parts = []
+        for progress in progress_list:
+            eta = progress.eta_seconds
+            eta_text = f", ~{eta:.0f} с" if eta is not None and progress.status == 'running' else ""
+            parts.append(
+                f"{os.path.basename(progress.file_path)}: {progress.rows_parsed} строк, "
+                f"{progress.bytes_read / 1024:.0f}/{progress.total_bytes / 1024:.0f} КБ{eta_text} "
+                f"[{progress.status}]"
+            )
+        self.ingestion_progress_label.config(text="\n".join(parts))
+
+    def _on_ingestion_finished(self, frames, errors):
+        """Обработка результатов параллельной загрузки"""
+        self._ingestor = None
+        self.parallel_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+        # Объединенные таблицы не соответствуют одному исходному файлу - манифест для них не ведется
+        if 'users' in frames:
+            self.users_data = self.data_loader.users_df = frames['users']
+            self.data_loader.source_files.pop('users', None)
+        if 'boxbase' in frames:
+            self.boxbase_data = self.data_loader.boxbase_df = frames['boxbase']
+            self.data_loader.source_files.pop('boxbase', None)
+
+        self.update_status()
+        for data_type, data in frames.items():
+            self.on_data_loaded(data_type, "parallel", data)
+
+        if errors:
+            self._on_load_error("\n".join(f"{os.path.basename(path)}: {error}" for path, error in errors.items()))
+
+        if self.users_data is not None and self.boxbase_data is not None:
+            self._auto_save_to_database()
+
+    def _on_ingestion_cancelled(self):
+        """Восстановление кнопок после отмены или ошибки параллельной загрузки"""
+        self._ingestor = None
+        self.parallel_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.ingestion_progress_label.config(text="Загрузка отменена")
+
     def _load_data_thread(self, data_type, file_path):
         """Загрузка данных в отдельном потоке"""
         thread = threading.Thread(target=self._load_data, args=(data_type, file_path))
@@ -852,12 +950,27 @@ class DataLoaderUI:
             info = self.data_loader.get_data_info()
             schema_info = "Новая схема: доступна" if info['new_schema_available'] else "Новая схема: недоступна"
 
+            # Разбор дат: быстрый путь / медленный путь / не разобрано
+            parse_lines = []
+            for data_type, columns in info.get('parse_stats', {}).items():
+                for col, stats in columns.items():
+                    parse_lines.append(
+                        f"Даты {data_type}.{col}: {stats['fast']} быстро, "
+                        f"{stats['fallback']} медленно, {stats['failed']} ошибок"
+                    )
+            parse_info = "\n".join(parse_lines) + "\n" if parse_lines else ""
+
             messagebox.showinfo(
                 "Информация о данных",
                 f"Users: {'Загружены' if info['users_loaded'] else 'Не загружены'}\n"
                 f"Boxbase: {'Загружены' if info['boxbase_loaded'] else 'Не загружены'}\n"
                 f"Строк Users: {info['users_rows']}\n"
                 f"Строк Boxbase: {info['boxbase_rows']}\n"
+                f"Память Users: {info['users_memory_before'] / 1024:.0f} КБ -> "
+                f"{info['users_memory_usage'] / 1024:.0f} КБ\n"
+                f"Память Boxbase: {info['boxbase_memory_before'] / 1024:.0f} КБ -> "
+                f"{info['boxbase_memory_usage'] / 1024:.0f} КБ\n"
+                f"{parse_info}"
                 f"{schema_info}\n\n"
                 f"SQLite база: {'✅ создана' if os.path.exists(self.db_path) else '❌ отсутствует'}"
             )
@@ -70,8 +70,9 @@ def auto_migrate_database():
 def initialize_test_metadata():
     """Инициализировать метаданные тестирования из базы данных"""
     try:
-        from core.test_metadata import metadata_manager
+        from core.test_metadata import get_metadata_manager
 
+        metadata_manager = get_metadata_manager()
         conn = sqlite3.connect("neuro_data.db")
         success = metadata_manager.load_from_database(conn)
         conn.close()
@@ -3,6 +3,7 @@ from typing import Dict, Any
 import pandas as pd
 from modules.demographic import DemographicAnalyzer
 from modules.test_analyzer import TestAnalyzer
+from core.reaction_matrix import ReactionTimeCube
 
 
 class ComprehensiveAnalyzer:
@@ -48,8 +49,7 @@ class ComprehensiveAnalyzer:
         merged_data['Age'] = current_year - merged_data['YBorn'].dt.year
 
         # Расчет среднего времени реакции по тестам
-        test_columns = [f'Tst{i}_{j}' for i in range(1, 4) for j in range(1, 37)]
-        merged_data['MeanReactionTime'] = merged_data[test_columns].mean(axis=1)
+        merged_data['MeanReactionTime'] = ReactionTimeCube.from_boxbase(merged_data).session_means()
 
         # Корреляция возраста и времени реакции
         correlation = merged_data['Age'].corr(merged_data['MeanReactionTime'])
@@ -64,8 +64,7 @@ class ComprehensiveAnalyzer:
         if 'Gender' not in merged_data.columns:
             return {}
 
-        test_columns = [f'Tst{i}_{j}' for i in range(1, 4) for j in range(1, 37)]
-        merged_data['MeanReactionTime'] = merged_data[test_columns].mean(axis=1)
+        merged_data['MeanReactionTime'] = ReactionTimeCube.from_boxbase(merged_data).session_means()
 
         gender_stats = merged_data.groupby('Gender')['MeanReactionTime'].agg(['mean', 'std', 'count']).to_dict()
 
@@ -1,8 +1,18 @@
 # modules/test_analyzer.py
+import warnings
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any
-from core.test_metadata import TestMetadata
+from typing import Dict, List, Any, Optional
+from core.test_metadata import TestMetadataManager
+from core.reaction_matrix import ReactionTimeCube
+from core.grouped_stats import grouped_stats
+
+# Группировки стимулов в групповой статистике: имя -> атрибуты стимула
+STIMULUS_GROUPINGS = {
+    'color': ('color',),
+    'position': ('position',),
+    'interval': ('prestimulus_interval',),
+}
 
 
 class TestAnalyzer:
@@ -10,18 +20,21 @@ class TestAnalyzer:
 
     def __init__(self, boxbase_data: pd.DataFrame):
         self.boxbase_data = boxbase_data
-        self.metadata = TestMetadata()
+        self.metadata = TestMetadataManager()
+        self.cube = ReactionTimeCube.from_boxbase(boxbase_data)
 
     def analyze_simple_test(self) -> Dict[str, Any]:
         """Анализ простого теста"""
-        test_columns = [f'Tst1_{i}' for i in range(1, 37)]
-        reaction_times = self.boxbase_data[test_columns]
+        reaction_times = self.cube.test_matrix('simple')
+        group_stats = self.group_stats('simple', reaction_times)
 
         analysis = {
             'basic_stats': self._calculate_basic_stats(reaction_times),
-            'by_color': self._analyze_by_color('simple', reaction_times),
-            'by_position': self._analyze_by_position('simple', reaction_times),
-            'by_interval': self._analyze_by_interval('simple', reaction_times),
+            'by_color': self._groups_from_table(group_stats, 'color'),
+            'by_position': self._groups_from_table(group_stats, 'position'),
+            'by_interval': {f"{interval}ms": stats for interval, stats
+                            in self._groups_from_table(group_stats, 'interval').items()},
+            'group_stats': group_stats,
             'errors': self._analyze_errors('simple')
         }
 
@@ -29,8 +42,7 @@ class TestAnalyzer:
 
     def analyze_color_red_test(self) -> Dict[str, Any]:
         """Анализ теста с красным стимулом"""
-        test_columns = [f'Tst2_{i}' for i in range(1, 37)]
-        reaction_times = self.boxbase_data[test_columns]
+        reaction_times = self.cube.test_matrix('color_red')
 
         analysis = {
             'basic_stats': self._calculate_basic_stats(reaction_times),
@@ -42,8 +54,7 @@ class TestAnalyzer:
 
     def analyze_shift_test(self) -> Dict[str, Any]:
         """Анализ теста со смещением"""
-        test_columns = [f'Tst3_{i}' for i in range(1, 37)]
-        reaction_times = self.boxbase_data[test_columns]
+        reaction_times = self.cube.test_matrix('shift')
 
         analysis = {
             'basic_stats': self._calculate_basic_stats(reaction_times),
@@ -53,91 +64,35 @@ class TestAnalyzer:
 
         return analysis
 
-    def _calculate_basic_stats(self, reaction_times: pd.DataFrame) -> Dict[str, float]:
+    def _calculate_basic_stats(self, reaction_times: np.ndarray) -> Dict[str, float]:
         """Расчет базовой статистики"""
-        return {
-            'mean_reaction_time': float(reaction_times.mean().mean()),
-            'std_reaction_time': float(reaction_times.std().mean()),
-            'min_reaction_time': float(reaction_times.min().min()),
-            'max_reaction_time': float(reaction_times.max().max()),
-            'median_reaction_time': float(reaction_times.median().median())
-        }
-
-    def _analyze_by_color(self, test_type: str, reaction_times: pd.DataFrame) -> Dict[str, Any]:
-        """Анализ по цветам стимулов"""
-        color_stats = {}
-
-        for stimulus_id in range(1, 37):
-            color = self.metadata.get_stimulus_info(test_type, stimulus_id).color
-            reaction_time = reaction_times[f'Tst{self._get_test_number(test_type)}_{stimulus_id}']
-
-            if color not in color_stats:
-                color_stats[color] = []
-
-            color_stats[color].extend(reaction_time.dropna().tolist())
-
-        # Расчет статистики по цветам
-        result = {}
-        for color, times in color_stats.items():
-            if times:
-                result[color] = {
-                    'mean': np.mean(times),
-                    'std': np.std(times),
-                    'count': len(times)
-                }
-
-        return result
-
-    def _analyze_by_position(self, test_type: str, reaction_times: pd.DataFrame) -> Dict[str, Any]:
-        """Анализ по позициям стимулов"""
-        position_stats = {}
-
-        for stimulus_id in range(1, 37):
-            position = self.metadata.get_stimulus_info(test_type, stimulus_id).position
-            reaction_time = reaction_times[f'Tst{self._get_test_number(test_type)}_{stimulus_id}']
-
-            if position not in position_stats:
-                position_stats[position] = []
-
-            position_stats[position].extend(reaction_time.dropna().tolist())
-
-        # Расчет статистики по позициям
-        result = {}
-        for position, times in position_stats.items():
-            if times:
-                result[position] = {
-                    'mean': np.mean(times),
-                    'std': np.std(times),
-                    'count': len(times)
-                }
-
-        return result
-
-    def _analyze_by_interval(self, test_type: str, reaction_times: pd.DataFrame) -> Dict[str, Any]:
-        """Анализ по предстимульным интервалам"""
-        interval_stats = {}
-
-        for stimulus_id in range(1, 37):
-            interval = self.metadata.get_stimulus_info(test_type, stimulus_id).pre_stimulus_interval
-            reaction_time = reaction_times[f'Tst{self._get_test_number(test_type)}_{stimulus_id}']
-
-            interval_key = f"{interval}ms"
-            if interval_key not in interval_stats:
-                interval_stats[interval_key] = []
-
-            interval_stats[interval_key].extend(reaction_time.dropna().tolist())
-
-        # Расчет статистики по интервалам
-        result = {}
-        for interval, times in interval_stats.items():
-            if times:
-                result[interval] = {
-                    'mean': np.mean(times),
-                    'std': np.std(times),
-                    'count': len(times)
-                }
-
-        return result
+        # Статистики по стимулам (столбцам) с пропуском NaN, затем сводка по ним
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            return {
+                'mean_reaction_time': float(np.nanmean(np.nanmean(reaction_times, axis=0))),
+                'std_reaction_time': float(np.nanmean(np.nanstd(reaction_times, axis=0, ddof=1))),
+                'min_reaction_time': float(np.nanmin(reaction_times)),
+                'max_reaction_time': float(np.nanmax(reaction_times)),
+                'median_reaction_time': float(np.nanmedian(np.nanmedian(reaction_times, axis=0)))
+            }
+
+    def group_stats(self, test_type: str, reaction_times: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Статистика по всем группировкам стимулов (STIMULUS_GROUPINGS) одной таблицей:
+        строка на группу - count, mean, std, median, q25, q75"""
+        if reaction_times is None:
+            reaction_times = self.cube.test_matrix(test_type)
+        index = self.metadata.get_stimulus_index(test_type)
+        groupings = {name: index.codes(*attributes) for name, attributes in STIMULUS_GROUPINGS.items()}
+        return grouped_stats(reaction_times, groupings)
+
+    @staticmethod
+    def _groups_from_table(group_stats: pd.DataFrame, grouping: str) -> Dict[Any, Dict[str, float]]:
+        """Строки группировки из таблицы групповой статистики: {группа: {статистика: значение}}"""
+        rows = group_stats[group_stats['grouping'] == grouping]
+        return {row['group']: {column: (int(value) if column == 'count' else float(value))
+                               for column, value in row.items() if column not in ('grouping', 'group')}
+                for _, row in rows.iterrows()}
 
     def _analyze_errors(self, test_type: str) -> Dict[str, Any]:
         """Анализ ошибок"""
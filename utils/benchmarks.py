@@ -0,0 +1,384 @@
+# utils/benchmarks.py
+"""
+Замеры производительности загрузки и записи данных.
+
+Запуск: python -m utils.benchmarks bulk-writer --scale 20
+        python -m utils.benchmarks migrate-boxbase --scale 20
+        python -m utils.benchmarks reaction-storage --scale 20
+        python -m utils.benchmarks metrics --db neuro_data.db --workers 1 2 4
+        python -m utils.benchmarks group-stats --scale 200
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import json
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from core.bulk_writer import BulkSQLiteWriter
+from core.data_loader import DataLoader
+from core.grouped_stats import GROUP_QUANTILES, grouped_stats
+from core.legacy_migrator import LegacyMigrator
+from core.metrics_engine import METRICS_BATCH_SIZE, MetricsEngine
+from core.reaction_matrix import ReactionTimeCube
+from core.reaction_storage import load_reaction_times, pack_reaction_times
+from core.test_metadata import TestMetadataManager
+from modules.test_analyzer import STIMULUS_GROUPINGS
+
+DEFAULT_BOXBASE = os.path.join('data', 'boxbase_csv.csv')
+DEFAULT_USERS = os.path.join('data', 'users.xlsx')
+
+# Таблицы миграции boxbase и сравниваемые столбцы (без меток времени вставки)
+MIGRATED_TABLES = {
+    'raw_legacy_data': 'id, source_table, original_id, raw_data, schema_id, raw_blob',
+    'testing_sessions': 'id, patient_id, session_date, session_time, systolic_bp, diastolic_bp, '
+                        'conditions, validity, legacy_data_id',
+    'visual_tests': 'id, session_id, test_type, raw_reaction_times, reaction_times_packed, raw_aggregates'
+}
+
+
+def scaled_boxbase(source_path: str = DEFAULT_BOXBASE, scale: int = 20) -> pd.DataFrame:
+    """boxbase, размноженный в scale раз с уникальными cnt (имитация полного архива)"""
+    base = DataLoader().load_boxbase_data(source_path)
+    step = int(base['cnt'].max()) + 1
+    copies = []
+    for i in range(scale):
+        copy = base.copy()
+        copy['cnt'] = base['cnt'].astype('int64') + i * step
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def _timed_write(db_path: str, write) -> float:
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    started = time.perf_counter()
+    write()
+    return time.perf_counter() - started
+
+
+def benchmark_bulk_writer(source_path: str = DEFAULT_BOXBASE, scale: int = 20, repeats: int = 3) -> dict:
+    """Сравнение pandas.to_sql (текущий путь) и BulkSQLiteWriter на размноженном boxbase.
+    В обоих случаях таблица имеет вторичный индекс по REG_ID."""
+    df = scaled_boxbase(source_path, scale)
+    print(f"📊 boxbase x{scale}: {len(df)} строк, {len(df.columns)} столбцов")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'benchmark.db')
+
+        def prepare_table():
+            # Таблица с индексом существует заранее - как после первого импорта
+            with sqlite3.connect(db_path) as conn:
+                df.head(0).to_sql('boxbase', conn, index=False)
+                conn.execute('CREATE INDEX idx_boxbase_reg_id ON boxbase (REG_ID)')
+
+        def write_to_sql():
+            prepare_table()
+            with sqlite3.connect(db_path) as conn:
+                df.to_sql('boxbase', conn, if_exists='append', index=False)
+
+        def write_bulk():
+            prepare_table()
+            with BulkSQLiteWriter(db_path) as writer:
+                writer.write_frame('boxbase', df, if_exists='append')
+
+        results = {}
+        for name, write in (('to_sql', write_to_sql), ('bulk_writer', write_bulk)):
+            best = min(_timed_write(db_path, write) for _ in range(repeats))
+            results[name] = {'seconds': best, 'rows_per_second': len(df) / best}
+            print(f"   • {name}: {best:.2f} с, {len(df) / best:,.0f} строк/с")
+
+        with sqlite3.connect(db_path) as conn:
+            count = conn.execute('SELECT COUNT(*) FROM boxbase').fetchone()[0]
+            indexes = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'boxbase'")]
+        assert count == len(df), f"Записано {count} строк вместо {len(df)}"
+        assert 'idx_boxbase_reg_id' in indexes, "Вторичный индекс не перестроен"
+
+    speedup = results['to_sql']['seconds'] / results['bulk_writer']['seconds']
+    print(f"⚡ Ускорение BulkSQLiteWriter относительно to_sql: x{speedup:.1f}")
+    results['speedup'] = speedup
+    return results
+
+
+def _table_digest(db_path: str, table: str, columns: str) -> str:
+    """SHA-256 содержимого таблицы в порядке id (для сравнения результатов миграции)"""
+    digest = hashlib.sha256()
+    with sqlite3.connect(db_path) as conn:
+        for row in conn.execute(f"SELECT {columns} FROM {table} ORDER BY id"):
+            digest.update(repr(row).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def benchmark_migrate_boxbase(source_path: str = DEFAULT_BOXBASE, users_path: str = DEFAULT_USERS,
+                              scale: int = 20, workers: Optional[int] = None) -> dict:
+    """Построчная (bulk=False) и пакетная миграция boxbase на размноженной выгрузке,
+    с workers - также конвейерная. Проверяется, что все миграции дают одинаковое
+    содержимое таблиц."""
+    raw = LegacyMigrator._read_excel(source_path) if source_path.endswith(('.xlsx', '.xls')) \
+        else pd.read_csv(source_path)
+    step = int(raw['cnt'].max()) + 1
+    scaled = pd.concat([raw.assign(cnt=raw['cnt'] + i * step) for i in range(scale)], ignore_index=True)
+    print(f"📊 boxbase x{scale}: {len(scaled)} сессий")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source_csv = os.path.join(tmp_dir, 'boxbase.csv')
+        scaled.to_csv(source_csv, index=False)
+
+        variants = [('rows', False, None), ('bulk', True, None)]
+        if workers:
+            variants.append(('pipeline', True, workers))
+
+        for name, bulk, variant_workers in variants:
+            db_path = os.path.join(tmp_dir, f'{name}.db')
+            migrator = LegacyMigrator(db_path)
+            # Вывод миграции (в том числе по каждой пропущенной сессии) в замер не попадает
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                migrator.initialize_new_schema()
+                migrator.migrate_patients_from_xlsx(users_path)
+                started = time.perf_counter()
+                migrator.migrate_boxbase_data(source_csv, bulk=bulk, workers=variant_workers)
+                seconds = time.perf_counter() - started
+
+            digests = {table: _table_digest(db_path, table, columns) for table, columns in MIGRATED_TABLES.items()}
+            with sqlite3.connect(db_path) as conn:
+                sessions = conn.execute('SELECT COUNT(*) FROM testing_sessions').fetchone()[0]
+            results[name] = {'seconds': seconds, 'sessions': sessions, 'digests': digests}
+            print(f"   • {name}: {seconds:.2f} с, {sessions / seconds:,.0f} сессий/с")
+            if variant_workers:
+                # Счетчики стадий конвейера
+                report = output.getvalue().splitlines()
+                for line in report[next(i for i, text in enumerate(report) if text.startswith('📈')) + 1:]:
+                    print(f"  {line}")
+
+    for name in results:
+        assert results[name]['digests'] == results['rows']['digests'], f"Результаты миграции {name} различаются"
+
+    speedup = results['rows']['seconds'] / results['bulk']['seconds']
+    print(f"⚡ Ускорение пакетной миграции: x{speedup:.1f} (содержимое таблиц совпадает)")
+    results['speedup'] = speedup
+    return results
+
+
+def benchmark_reaction_storage(source_path: str = DEFAULT_BOXBASE, scale: int = 20, repeats: int = 3) -> dict:
+    """Времена реакции visual_tests: JSON-списки против упакованных int16 BLOB.
+    Сравниваются объем хранения и декодирование всей популяции тестов в матрицу (n, 36)."""
+    cube = ReactionTimeCube.from_boxbase(scaled_boxbase(source_path, scale))
+    matrix = cube.reaction_times.reshape(-1, cube.reaction_times.shape[-1])
+    print(f"📊 boxbase x{scale}: {len(matrix)} тестов")
+
+    json_times = LegacyMigrator._reaction_times_json(matrix)
+    packed = pack_reaction_times(matrix)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'reaction_times.db')
+        with sqlite3.connect(db_path) as conn:
+            conn.execute('CREATE TABLE visual_tests '
+                         '(id INTEGER PRIMARY KEY, test_type TEXT, raw_reaction_times JSON, reaction_times_packed BLOB)')
+            conn.executemany('INSERT INTO visual_tests (id, raw_reaction_times) VALUES (?, ?)',
+                             enumerate(json_times, start=1))
+
+        def decode_json():
+            with sqlite3.connect(db_path) as conn:
+                rows = conn.execute('SELECT raw_reaction_times FROM visual_tests ORDER BY id').fetchall()
+            return np.array([[np.nan if value is None else value for value in json.loads(row[0])] for row in rows],
+                            dtype=np.float32)
+
+        def decode_packed():
+            with sqlite3.connect(db_path) as conn:
+                return load_reaction_times(conn)[1]
+
+        for name, size, decode, prepare in (
+                ('json', sum(len(text.encode('utf-8')) for text in json_times), decode_json, None),
+                ('packed', sum(len(blob) for blob in packed), decode_packed,
+                 'UPDATE visual_tests SET reaction_times_packed = ?, raw_reaction_times = NULL WHERE id = ?')):
+            if prepare:
+                conn = sqlite3.connect(db_path)
+                with conn:
+                    conn.executemany(prepare, zip(packed, range(1, len(packed) + 1)))
+                conn.execute('VACUUM')
+                conn.close()
+            best = float('inf')
+            for _ in range(repeats):
+                started = time.perf_counter()
+                decoded = decode()
+                best = min(best, time.perf_counter() - started)
+            results[name] = {'bytes': size, 'file_bytes': os.path.getsize(db_path), 'seconds': best,
+                             'matrix': decoded}
+            print(f"   • {name}: {size / len(matrix):.0f} байт на тест, файл БД {os.path.getsize(db_path):,} байт, "
+                  f"декодирование {best:.3f} с")
+
+    assert np.array_equal(results['json'].pop('matrix'), results['packed'].pop('matrix'), equal_nan=True), \
+        "Декодированные матрицы различаются"
+
+    results['size_ratio'] = results['json']['bytes'] / results['packed']['bytes']
+    results['speedup'] = results['json']['seconds'] / results['packed']['seconds']
+    print(f"⚡ Объем x{results['size_ratio']:.1f} меньше, декодирование x{results['speedup']:.1f} быстрее "
+          f"(матрицы совпадают)")
+    return results
+
+
+def _metrics_digest(db_path: str) -> str:
+    """SHA-256 рассчитанных метрик в порядке id без меток времени расчета"""
+    digest = hashlib.sha256()
+    with sqlite3.connect(db_path) as conn:
+        for test_id, metrics, processed in conn.execute(
+                'SELECT id, calculated_metrics, is_processed FROM visual_tests ORDER BY id'):
+            values = json.loads(metrics) if metrics else None
+            if isinstance(values, dict):
+                values.pop('calculation_timestamp', None)
+            digest.update(repr((test_id, values, processed)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def benchmark_metrics(db_path: str = 'neuro_data.db', workers: Sequence[int] = (1, 2, 4),
+                      batch_size: int = METRICS_BATCH_SIZE) -> dict:
+    """Пересчет метрик visual_tests копии базы при разном числе процессов.
+    Проверяется, что результат совпадает с последовательным расчетом."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for count in sorted(set([1, *workers])):
+            copy_path = os.path.join(tmp_dir, f'metrics_{count}.db')
+            shutil.copyfile(db_path, copy_path)
+            with sqlite3.connect(copy_path) as conn:
+                conn.execute('UPDATE visual_tests SET calculated_metrics = NULL, is_processed = FALSE, '
+                             'processed_at = NULL')
+                tests = conn.execute('SELECT COUNT(*) FROM visual_tests').fetchone()[0]
+
+            engine = MetricsEngine(copy_path, batch_size, workers=count)
+            started = time.perf_counter()
+            report = engine.run()
+            seconds = time.perf_counter() - started
+            results[count] = {'seconds': seconds, 'tests': tests, 'processed': report.processed,
+                              'digest': _metrics_digest(copy_path)}
+
+    print(f"📊 Пересчет метрик: {tests} тестов, ядер: {os.cpu_count()}")
+    serial = results[1]['seconds']
+    for count, result in results.items():
+        assert result['digest'] == results[1]['digest'], f"Метрики при {count} процессах отличаются"
+        speedup = serial / result['seconds']
+        result['speedup'] = speedup
+        print(f"   • процессов {count}: {result['seconds']:.2f} с, {result['tests'] / result['seconds']:,.0f} тестов/с, "
+              f"ускорение x{speedup:.2f}, эффективность {speedup / count:.0%}")
+    print("⚡ Метрики совпадают с последовательным расчетом")
+    return results
+
+
+def _group_stats_by_lists(matrix: np.ndarray, groupings: dict) -> list:
+    """Прежний способ: значения стимулов собираются в списки групп, статистики - по спискам"""
+    quantiles = [0.5, *GROUP_QUANTILES]
+    rows = []
+    for name, (keys, codes) in groupings.items():
+        values = {key: [] for key in keys}
+        for column, code in enumerate(codes):
+            times = matrix[:, column]
+            values[keys[code]].extend(times[~np.isnan(times)].tolist())
+        rows.extend((name, key, len(times), np.mean(times), np.std(times), *np.quantile(times, quantiles))
+                    for key, times in values.items() if times)
+    return rows
+
+
+def _group_stats_by_columns(matrix: np.ndarray, groupings: dict) -> list:
+    """Выборка столбцов группы из матрицы отдельно для каждой группы каждой группировки"""
+    quantiles = [0.5, *GROUP_QUANTILES]
+    rows = []
+    for name, (keys, codes) in groupings.items():
+        for code, key in enumerate(keys):
+            times = matrix[:, codes == code]
+            times = times[~np.isnan(times)].astype(np.float64)
+            if times.size:
+                rows.append((name, key, times.size, times.mean(), times.std(), *np.quantile(times, quantiles)))
+    return rows
+
+
+def benchmark_group_stats(source_path: str = DEFAULT_BOXBASE, scale: int = 200, repeats: int = 3,
+                          test_type: str = 'simple') -> dict:
+    """Групповая статистика TestAnalyzer (группировки STIMULUS_GROUPINGS): ядро grouped_stats
+    против списков по стимулам и против выборки столбцов для каждой группы"""
+    matrix = ReactionTimeCube.from_boxbase(scaled_boxbase(source_path, scale)).test_matrix(test_type)
+    index = TestMetadataManager().get_stimulus_index(test_type)
+    groupings = {name: index.codes(*attributes) for name, attributes in STIMULUS_GROUPINGS.items()}
+    print(f"📊 boxbase x{scale}: {len(matrix)} сессий, тест {test_type}")
+
+    results = {}
+    for name, compute in (('lists', lambda: _group_stats_by_lists(matrix, groupings)),
+                          ('columns', lambda: _group_stats_by_columns(matrix, groupings)),
+                          ('kernel', lambda: grouped_stats(matrix, groupings))):
+        best = float('inf')
+        # Списки по стимулам медленные - один повтор
+        for _ in range(1 if name == 'lists' else repeats):
+            started = time.perf_counter()
+            table = compute()
+            best = min(best, time.perf_counter() - started)
+        results[name] = {'seconds': best, 'table': table}
+        print(f"   • {name}: {best:.3f} с")
+
+    kernel = results['kernel'].pop('table')
+    for name in ('lists', 'columns'):
+        expected = pd.DataFrame(results[name].pop('table'), columns=kernel.columns)
+        assert expected['group'].tolist() == kernel['group'].tolist() and np.allclose(
+            expected.iloc[:, 2:].to_numpy(float), kernel.iloc[:, 2:].to_numpy(float)), \
+            f"Статистики ядра и способа {name} различаются"
+        results[name]['speedup'] = results[name]['seconds'] / results['kernel']['seconds']
+    print(f"⚡ Ядро быстрее списков x{results['lists']['speedup']:.0f}, "
+          f"выборки столбцов x{results['columns']['speedup']:.1f} (статистики совпадают)")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры производительности NeuroTransAnalytics')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    bulk_parser = subparsers.add_parser('bulk-writer', help='BulkSQLiteWriter против pandas.to_sql')
+    bulk_parser.add_argument('--source', default=DEFAULT_BOXBASE, help='Исходный boxbase (CSV/Excel)')
+    bulk_parser.add_argument('--scale', type=int, default=20, help='Во сколько раз размножить boxbase')
+    bulk_parser.add_argument('--repeats', type=int, default=3, help='Число повторов (берется лучший)')
+
+    migrate_parser = subparsers.add_parser('migrate-boxbase', help='Пакетная миграция boxbase против построчной')
+    migrate_parser.add_argument('--source', default=DEFAULT_BOXBASE, help='Исходный boxbase (CSV/Excel)')
+    migrate_parser.add_argument('--users', default=DEFAULT_USERS, help='Файл пациентов users.xlsx')
+    migrate_parser.add_argument('--scale', type=int, default=20, help='Во сколько раз размножить boxbase')
+    migrate_parser.add_argument('--workers', type=int, help='Также замерить конвейер с N процессами подготовки')
+
+    storage_parser = subparsers.add_parser('reaction-storage', help='Времена реакции: JSON против int16 BLOB')
+    storage_parser.add_argument('--source', default=DEFAULT_BOXBASE, help='Исходный boxbase (CSV/Excel)')
+    storage_parser.add_argument('--scale', type=int, default=20, help='Во сколько раз размножить boxbase')
+    storage_parser.add_argument('--repeats', type=int, default=3, help='Число повторов (берется лучший)')
+
+    metrics_parser = subparsers.add_parser('metrics', help='Пересчет метрик: масштабирование по числу процессов')
+    metrics_parser.add_argument('--db', default='neuro_data.db', help='База с visual_tests (копируется)')
+    metrics_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Число процессов')
+    metrics_parser.add_argument('--batch-size', type=int, default=METRICS_BATCH_SIZE, help='Тестов в диапазоне id')
+
+    group_parser = subparsers.add_parser('group-stats', help='Групповая статистика TestAnalyzer: ядро против циклов')
+    group_parser.add_argument('--source', default=DEFAULT_BOXBASE, help='Исходный boxbase (CSV/Excel)')
+    group_parser.add_argument('--scale', type=int, default=200, help='Во сколько раз размножить boxbase')
+    group_parser.add_argument('--repeats', type=int, default=3, help='Число повторов (берется лучший)')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'bulk-writer':
+        benchmark_bulk_writer(args.source, args.scale, args.repeats)
+    elif args.benchmark == 'migrate-boxbase':
+        benchmark_migrate_boxbase(args.source, args.users, args.scale, args.workers)
+    elif args.benchmark == 'reaction-storage':
+        benchmark_reaction_storage(args.source, args.scale, args.repeats)
+    elif args.benchmark == 'metrics':
+        benchmark_metrics(args.db, args.workers, args.batch_size)
+    elif args.benchmark == 'group-stats':
+        benchmark_group_stats(args.source, args.scale, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
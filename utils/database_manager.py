@@ -1,28 +1,119 @@
 # utils/database_manager.py
 import argparse
+import sqlite3
 from core.legacy_migrator import LegacyMigrator
 from core.neuro_analyzer import NeurotransmitterAnalyzer
+from core.data_loader import DataLoader
+from core.ingestion import ConcurrentIngestor, IngestionTask
+from core.import_manifest import ImportManifest
+from core.legacy_archive import LegacyArchive
+from core.event_tables import EventTableBuilder, event_tables_current
+from core.migration_checkpoint import CheckpointStore
+from core.reaction_storage import migrate_reaction_times_to_packed
 
 
 def main():
     parser = argparse.ArgumentParser(description='Управление базой данных NeuroTransAnalytics')
     parser.add_argument('--migrate', action='store_true', help='Запустить миграцию данных')
+    parser.add_argument('--migrate-workers', type=int,
+                        help='Миграция boxbase конвейером: N процессов подготовки и один писатель')
+    parser.add_argument('--resume', action='store_true',
+                        help='Продолжить прерванную миграцию с последней контрольной точки')
     parser.add_argument('--analyze', action='store_true', help='Пересчитать аналитические метрики')
+    parser.add_argument('--analyze-plan', action='store_true',
+                        help='Показать, сколько тестов будет пересчитано и почему, без расчета')
+    parser.add_argument('--analyze-workers', type=int,
+                        help='Пересчет метрик в N процессах (диапазоны id, один писатель)')
     parser.add_argument('--backup', help='Создать бэкап базы данных')
+    parser.add_argument('--import-access', metavar='MDB_PATH',
+                        help='Перенести users/boxbase из Access в SQLite (без ODBC-драйвера - через mdbtools)')
+    parser.add_argument('--ingest-users', metavar='USERS_PATH', help='Файл users для параллельной загрузки')
+    parser.add_argument('--ingest-boxbase', metavar='BOXBASE_PATH', nargs='+',
+                        help='Один или несколько файлов boxbase для параллельной загрузки')
+    parser.add_argument('--workers', type=int, help='Число процессов для параллельной загрузки')
+    parser.add_argument('--force', action='store_true',
+                        help='Загружать файлы заново, даже если они не изменились с прошлого импорта')
+    parser.add_argument('--pack-reaction-times', action='store_true',
+                        help='Перевести времена реакции visual_tests из JSON в упакованный int16 BLOB')
+    parser.add_argument('--compress-raw', action='store_true',
+                        help='Сжать исходные строки raw_legacy_data, записанные JSON-текстом')
+    parser.add_argument('--build-events', action='store_true',
+                        help='Построить таблицы событий stimulus_events/response_events из visual_tests')
 
     args = parser.parse_args()
 
     if args.migrate:
         print("Запуск миграции...")
         migrator = LegacyMigrator()
-        migrator.initialize_new_schema()
+        if args.resume and CheckpointStore.has_progress(migrator.db_path):
+            print("Продолжение с последней контрольной точки")
+        else:
+            migrator.initialize_new_schema()
         migrator.migrate_patients_from_xlsx('data/users.xlsx')
-        migrator.migrate_boxbase_data('data/boxbase.csv')
+        migrator.migrate_boxbase_data('data/boxbase.csv', workers=args.migrate_workers)
+
+    if args.pack_reaction_times:
+        print("Упаковка времен реакции...")
+        stats = migrate_reaction_times_to_packed()
+        print(f"   • упаковано тестов: {stats['packed']}, оставлено в JSON: {stats['kept_json']}")
+
+    if args.compress_raw:
+        print("Сжатие архива исходных строк...")
+        stats = LegacyArchive().compress_existing()
+        print(f"   • сжато строк: {stats['compressed']}, "
+              f"{stats['bytes_before']:,} -> {stats['bytes_after']:,} байт")
+
+    if args.build_events:
+        print("Построение таблиц событий...")
+        stats = EventTableBuilder().build()
+        print(f"   • тестов: {stats['tests']}, стимулов: {stats['stimulus_events']}, "
+              f"реакций: {stats['response_events']}")
+
+    if args.import_access:
+        print(f"Импорт Access: {args.import_access}")
+        row_counts = DataLoader().extract_access_to_sqlite(args.import_access)
+        for table_name, count in row_counts.items():
+            print(f"   • {table_name}: {count} строк")
+
+    if args.ingest_users or args.ingest_boxbase:
+        tasks = []
+        if args.ingest_users:
+            tasks.append(IngestionTask('users', args.ingest_users))
+        tasks.extend(IngestionTask('boxbase', file_path) for file_path in args.ingest_boxbase or [])
+
+        print(f"Параллельная загрузка: {len(tasks)} файлов")
+        manifest = None if args.force else ImportManifest()
+        ingestor = ConcurrentIngestor(max_workers=args.workers, manifest=manifest)
+
+        def on_progress(progress):
+            eta = progress.eta_seconds
+            eta_text = f", осталось ~{eta:.0f} с" if eta is not None and progress.status == 'running' else ""
+            print(f"   {progress.file_path}: {progress.rows_parsed} строк, "
+                  f"{progress.fraction:.0%}{eta_text} [{progress.status}]")
+
+        frames = ingestor.run(tasks, on_progress=on_progress)
+        ingestor.write_to_sqlite(frames)
+        for data_type, df in frames.items():
+            print(f"   • {data_type}: {len(df)} строк")
+        for file_path, error in ingestor.errors.items():
+            print(f"   ❌ {file_path}: {error}")
+
+    if args.analyze_plan:
+        analyzer = NeurotransmitterAnalyzer()
+        plan = analyzer.plan_metrics()
+        print(plan.describe())
+        print(f"   • версия метаданных: {plan.metadata_version}")
+        conn = sqlite3.connect(analyzer.db_path)
+        try:
+            state = "актуальны" if event_tables_current(conn) else "не построены или устарели"
+        finally:
+            conn.close()
+        print(f"   • таблицы событий: {state}")
 
     if args.analyze:
         print("Пересчет метрик...")
         analyzer = NeurotransmitterAnalyzer()
-        analyzer.calculate_all_metrics()
+        analyzer.calculate_all_metrics(workers=args.analyze_workers)
 
     print("Операция завершена")
 
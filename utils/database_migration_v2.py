@@ -147,7 +147,8 @@ class DatabaseMigrationV2:
             cursor.execute("DELETE FROM testing_system_parameters")
 
             # Импортируем и используем полные данные из core.test_metadata
-            from core.test_metadata import metadata_manager, SYSTEM_PARAMETERS
+            from core.test_metadata import get_metadata_manager, SYSTEM_PARAMETERS, TestMetadataManager
+            from core.bulk_writer import BulkSQLiteWriter
 
             # Используем системные параметры из core.test_metadata
             system_parameters = [
@@ -162,15 +163,16 @@ class DatabaseMigrationV2:
                 ("CIRCLE_COUNT", "3", "Количество кругов в интерфейсе")
             ]
 
+            # Запись идет на соединении вызывающего кода, транзакцией управляет он
+            writer = BulkSQLiteWriter(connection=conn, import_pragmas=False)
+
             # Вставить системные параметры
-            for param_name, param_value, description in system_parameters:
-                cursor.execute("""
-                    INSERT OR REPLACE INTO testing_system_parameters 
-                    (parameter_name, parameter_value, description)
-                    VALUES (?, ?, ?)
-                """, (param_name, param_value, description))
-
-            # Вставить полные данные всех трех тестов из metadata_manager
+            writer.insert_rows('testing_system_parameters',
+                               ['parameter_name', 'parameter_value', 'description'],
+                               system_parameters, conflict='REPLACE')
+
+            # Вставить полные данные всех трех тестов из общего менеджера метаданных
+            metadata_manager = get_metadata_manager()
             all_test_data = []
             test_types = ["simple", "color_red", "shift"]
 
@@ -189,17 +191,22 @@ class DatabaseMigrationV2:
                         ))
 
             # Вставить все тестовые данные
-            for test_data in all_test_data:
-                cursor.execute("""
-                    INSERT OR REPLACE INTO test_metadata 
-                    (test_type, stimulus_number, color, position, prestimulus_interval, circle_sequence, shift_parameter)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, test_data)
+            writer.insert_rows('test_metadata',
+                               ['test_type', 'stimulus_number', 'color', 'position',
+                                'prestimulus_interval', 'circle_sequence', 'shift_parameter'],
+                               all_test_data, conflict='REPLACE')
+
+            # Версия метаданных - хэш содержимого в том виде, в каком его загрузит менеджер;
+            # результаты анализаторов с другой версией считаются устаревшими
+            stored = TestMetadataManager()
+            stored.load_from_database(conn)
+            stored.save_version(conn)
 
             conn.commit()
 
             # Логируем детальную статистику
-            logger.info(f"✅ Метаданные заполнены: {len(all_test_data)} стимулов, {len(system_parameters)} параметров")
+            logger.info(f"✅ Метаданные заполнены: {len(all_test_data)} стимулов, {len(system_parameters)} параметров, "
+                        f"версия {stored.content_hash}")
 
             for test_type in test_types:
                 cursor.execute("SELECT COUNT(*) FROM test_metadata WHERE test_type = ?", (test_type,))